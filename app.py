@@ -4,36 +4,319 @@ IPTV Transcoder Manager - النظام المتكامل
 """
 
 import os
+import re
 import sys
 import json
 import time
 import signal
+import fcntl
+import random
+import heapq
+import inspect
+import glob
+import math
 import logging
+import selectors
 import subprocess
 import threading
+import uuid
+import hashlib
+import shutil
+import copy
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta
-from flask import Flask, render_template, jsonify, request, session, redirect, url_for
+from functools import lru_cache, wraps
+from flask import Flask, render_template, jsonify, request, session, redirect, url_for, g
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_cors import CORS
 from apscheduler.schedulers.background import BackgroundScheduler
 import psutil
 
+from channel_store import ChannelStore
+from metrics_store import TimeSeriesStore
+from metrics_exporter import Registry, Gauge, WorkerAggregator
+from port_allocator import OutputAllocator, DEFAULT_OUTPUT_POOLS
+from schedule_engine import ScheduleEngine, CompiledSchedule
+from profiler import SamplingProfiler, ProfilerBusy, PROFILE_DEFAULT_INTERVAL
+from source_probe import SourceProber, ENCODE_MODES, choose_mode, input_hints, parse_bitrate
+from encoder_profiles import (DEFAULT_PROFILE, load_profiles, load_benchmarks, resolve_profile,
+                              video_args, audio_args)
+
 # إعدادات المسارات
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CONFIG_DIR = os.path.join(BASE_DIR, 'etc')
 LOG_DIR = os.path.join(BASE_DIR, 'logs')
 PROCESS_DIR = os.path.join(BASE_DIR, 'processes')
+BACKUP_DIR = os.path.join(BASE_DIR, 'backups')
+SECRET_KEY_FILE = os.environ.get('IPTV_SECRET_KEY_FILE', os.path.join(CONFIG_DIR, 'secret_key'))
+CHANNELS_DB = os.path.join(CONFIG_DIR, 'channels.db')
+
+# لقطات القنوات المجدولة: الفاصل (ساعات) وعدد اللقطات المحتفظ بها
+SNAPSHOT_INTERVAL_HOURS = int(os.environ.get('IPTV_SNAPSHOT_INTERVAL_HOURS', 6))
+SNAPSHOT_RETENTION = int(os.environ.get('IPTV_SNAPSHOT_RETENTION', 28))
+
+# استيراد قوائم M3U: حجم دفعة القراءة وعدد القنوات بين تقارير التقدم
+IMPORT_CHUNK_SIZE = 64 * 1024
+IMPORT_PROGRESS_EVERY = 500
+# مزامنة قائمة المزود الدورية: تعمل فقط عند ضبط IPTV_PLAYLIST_URL (0 دقائق = معطلة)
+PLAYLIST_URL = os.environ.get('IPTV_PLAYLIST_URL', '')
+PLAYLIST_SYNC_MINUTES = int(os.environ.get('IPTV_PLAYLIST_SYNC_MINUTES', 60))
+EXTINF_ATTR_RE = re.compile(r'([\w-]+)="([^"]*)"')
+RESOLUTION_RE = re.compile(r'^\d+x\d+$')
+# حقول القناة التي يُبنى منها argv الـ FFmpeg (بصمتها مفتاح ذاكرة argv)
+ARGV_FIELDS = ('source_url', 'transcode', 'output', 'renditions', 'profile', 'encode_mode', 'input_hints')
+# مجمعات مخارج القنوات الجديدة (عناوين:منافذ، مفصولة بفواصل)
+OUTPUT_POOLS = os.environ.get('IPTV_OUTPUT_POOLS', DEFAULT_OUTPUT_POOLS)
+# تحديث فحوصات المصادر (ffprobe) للقنوات المفعلة في الوضع التلقائي قبل انتهاء صلاحيتها
+PROBE_REFRESH_MINUTES = int(os.environ.get('IPTV_PROBE_REFRESH_MINUTES', 30))
+
+# قراءة السجلات: عدد الأسطر الافتراضي والأقصى لكل طلب، وفترة متابعة السجلات الحية
+LOG_TAIL_LINES = 100
+LOG_TAIL_MAX_LINES = 2000
+LOG_FOLLOW_INTERVAL = 1.0
+LOG_FOLLOW_MAX_BYTES = 64 * 1024    # أقصى ما يُرسل لكل سجل في كل دورة
+
+# تقدم FFmpeg (-progress): فترة التقرير، عدد العينات المحفوظة لكل قناة، وحدود الصحة
+PROGRESS_PERIOD = float(os.environ.get('IPTV_PROGRESS_PERIOD', 1))
+PROGRESS_HISTORY = 300
+PROGRESS_MIN_SPEED = 0.95           # أبطأ من الزمن الحقيقي = البث يتأخر
+PROGRESS_DROP_WINDOW = 10           # عينات لحساب ازدياد الإطارات المُسقطة
+# سعة أنبوب التقدم المسمى: ما يستوعبه من تقدم FFmpeg أثناء إعادة تشغيل المدير قبل أن تتعطل كتابته
+PROGRESS_PIPE_SIZE = int(os.environ.get('IPTV_PROGRESS_PIPE_SIZE', 1024 * 1024))
+
+# مراقب التجمد: ثوانٍ بلا تقدم في المخرج قبل قتل العملية وإعادة تشغيلها (0 = معطل)
+STALL_TIMEOUT = float(os.environ.get('IPTV_STALL_TIMEOUT', 5))
+STALL_STARTUP_GRACE = 20            # مهلة الاتصال بالمصدر قبل أول تقدم
+WATCHDOG_INTERVAL = 1
+
+# فترة أخذ عينات إحصائيات عمليات FFmpeg (ثواني)
+STATS_SAMPLE_INTERVAL = 5
+# فترة عينات النظام لمخزن السلاسل الزمنية (ثواني)
+SYSTEM_SAMPLE_INTERVAL = 1
+
+# سياسة إعادة التشغيل التلقائي عند انهيار القناة
+RESTART_BACKOFF_BASE = 2        # ثواني، تتضاعف مع كل انهيار متتالي
+RESTART_BACKOFF_MAX = 300
+CRASH_LOOP_WINDOW = 600         # نافذة عدّ الانهيارات (ثواني)
+CRASH_LOOP_THRESHOLD = 5        # عدد الانهيارات داخل النافذة قبل إيقاف المحاولات
+
+# مهلة انتظار خروج FFmpeg بعد SIGTERM قبل SIGKILL (ثواني)
+STOP_TIMEOUT = 5
+
+# العمليات المجمّعة: حجم مجمع العمال والحد الافتراضي للتوازي لكل مهمة
+BATCH_MAX_WORKERS = int(os.environ.get('IPTV_BATCH_WORKERS', 32))
+BATCH_DEFAULT_CONCURRENCY = int(os.environ.get('IPTV_BATCH_CONCURRENCY', 8))
+BATCH_JOBS_RETAINED = 50
+
+# طابور التشغيل: معدل التشغيل (دلو الرموز) وسقف القنوات في مرحلة الإحماء
+START_RATE = float(os.environ.get('IPTV_START_RATE', 2))          # تشغيل في الثانية
+START_BURST = int(os.environ.get('IPTV_START_BURST', 4))
+MAX_WARMING_CHANNELS = int(os.environ.get('IPTV_MAX_WARMING', 8))
+WARMUP_SECONDS = 15
+START_REQUEST_TIMEOUT = 30     # انتظار التشغيل اليدوي في الطابور قبل الرد بأنه ما زال منتظراً
+
+# نموذج السعة: نسبة الأنوية المسموح بها للتحويل وكلفة البداية قبل القياس
+CPU_BUDGET_RATIO = float(os.environ.get('IPTV_CPU_BUDGET', 0.85))
+DEFAULT_TRANSCODE_COST = 0.5    # أنوية لقناة SD (720x576) قبل وجود قياسات
+DEFAULT_COPY_COST = 0.05
+DEFAULT_AUDIO_COST = 0.1      # نسخ الفيديو وترميز الصوت فقط
+COST_EWMA_ALPHA = 0.2
+CAPACITY_RETRY_SECONDS = 10     # إعادة محاولة تشغيل مؤجل لعدم توفر السعة
+
+# دور العملية: all = عملية واحدة (افتراضي)، controller = المتحكم الذي يملك القنوات وFFmpeg،
+# web = عامل واجهة فقط يستدعي المتحكم عبر مقبس Unix (يمكن تشغيل عدة عمال)
+IPTV_ROLE = os.environ.get('IPTV_ROLE', 'all')
+CONTROL_SOCKET = os.environ.get('IPTV_CONTROL_SOCKET', os.path.join(PROCESS_DIR, 'controller.sock'))
+# نمط التزامن: gevent/eventlet لعمال الويب فقط (آلاف المقابس بدون خيط لكل عميل)،
+# أما المتحكم فيبقى بالخيوط لأنه يدير العمليات والمراقب المركزي
+ASYNC_MODE = os.environ.get('IPTV_ASYNC_MODE', 'threading') if IPTV_ROLE == 'web' else 'threading'
+# طابور الرسائل المشترك لأحداث SocketIO بين المتحكم والعمال (مثال: redis://127.0.0.1:6379/0)
+MESSAGE_QUEUE = os.environ.get('IPTV_MESSAGE_QUEUE') or None
+
+# نقطة /metrics لـ Prometheus (بدون جلسة دخول): رمز Bearer، وبدونه تُخدم للطلبات المحلية المباشرة فقط
+METRICS_TOKEN = os.environ.get('IPTV_METRICS_TOKEN')
+# قياس زمن المسارات ودوال المدير الساخنة (عند التعطيل لا يُغلف شيء أصلاً)
+INSTRUMENT = os.environ.get('IPTV_INSTRUMENT', '1') != '0'
+# كل عامل ويب يدفع فروق مقاييسه إلى المتحكم بهذه الفترة (/metrics واحد لكل العمال)
+WEB_METRICS_PUSH_SECONDS = 5
+SPAWN_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+STOP_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 7.5, 10)
+QUEUE_WAIT_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# أولويات التشغيل (الأصغر أولاً)
+PRIORITY_MANUAL = -1     # تشغيل يدوي من الواجهة: قبل كل الطابور لكن بنفس حد المعدل
+PRIORITY_FLAGGED = 0     # قنوات مميزة من المدير
+PRIORITY_AUTO_START = 1
+PRIORITY_DEFAULT = 2
+
+def load_secret_key():
+    """IPTV_SECRET_KEY أو ملف المفتاح الذي يولده install.sh؛ عمال الويب لا يبدؤون بدونه"""
+    key = os.environ.get('IPTV_SECRET_KEY')
+    if not key:
+        try:
+            with open(SECRET_KEY_FILE) as f:
+                key = f.read().strip()
+        except FileNotFoundError:
+            key = None
+    if key == 'change-me':
+        raise RuntimeError('IPTV_SECRET_KEY ما زال القيمة الافتراضية change-me: ولّد مفتاحاً خاصاً بهذا التثبيت')
+    if key:
+        return key
+    if IPTV_ROLE == 'web':
+        raise RuntimeError(f'لا يوجد مفتاح جلسات: اضبط IPTV_SECRET_KEY أو أنشئ {SECRET_KEY_FILE}')
+    return os.urandom(24)   # عملية واحدة: مفتاح عشوائي يكفي (الجلسات تنتهي بإعادة التشغيل)
 
 # تهيئة Flask
 app = Flask(__name__)
-app.secret_key = os.urandom(24)
+# مفتاح ثابت مشترك بين العمال، وإلا فكل عامل يرفض جلسات غيره
+app.secret_key = load_secret_key()
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=24)
 
 # تهيئة SocketIO للاتصال المباشر
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=ASYNC_MODE, message_queue=MESSAGE_QUEUE)
 CORS(app)
 
+def run_blocking(func, *args, **kwargs):
+    """تنفيذ استدعاء حاجب (ملفات، عمليات) في مجمع خيوط النظام حتى لا يوقف حلقة gevent/eventlet"""
+    if ASYNC_MODE == 'gevent':
+        import gevent
+        return gevent.get_hub().threadpool.apply(func, args, kwargs)
+    if ASYNC_MODE == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(func, *args, **kwargs)
+    return func(*args, **kwargs)
+
+@lru_cache(maxsize=1)
+def ffmpeg_version():
+    """السطر الأول من ffmpeg -version (يُفحص مرة واحدة)"""
+    try:
+        output = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True, timeout=10).stdout
+        return output.split('\n', 1)[0]
+    except (OSError, subprocess.TimeoutExpired):
+        return ''
+
+# مقاييس Prometheus: سجل للمتحكم (القنوات والجدولة) وسجل لكل عامل ويب (الطلبات والمقابس)
+# تُدفع فروقه إلى المتحكم ويُجمع هناك
+# كلها عدادات في الذاكرة؛ القراءة لا تستدعي psutil ولا النظام
+CONTROL_METRICS = Registry()
+CHANNEL_RESTARTS = CONTROL_METRICS.counter(
+    'iptv_channel_restarts_total', 'Automatic channel restarts after a crash or stall', ['channel'])
+CHANNEL_STALLS = CONTROL_METRICS.counter(
+    'iptv_channel_stalls_total', 'FFmpeg processes killed by the stall watchdog', ['channel'])
+CHANNEL_START_SECONDS = CONTROL_METRICS.histogram(
+    'iptv_channel_start_seconds', 'Time to admit and spawn FFmpeg in start_channel', buckets=SPAWN_BUCKETS)
+CHANNEL_STOP_SECONDS = CONTROL_METRICS.histogram(
+    'iptv_channel_stop_seconds', 'Time from stop request until FFmpeg exited', buckets=STOP_BUCKETS)
+START_QUEUE_WAIT_SECONDS = CONTROL_METRICS.histogram(
+    'iptv_start_queue_wait_seconds', 'Time a channel waited in the start queue', buckets=QUEUE_WAIT_BUCKETS)
+SCHEDULER_JOB_SECONDS = CONTROL_METRICS.histogram(
+    'iptv_scheduler_job_duration_seconds', 'Duration of scheduler jobs', ['job'])
+MANAGER_CALL_SECONDS = CONTROL_METRICS.histogram(
+    'iptv_manager_call_seconds', 'Duration of instrumented ChannelManager methods', ['method'])
+
+WEB_METRICS = Registry()
+HTTP_REQUEST_SECONDS = WEB_METRICS.histogram(
+    'iptv_http_request_duration_seconds', 'HTTP request latency by route', ['method', 'route', 'status'])
+SOCKETIO_CLIENTS = WEB_METRICS.gauge(
+    'iptv_socketio_clients', 'Connected SocketIO clients')
+_metrics_pusher_pid = None
+
+def timed_call(histogram, func, **labels):
+    """تغليف دالة لتسجيل مدة كل استدعاء في مدرج (المولدات: حتى استنفادها)"""
+    if inspect.isgeneratorfunction(func):
+        @wraps(func)
+        def run_generator(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                yield from func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, **labels)
+        return run_generator
+    
+    @wraps(func)
+    def run(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started, **labels)
+    return run
+
+def instrumented(func):
+    """مزخرف لدوال المدير الساخنة: مدرج زمن لكل دالة، أو الدالة نفسها إذا عُطل القياس"""
+    if not INSTRUMENT:
+        return func
+    return timed_call(MANAGER_CALL_SECONDS, func, method=func.__name__)
+
+profiler = SamplingProfiler()
+
+def capture_profile(seconds, interval, idle=False):
+    """التقاط عينات هذه العملية بصيغة نتيجة موحدة"""
+    try:
+        logger.info(f"بدء التقاط عينات الأداء لمدة {seconds} ثانية")
+        return {'success': True, **profiler.capture(seconds, interval, idle)}
+    except ProfilerBusy as e:
+        return {'success': False, 'reason': 'busy', 'message': str(e)}
+
+def open_progress_fifo(path):
+    """أنبوب مسمى جديد لتقدم عملية: (طرف قراءة المدير، طرف كتابة العملية، طرف قراءة تحمله العملية)"""
+    try:
+        os.unlink(path)     # عملية سابقة ما زالت تكتب تبقى على الأنبوب القديم
+    except FileNotFoundError:
+        pass
+    os.mkfifo(path, 0o600)
+    reader = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+    writer = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+    os.set_blocking(writer, True)
+    keepalive = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+    try:
+        fcntl.fcntl(writer, fcntl.F_SETPIPE_SZ, PROGRESS_PIPE_SIZE)
+    except (AttributeError, OSError):
+        pass    # أكبر من fs.pipe-max-size أو تجاوز حصة المستخدم: تبقى السعة الافتراضية
+    return reader, writer, keepalive
+
+def open_progress_reader(path):
+    """إعادة فتح أنبوب تقدم عملية حية (بعد إعادة تشغيل المدير)، أو None إن لم يوجد"""
+    try:
+        return os.fdopen(os.open(path, os.O_RDONLY | os.O_NONBLOCK), 'rb', buffering=0)
+    except OSError:
+        return None
+
+def spawn_process(argv, log_file, cpus=None, progress_fifo=None):
+    """تشغيل عملية مباشرة بدون صدفة: stderr إلى ملف السجل، stdout أنبوب، وجلسة مستقلة
+
+    بدون preexec_fn يستطيع subprocess استخدام vfork فلا تُنسخ ذاكرة المدير. التثبيت على الأنوية
+    يورثه الابن من الخيط المنادي، فيُضبط قناع هذا الخيط مؤقتاً حول التشغيل.
+    
+    مع progress_fifo يكون stdout أنبوباً مسمى يعيد المدير التالي فتحه، وتحمل العملية طرف قراءة منه
+    فلا تتلقى SIGPIPE إذا خرج المدير؛ يتراكم التقدم في الأنبوب حتى يعود من يقرؤه.
+    """
+    log_fd = os.open(log_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    stdout, pass_fds, reader, child_fds = subprocess.PIPE, (), None, ()
+    inherited = None
+    try:
+        if progress_fifo:
+            reader, writer, keepalive = open_progress_fifo(progress_fifo)
+            stdout, pass_fds, child_fds = writer, (keepalive,), (writer, keepalive)
+        if cpus:
+            inherited = os.sched_getaffinity(0)
+            os.sched_setaffinity(0, cpus)
+        process = subprocess.Popen(argv, stdin=subprocess.DEVNULL, stdout=stdout, stderr=log_fd,
+                                   pass_fds=pass_fds, start_new_session=True)
+        if reader is not None:
+            process.stdout, reader = os.fdopen(reader, 'rb', buffering=0), None
+        return process
+    finally:
+        if inherited is not None:
+            os.sched_setaffinity(0, inherited)
+        os.close(log_fd)
+        for fd in child_fds:
+            os.close(fd)
+        if reader is not None:
+            os.close(reader)
+
 # تهيئة Flask-Login
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -66,177 +349,1511 @@ logging.basicConfig(
 )
 logger = logging.getLogger('IPTV-Manager')
 
+def channel_log_path(channel_id):
+    """مسار سجل القناة ('system' = سجل النظام)"""
+    if channel_id == 'system':
+        return os.path.join(LOG_DIR, 'system.log')
+    return os.path.join(LOG_DIR, f"channel_{channel_id}.log")
+
+def channel_pid_path(channel_id):
+    """ملف PID القناة: "pid create_time" للتحقق من هوية العملية بعد إعادة تشغيل المدير"""
+    return os.path.join(PROCESS_DIR, f"channel_{channel_id}.pid")
+
+def channel_progress_path(channel_id):
+    """أنبوب -progress المسمى للقناة: يبقى مع العملية بعد خروج المدير ليعيد فتحه المدير التالي"""
+    return os.path.join(PROCESS_DIR, f"channel_{channel_id}.progress")
+
+def read_log_tail(path, lines=LOG_TAIL_LINES, before=None, block_size=8192):
+    """آخر N سطر قبل موضع معين بالقراءة العكسية على كتل - O(الأسطر المطلوبة) لا O(حجم الملف)
+    
+    يُرجع الأسطر وموضع أولها (يُمرر كـ before للصفحة السابقة) وموضع النهاية (بداية المتابعة).
+    """
+    with open(path, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end if before is None else max(0, min(before, end))
+        stop = position
+        data = b''
+        # سطر إضافي للتأكد أن أول سطر مُرجع كامل
+        while position > 0 and data.count(b'\n') <= lines:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+    
+    # موضع بداية كل سطر في الملف
+    entries = []
+    start = position
+    for chunk in data.split(b'\n'):
+        entries.append((start, chunk))
+        start += len(chunk) + 1
+    if entries and entries[-1][1] == b'':
+        entries.pop()
+    if position > 0 and entries:
+        entries.pop(0)  # بقية سطر يبدأ قبل الكتلة المقروءة
+    entries = entries[-lines:] if lines > 0 else []
+    
+    return {
+        'logs': [chunk.decode('utf-8', errors='ignore').rstrip('\r') for _, chunk in entries],
+        'offset': entries[0][0] if entries else stop,
+        'end': end
+    }
+
+class LogFollower:
+    """متابعة السجلات الحية: خيط واحد يستطلع مواضع كل السجلات المتابَعة
+    ويرسل الأسطر الجديدة لغرفة SocketIO الخاصة بكل سجل (مشتركة بين كل المتابعين)"""
+    
+    def __init__(self, emit_lines, interval=LOG_FOLLOW_INTERVAL):
+        self.emit_lines = emit_lines
+        self.interval = interval
+        self._followed = {}      # channel_id -> {'offset': ..., 'sids': set()}
+        self._lock = threading.Lock()
+        self._thread = None
+    
+    def follow(self, channel_id, sid):
+        """اشتراك عميل؛ أول مشترك يبدأ المتابعة من نهاية الملف"""
+        with self._lock:
+            entry = self._followed.get(channel_id)
+            if entry is None:
+                try:
+                    offset = os.path.getsize(channel_log_path(channel_id))
+                except OSError:
+                    offset = 0
+                entry = self._followed[channel_id] = {'offset': offset, 'sids': set()}
+            entry['sids'].add(sid)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name='log-follower')
+                self._thread.start()
+            return entry['offset']
+    
+    def unfollow(self, sid, channel_id=None):
+        """إلغاء اشتراك عميل (من سجل واحد أو من الكل عند الانفصال)"""
+        with self._lock:
+            for cid in [channel_id] if channel_id else list(self._followed):
+                entry = self._followed.get(cid)
+                if entry:
+                    entry['sids'].discard(sid)
+                    if not entry['sids']:
+                        del self._followed[cid]
+    
+    def followers(self):
+        """عدد المتابعين لكل سجل"""
+        with self._lock:
+            return {cid: len(entry['sids']) for cid, entry in self._followed.items()}
+    
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                followed = [(cid, entry['offset']) for cid, entry in self._followed.items()]
+            for channel_id, offset in followed:
+                try:
+                    self._poll(channel_id, offset)
+                except Exception as e:
+                    logger.error(f"خطأ في متابعة سجل {channel_id}: {e}")
+    
+    def _poll(self, channel_id, offset):
+        path = channel_log_path(channel_id)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        if size < offset:
+            offset = 0  # الملف اقتُطع أو استُبدل
+        if size == offset:
+            return
+        
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(min(size - offset, LOG_FOLLOW_MAX_BYTES))
+        
+        # إرسال الأسطر الكاملة فقط؛ السطر الناقص ينتظر الدورة التالية
+        cut = data.rfind(b'\n') + 1
+        if cut == 0:
+            if len(data) < LOG_FOLLOW_MAX_BYTES:
+                return
+            cut = len(data)
+        new_offset = offset + cut
+        
+        with self._lock:
+            entry = self._followed.get(channel_id)
+            if entry is None:
+                return
+            entry['offset'] = new_offset
+        
+        lines = data[:cut].decode('utf-8', errors='ignore').splitlines()
+        self.emit_lines(channel_id, lines, new_offset)
+
+class ProcessStatsSampler:
+    """جامع إحصائيات عمليات FFmpeg في مسح دوري واحد"""
+    
+    def __init__(self):
+        # مقابض psutil تبقى بين المسحات حتى تكون فروق CPU صحيحة
+        self._handles = {}
+        # آخر لقطة: channel_id -> stats (تُستبدل كاملة في كل مسح)
+        self._snapshot = {}
+    
+    def sweep(self, targets):
+        """قراءة CPU والذاكرة والـ I/O لكل العمليات المعطاة {channel_id: pid}"""
+        handles = {}
+        snapshot = {}
+        sampled_at = time.time()
+        
+        for channel_id, pid in targets.items():
+            process = self._handles.get(pid)
+            try:
+                if process is None or not process.is_running():
+                    process = psutil.Process(pid)
+                    process.cpu_percent(None)  # القراءة الأولى مرجعية فقط
+                
+                with process.oneshot():
+                    memory = process.memory_info()
+                    stats = {
+                        'cpu_percent': round(process.cpu_percent(None), 1),
+                        'memory_percent': round(process.memory_percent(), 2),
+                        'rss': memory.rss,
+                        'read_bytes': 0,
+                        'write_bytes': 0,
+                        'sampled_at': sampled_at
+                    }
+                    try:
+                        io = process.io_counters()
+                        stats['read_bytes'] = io.read_bytes
+                        stats['write_bytes'] = io.write_bytes
+                    except (psutil.AccessDenied, AttributeError):
+                        pass
+            except (psutil.NoSuchProcess, psutil.ZombieProcess, psutil.AccessDenied):
+                continue
+            
+            handles[pid] = process
+            snapshot[channel_id] = stats
+        
+        # استبدال المراجع دفعة واحدة؛ القرّاء لا يرون لقطة نصف محدثة
+        self._handles = handles
+        self._snapshot = snapshot
+    
+    def get(self, channel_id):
+        """آخر إحصائيات مسجلة للقناة (بدون أي استدعاء للنظام)"""
+        return self._snapshot.get(channel_id)
+
+class ProgressTracker:
+    """عينات تقدم FFmpeg لكل قناة في حلقة محدودة مع تقييم صحة البث"""
+    
+    NUMERIC_FIELDS = {'frame': int, 'fps': float, 'total_size': int, 'out_time_us': int,
+                      'dup_frames': int, 'drop_frames': int}
+    
+    def __init__(self, history=PROGRESS_HISTORY):
+        self.history = history
+        self._lock = threading.Lock()
+        self._samples = {}   # channel_id -> deque من العينات
+    
+    @classmethod
+    def parse(cls, fields):
+        """تحويل كتلة key=value من -progress إلى عينة رقمية"""
+        sample = {'time': time.time()}
+        for key, cast in cls.NUMERIC_FIELDS.items():
+            try:
+                sample[key] = cast(fields[key])
+            except (KeyError, ValueError):
+                pass
+        # out_time_ms في FFmpeg بالميكروثانية فعلاً؛ الإصدارات الأقدم لا ترسل out_time_us
+        if 'out_time_us' not in sample:
+            try:
+                sample['out_time_us'] = int(fields['out_time_ms'])
+            except (KeyError, ValueError):
+                pass
+        try:
+            sample['bitrate_kbps'] = float(fields['bitrate'].replace('kbits/s', ''))
+        except (KeyError, ValueError):
+            pass
+        try:
+            sample['speed'] = float(fields['speed'].rstrip('x'))
+        except (KeyError, ValueError):
+            pass
+        sample['ended'] = fields.get('progress') == 'end'
+        return sample
+    
+    def record(self, channel_id, fields):
+        """تسجيل كتلة تقدم جديدة"""
+        sample = self.parse(fields)
+        with self._lock:
+            samples = self._samples.get(channel_id)
+            if samples is None:
+                samples = self._samples[channel_id] = deque(maxlen=self.history)
+            samples.append(sample)
+        return sample
+    
+    def clear(self, channel_id):
+        with self._lock:
+            self._samples.pop(channel_id, None)
+    
+    def latest(self, channel_id):
+        """آخر عينة مع تقييم الصحة"""
+        with self._lock:
+            samples = self._samples.get(channel_id)
+            if not samples:
+                return None
+            sample = dict(samples[-1])
+            window = list(samples)[-PROGRESS_DROP_WINDOW:]
+        
+        issues = []
+        if sample.get('speed') is not None and sample['speed'] < PROGRESS_MIN_SPEED:
+            issues.append('slow')
+        if window[-1].get('drop_frames', 0) > window[0].get('drop_frames', 0):
+            issues.append('dropping')
+        sample['drops_recent'] = window[-1].get('drop_frames', 0) - window[0].get('drop_frames', 0)
+        sample['healthy'] = not issues
+        sample['issues'] = issues
+        return sample
+    
+    def get_history(self, channel_id, limit=None):
+        """سلسلة العينات المحفوظة (الأحدث آخراً)"""
+        with self._lock:
+            samples = list(self._samples.get(channel_id, ()))
+        return samples[-limit:] if limit else samples
+
+class AdoptedProcess:
+    """عملية FFmpeg من تشغيل سابق للمدير تُراقب عبر pidfd؛ ليست ابنة لنا فلا كود خروج لها"""
+    
+    def __init__(self, pid, create_time, stdout=None):
+        self.pid = pid
+        self.create_time = create_time
+        self.stdout = stdout    # أنبوب -progress المسمى بعد إعادة فتحه (None لعمليات الإصدارات السابقة)
+        self.returncode = None
+    
+    def poll(self):
+        if self.returncode is None:
+            try:
+                # PID أعيد استخدامه لعملية أخرى = العملية الأصلية خرجت
+                process = psutil.Process(self.pid)
+                alive = (process.create_time() == self.create_time
+                         and process.status() != psutil.STATUS_ZOMBIE)
+            except psutil.NoSuchProcess:
+                alive = False
+            if not alive:
+                self.returncode = -1    # غير معروف
+        return self.returncode
+    
+    def wait(self, timeout=None):
+        return self.poll()
+
+class ProcessSupervisor:
+    """مراقب واحد لكل عمليات FFmpeg مع جدولة إعادة التشغيل"""
+    
+    # فترة الفحص الاحتياطي عندما لا يتوفر pidfd (أنوية أقدم من 5.3)
+    FALLBACK_POLL_INTERVAL = 1
+    
+    def __init__(self, on_exit, on_restart, on_progress=None, on_stall=None):
+        self.on_exit = on_exit          # on_exit(channel_id, process)
+        self.on_restart = on_restart    # on_restart(channel_id)
+        self.on_progress = on_progress  # on_progress(channel_id, fields) لكل كتلة -progress
+        self.on_stall = on_stall        # on_stall(channel_id, pid, stalled_for)
+        
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._pending = []      # عمليات تنتظر التسجيل في حلقة المراقبة
+        self._watched = {}      # pid -> (channel_id, process, pidfd)
+        self._timers = []       # heap: (due, seq, channel_id)
+        self._timer_seq = 0
+        self._restart_due = {}  # channel_id -> seq لإعادة التشغيل المجدولة الحالية
+        self._crashes = {}      # channel_id -> أوقات الانهيارات الأخيرة
+        self._exit_events = {}  # pid -> threading.Event يُضبط عند الخروج
+        self._progress = {}     # pid -> (fd, بقايا السطر، الحقول الحالية)
+        self._stall = {}        # pid -> [المهلة، وقت البدء، آخر تقدم، out_time، الحجم، أُبلغ]
+        
+        # أنبوب لإيقاظ الحلقة عند تسجيل عملية أو مؤقت جديد
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+        
+        self._thread = threading.Thread(target=self._run, name='process-supervisor', daemon=True)
+        self._thread.start()
+    
+    def watch(self, channel_id, process, stall_timeout=None):
+        """بدء مراقبة عملية قناة (مع كشف التجمد إذا حُددت مهلة)"""
+        with self._lock:
+            self._pending.append((channel_id, process, stall_timeout))
+            self._exit_events[process.pid] = threading.Event()
+        self._wakeup()
+    
+    def wait_for_exit(self, pid, timeout):
+        """انتظار خروج عملية حتى المهلة؛ ترجع True إذا خرجت"""
+        event = self._exit_events.get(pid)
+        if event is None:
+            return not psutil.pid_exists(pid)
+        return event.wait(timeout)
+    
+    def schedule_restart(self, channel_id):
+        """جدولة إعادة تشغيل مع تراجع أسي عشوائي؛ ترجع None عند اكتشاف حلقة انهيار"""
+        now = time.time()
+        with self._lock:
+            crashes = self._crashes.setdefault(channel_id, deque(maxlen=CRASH_LOOP_THRESHOLD))
+            crashes.append(now)
+            if len(crashes) >= CRASH_LOOP_THRESHOLD and now - crashes[0] <= CRASH_LOOP_WINDOW:
+                self._restart_due.pop(channel_id, None)
+                return None
+            
+            recent = sum(1 for t in crashes if now - t <= CRASH_LOOP_WINDOW)
+            delay = min(RESTART_BACKOFF_MAX, RESTART_BACKOFF_BASE * 2 ** (recent - 1))
+            delay = random.uniform(delay / 2, delay)
+            
+            self._timer_seq += 1
+            self._restart_due[channel_id] = self._timer_seq
+            heapq.heappush(self._timers, (now + delay, self._timer_seq, channel_id))
+        self._wakeup()
+        return delay
+    
+    def cancel_restart(self, channel_id):
+        """إلغاء إعادة تشغيل مجدولة (يُتجاهل المؤقت عند حلول موعده)"""
+        with self._lock:
+            self._restart_due.pop(channel_id, None)
+    
+    def reset_crashes(self, channel_id):
+        """مسح سجل الانهيارات بعد تشغيل يدوي"""
+        with self._lock:
+            self._crashes.pop(channel_id, None)
+    
+    def _wakeup(self):
+        try:
+            os.write(self._wakeup_w, b'\0')
+        except BlockingIOError:
+            pass  # الحلقة ستستيقظ على أي حال
+    
+    def _register_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        
+        for channel_id, process, stall_timeout in pending:
+            if stall_timeout:
+                self._stall[process.pid] = [stall_timeout, time.monotonic(), None, -1, -1, False]
+            pidfd = None
+            try:
+                pidfd = os.pidfd_open(process.pid)
+                self._selector.register(pidfd, selectors.EVENT_READ, process.pid)
+            except (AttributeError, OSError):
+                pidfd = None  # الفحص الاحتياطي الدوري
+            self._watched[process.pid] = (channel_id, process, pidfd)
+            
+            # قراءة -progress من stdout بدون حجب ضمن نفس الحلقة (وإلا امتلأ الأنبوب وتوقف FFmpeg)
+            if process.stdout is not None:
+                fd = process.stdout.fileno()
+                os.set_blocking(fd, False)
+                self._selector.register(fd, selectors.EVENT_READ, ('progress', process.pid))
+                self._progress[process.pid] = [fd, b'', {}]
+    
+    def _read_progress(self, pid):
+        state = self._progress.get(pid)
+        if state is None:
+            return
+        fd = state[0]
+        try:
+            data = os.read(fd, 65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._close_progress(pid)
+            return
+        
+        channel_id = self._watched[pid][0]
+        lines = (state[1] + data).split(b'\n')
+        state[1] = lines.pop()
+        for line in lines:
+            key, _, value = line.decode('utf-8', errors='ignore').strip().partition('=')
+            state[2][key] = value.strip()
+            # كل كتلة تنتهي بـ progress=continue أو progress=end
+            if key == 'progress':
+                fields, state[2] = state[2], {}
+                self._note_advance(pid, fields)
+                if self.on_progress:
+                    try:
+                        self.on_progress(channel_id, fields)
+                    except Exception as e:
+                        logger.error(f"خطأ في معالجة تقدم القناة {channel_id}: {e}")
+    
+    def _note_advance(self, pid, fields):
+        """تسجيل وقت آخر تقدم فعلي (زمن المخرج أو حجمه ازداد)"""
+        stall = self._stall.get(pid)
+        if stall is None:
+            return
+        try:
+            out_time = int(fields.get('out_time_us') or fields.get('out_time_ms') or -1)
+        except ValueError:
+            out_time = -1
+        try:
+            size = int(fields.get('total_size') or -1)
+        except ValueError:
+            size = -1
+        if out_time > stall[3] or size > stall[4]:
+            stall[2] = time.monotonic()
+            stall[3] = max(stall[3], out_time)
+            stall[4] = max(stall[4], size)
+    
+    def _check_stalls(self):
+        """فحص واحد لكل العمليات المراقبة: أي عملية بلا تقدم لأكثر من مهلتها تُبلَّغ مرة واحدة"""
+        now = time.monotonic()
+        for pid, stall in list(self._stall.items()):
+            timeout, started, last_advance, _, _, reported = stall
+            if reported or pid not in self._watched:
+                continue
+            since = last_advance if last_advance is not None else started + STALL_STARTUP_GRACE
+            if now - since <= timeout:
+                continue
+            stall[5] = True
+            if self.on_stall:
+                try:
+                    self.on_stall(self._watched[pid][0], pid, now - (last_advance or started))
+                except Exception as e:
+                    logger.error(f"خطأ في معالجة تجمد العملية {pid}: {e}")
+    
+    def _close_progress(self, pid):
+        state = self._progress.pop(pid, None)
+        if state:
+            self._selector.unregister(state[0])
+    
+    def _next_timeout(self):
+        timeout = None
+        with self._lock:
+            if self._timers:
+                timeout = max(0, self._timers[0][0] - time.time())
+        if any(pidfd is None for _, _, pidfd in self._watched.values()):
+            timeout = self.FALLBACK_POLL_INTERVAL if timeout is None else min(timeout, self.FALLBACK_POLL_INTERVAL)
+        if self._stall:
+            timeout = WATCHDOG_INTERVAL if timeout is None else min(timeout, WATCHDOG_INTERVAL)
+        return timeout
+    
+    def _reap(self, pid):
+        # قراءة آخر تقدم متبقٍ قبل إغلاق الأنبوب
+        if pid in self._progress:
+            self._read_progress(pid)
+            self._close_progress(pid)
+        channel_id, process, pidfd = self._watched.pop(pid)
+        self._stall.pop(pid, None)
+        if process.stdout is not None:
+            process.stdout.close()
+        if pidfd is not None:
+            self._selector.unregister(pidfd)
+            os.close(pidfd)
+        process.wait()
+        with self._lock:
+            event = self._exit_events.pop(pid, None)
+        if event:
+            event.set()
+        try:
+            self.on_exit(channel_id, process)
+        except Exception as e:
+            logger.error(f"خطأ في معالجة خروج القناة {channel_id}: {e}")
+    
+    def _fire_due_timers(self):
+        due = []
+        now = time.time()
+        with self._lock:
+            while self._timers and self._timers[0][0] <= now:
+                _, seq, channel_id = heapq.heappop(self._timers)
+                if self._restart_due.get(channel_id) == seq:
+                    del self._restart_due[channel_id]
+                    due.append(channel_id)
+        
+        for channel_id in due:
+            try:
+                self.on_restart(channel_id)
+            except Exception as e:
+                logger.error(f"خطأ في إعادة تشغيل القناة {channel_id}: {e}")
+    
+    def _run(self):
+        """حلقة المراقبة: تستيقظ فور خروج أي عملية أو حلول موعد إعادة تشغيل"""
+        while True:
+            try:
+                self._register_pending()
+                
+                for key, _ in self._selector.select(self._next_timeout()):
+                    if key.data is None:
+                        try:
+                            while os.read(self._wakeup_r, 512):
+                                pass
+                        except BlockingIOError:
+                            pass
+                    elif isinstance(key.data, tuple):
+                        self._read_progress(key.data[1])
+                    elif key.data in self._watched:
+                        self._reap(key.data)
+                
+                # العمليات بدون pidfd
+                for pid, (_, process, pidfd) in list(self._watched.items()):
+                    if pidfd is None and process.poll() is not None:
+                        self._reap(pid)
+                
+                self._check_stalls()
+                self._fire_due_timers()
+            except Exception as e:
+                logger.error(f"خطأ في حلقة مراقبة العمليات: {e}")
+                time.sleep(1)
+
+class CapacityModel:
+    """نموذج سعة المعالج: كلفة كل ملف تحويل بالأنوية متعلمة من العينات الحية"""
+    
+    def __init__(self, budget_ratio=CPU_BUDGET_RATIO):
+        self.total_cores = psutil.cpu_count() or 1
+        self.budget = self.total_cores * budget_ratio
+        self.nodes = self._read_numa_nodes()
+        
+        self._lock = threading.Lock()
+        self._costs = {}        # profile -> أنوية (متوسط متحرك)
+        self._samples = {}      # profile -> عدد العينات
+        self._allocations = {}  # channel_id -> {'profile', 'cost', 'threads', 'cpus'}
+        self._core_load = {cpu: 0.0 for node in self.nodes for cpu in node}
+        self.cost_factors = {}  # ملف الترميز -> معامل الكلفة مقارنة بـ x264 veryfast
+    
+    def _read_numa_nodes(self):
+        """قراءة أنوية كل عقدة NUMA (عقدة واحدة إذا لم تتوفر المعلومات)"""
+        try:
+            allowed = set(os.sched_getaffinity(0))
+        except AttributeError:
+            allowed = set(range(self.total_cores))
+        
+        nodes = []
+        for path in sorted(glob.glob('/sys/devices/system/node/node*/cpulist')):
+            cpus = set()
+            with open(path) as f:
+                for part in f.read().strip().split(','):
+                    if '-' in part:
+                        lo, hi = part.split('-')
+                        cpus.update(range(int(lo), int(hi) + 1))
+                    elif part:
+                        cpus.add(int(part))
+            if cpus & allowed:
+                nodes.append(sorted(cpus & allowed))
+        return nodes or [sorted(allowed)]
+    
+    @staticmethod
+    def profile_key(channel, encoder_profile=DEFAULT_PROFILE):
+        """مفتاح ملف التحويل الذي تُقاس كلفته (الدقات المتعددة مفصولة بـ |)"""
+        mode = channel.get('encode_mode') or ('transcode' if channel.get('transcode', True) else 'copy')
+        if mode in ('copy', 'audio'):
+            return mode
+        outputs = channel.get('renditions') or [channel.get('output', {})]
+        return '|'.join(f"{encoder_profile}:{o.get('resolution', '')}:{o.get('bitrate', '')}"
+                        for o in outputs)
+    
+    def cost(self, profile):
+        """الكلفة المقدرة بالأنوية: المقاسة إن وجدت وإلا تقدير حسب الدقة"""
+        if profile in self._costs:
+            return self._costs[profile]
+        if profile == 'copy':
+            return DEFAULT_COPY_COST
+        if profile == 'audio':
+            return DEFAULT_AUDIO_COST
+        
+        cost = 0.0
+        for part in profile.split('|'):
+            encoder_profile = part.split(':')[0]
+            factor = self.cost_factors.get(encoder_profile, 1.0)
+            try:
+                width, height = part.split(':')[1].split('x')
+                cost += factor * DEFAULT_TRANSCODE_COST * int(width) * int(height) / (720 * 576)
+            except (IndexError, ValueError):
+                cost += factor * DEFAULT_TRANSCODE_COST
+        return cost
+    
+    def committed(self):
+        return sum(a['cost'] for a in self._allocations.values())
+    
+    def admit(self, channel_id, profile, force=False):
+        """حجز سعة لقناة وإرجاع خيوطها وأنويتها، أو None إذا تجاوزت الميزانية
+        
+        force=True يسجل الحجز حتى فوق الميزانية (عملية موجودة بالفعل يجب أن تُحسب).
+        """
+        with self._lock:
+            self._release(channel_id)
+            cost = self.cost(profile)
+            committed = self.committed()
+            # قناة واحدة تُقبل دائماً حتى لو كانت أغلى من الميزانية كلها
+            if not force and committed > 0 and committed + cost > self.budget:
+                return None
+            
+            threads = max(1, min(math.ceil(cost), max(len(n) for n in self.nodes)))
+            
+            # العقدة الأقل حملاً لكل نواة ثم أقل أنويتها حملاً
+            node = min(self.nodes, key=lambda n: sum(self._core_load[c] for c in n) / len(n))
+            cpus = sorted(sorted(node, key=lambda c: self._core_load[c])[:threads])
+            for cpu in cpus:
+                self._core_load[cpu] += cost / len(cpus)
+            
+            allocation = {'profile': profile, 'cost': cost, 'threads': threads, 'cpus': cpus}
+            self._allocations[channel_id] = allocation
+            return allocation
+    
+    def release(self, channel_id):
+        """تحرير سعة قناة توقفت"""
+        with self._lock:
+            return self._release(channel_id)
+    
+    def _release(self, channel_id):
+        allocation = self._allocations.pop(channel_id, None)
+        if allocation:
+            for cpu in allocation['cpus']:
+                self._core_load[cpu] = max(0.0, self._core_load[cpu] - allocation['cost'] / len(allocation['cpus']))
+        return allocation is not None
+    
+    def learn(self, channel_id, cpu_percent):
+        """تحديث كلفة ملف القناة من عينة CPU حية (نسبة مئوية لنواة واحدة)"""
+        with self._lock:
+            allocation = self._allocations.get(channel_id)
+            if not allocation:
+                return
+            profile = allocation['profile']
+            sample = cpu_percent / 100.0
+            if profile in self._costs:
+                self._costs[profile] += COST_EWMA_ALPHA * (sample - self._costs[profile])
+            else:
+                self._costs[profile] = sample
+            self._samples[profile] = self._samples.get(profile, 0) + 1
+    
+    def report(self):
+        """السعة الحالية وعدد القنوات الإضافية الممكنة لكل ملف"""
+        with self._lock:
+            committed = self.committed()
+            free = max(0.0, self.budget - committed)
+            profiles = {}
+            for profile in set(self._costs) | {a['profile'] for a in self._allocations.values()}:
+                cost = self.cost(profile)
+                profiles[profile] = {
+                    'cost_cores': round(cost, 3),
+                    'samples': self._samples.get(profile, 0),
+                    'running': sum(1 for a in self._allocations.values() if a['profile'] == profile),
+                    'additional_fit': int(free // cost) if cost > 0 else None
+                }
+            return {
+                'total_cores': self.total_cores,
+                'numa_nodes': len(self.nodes),
+                'budget_cores': round(self.budget, 2),
+                'committed_cores': round(committed, 2),
+                'free_cores': round(free, 2),
+                'profiles': profiles
+            }
+
+class StartQueue:
+    """طابور تشغيل القنوات بأولوية ومعدل محدود وسقف للإحماء المتزامن"""
+    
+    def __init__(self, start_func, rate=START_RATE, burst=START_BURST,
+                 max_warming=MAX_WARMING_CHANNELS, warmup_seconds=WARMUP_SECONDS):
+        self.start_func = start_func
+        self.rate = rate
+        self.burst = burst
+        self.max_warming = max_warming
+        self.warmup_seconds = warmup_seconds
+        
+        self._cond = threading.Condition()
+        self._heap = []         # (priority, seq, channel_id, enqueued_at)
+        self._seq = 0
+        self._queued = {}       # channel_id -> {retry_capacity: Future} لكل نوع من المنتظرين
+        self._entries = {}      # channel_id -> (seq، الأولوية، وقت الدخول) للمدخل الحالي؛ غيره قديم يُتجاهل
+        self._running = None    # القناة التي يُنفذ تشغيلها الآن (خارج القفل)
+        self._parked = []       # مدخلات لم تتسع لها السعة: تعود للطابور عند تحرر سعة
+        self._warming = {}      # channel_id -> نهاية الإحماء
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._capacity_retry_at = 0  # موعد إعادة المحاولة للمدخلات المركونة
+        
+        # مقاييس
+        self.started_total = 0
+        self._latencies = deque(maxlen=500)
+        
+        self._thread = threading.Thread(target=self._run, name='start-queue', daemon=True)
+        self._thread.start()
+    
+    def submit(self, channel_id, priority=PRIORITY_DEFAULT, retry_capacity=True):
+        """إضافة قناة للطابور وإرجاع Future بنتيجة التشغيل
+        
+        قناة في الطابور بالفعل تُرفع أولويتها إن كانت الجديدة أعلى. retry_capacity=False
+        يُرجع رفض السعة فوراً لهذا الطالب (تشغيل يدوي) بدلاً من ركن القناة حتى تتحرر سعة؛
+        المنتظرون الآخرون لنفس القناة يبقون على خيارهم.
+        """
+        with self._cond:
+            waiters = self._queued.get(channel_id)
+            if waiters is None:
+                waiters = self._queued[channel_id] = {}
+                self._push(channel_id, priority, time.monotonic())
+            elif channel_id != self._running:
+                _, current, enqueued_at = self._entries[channel_id]
+                if priority < current:
+                    self._parked = [item for item in self._parked if item[2] != channel_id]
+                    self._push(channel_id, priority, enqueued_at)
+            future = waiters.get(retry_capacity)
+            if future is None:
+                future = waiters[retry_capacity] = Future()
+        return future
+    
+    def cancel(self, channel_id):
+        """إخراج قناة تنتظر التشغيل من الطابور (أُوقفت أو حُذفت)؛ ترجع True إن كانت تنتظر
+        
+        تشغيل جارٍ بالفعل لا يُلغى؛ منتظرو القناة الملغاة يتلقون نتيجة 'cancelled'.
+        """
+        with self._cond:
+            if channel_id == self._running or channel_id not in self._queued:
+                return False
+            waiters = self._queued.pop(channel_id)
+            del self._entries[channel_id]   # مدخلها في الكومة يصبح قديماً ويُتجاهل
+            self._parked = [item for item in self._parked if item[2] != channel_id]
+        result = {'success': False, 'reason': 'cancelled', 'message': 'أُلغي التشغيل المنتظر'}
+        for future in waiters.values():
+            future.set_result(result)
+        return True
+    
+    def _push(self, channel_id, priority, enqueued_at):
+        self._seq += 1
+        self._entries[channel_id] = (self._seq, priority, enqueued_at)
+        heapq.heappush(self._heap, (priority, self._seq, channel_id, enqueued_at))
+        self._cond.notify()
+    
+    def _unpark(self):
+        """إعادة المدخلات المركونة إلى الطابور بترتيب أولويتها الأصلي"""
+        for item in self._parked:
+            heapq.heappush(self._heap, item)
+        self._parked = []
+        self._capacity_retry_at = 0
+    
+    def mark_warming(self, channel_id):
+        """احتساب قناة بدأت للتو (حتى لو شُغلت مباشرة خارج الطابور)"""
+        with self._cond:
+            self._warming[channel_id] = time.monotonic() + self.warmup_seconds
+    
+    def release(self, channel_id):
+        """إخراج قناة من الإحماء (خرجت عمليتها أو أُوقفت)"""
+        with self._cond:
+            self._warming.pop(channel_id, None)
+            self._unpark()
+            self._cond.notify()
+    
+    def metrics(self):
+        """عمق الطابور وزمن الانتظار حتى التشغيل"""
+        with self._cond:
+            latencies = sorted(self._latencies)
+            return {
+                'queue_depth': len(self._heap) + len(self._parked),
+                'waiting_for_capacity': len(self._parked),
+                'warming': len(self._warming),
+                'max_warming': self.max_warming,
+                'rate': self.rate,
+                'tokens': round(self._tokens, 2),
+                'started_total': self.started_total,
+                'start_latency_avg': round(sum(latencies) / len(latencies), 3) if latencies else 0,
+                'start_latency_p95': round(latencies[int(len(latencies) * 0.95)], 3) if latencies else 0,
+                'start_latency_max': round(latencies[-1], 3) if latencies else 0
+            }
+    
+    def _next_wait(self, now):
+        """المدة حتى يمكن تشغيل القناة التالية (0 = الآن)"""
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+        
+        for channel_id, warm_until in list(self._warming.items()):
+            if warm_until <= now:
+                del self._warming[channel_id]
+        
+        if self._parked and self._capacity_retry_at <= now:
+            self._unpark()
+        
+        waits = []
+        if self._tokens < 1:
+            waits.append((1 - self._tokens) / self.rate)
+        if len(self._warming) >= self.max_warming:
+            waits.append(min(self._warming.values()) - now)
+        return max(waits) if waits else 0
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                # الطابور فارغ وكل المركونة تنتظر سعة: النوم حتى تحرر سعة أو موعد إعادة المحاولة
+                while not self._heap:
+                    if self._parked:
+                        self._cond.wait(max(0, self._capacity_retry_at - time.monotonic()))
+                        self._next_wait(time.monotonic())
+                    else:
+                        self._cond.wait()
+                wait = self._next_wait(time.monotonic())
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                
+                item = heapq.heappop(self._heap)
+                channel_id, enqueued_at = item[2], item[3]
+                if self._entries.get(channel_id, (None,))[0] != item[1]:
+                    continue    # مدخل قديم لقناة رُفعت أولويتها
+                self._tokens -= 1
+                self._running = channel_id
+            
+            try:
+                result = self.start_func(channel_id)
+            except Exception as e:
+                result = {'success': False, 'message': str(e)}
+            
+            with self._cond:
+                self._running = None
+                waiters = self._queued[channel_id]
+                # لا توجد سعة كافية: الرفض لمن طلبه فوراً، والقناة تُركن (دون استهلاك رمز)
+                # لبقية منتظريها فتمضي القنوات الأرخص خلفها
+                if result.get('reason') == 'capacity':
+                    self._tokens += 1
+                if result.get('reason') == 'capacity' and True in waiters:
+                    done = [waiters.pop(False)] if False in waiters else []
+                    self._parked.append(item)
+                    if not self._capacity_retry_at:
+                        self._capacity_retry_at = time.monotonic() + CAPACITY_RETRY_SECONDS
+                else:
+                    done = list(waiters.values())
+                    del self._queued[channel_id]
+                    del self._entries[channel_id]
+                    self.started_total += 1
+                    self._latencies.append(time.monotonic() - enqueued_at)
+                    START_QUEUE_WAIT_SECONDS.observe(self._latencies[-1])
+            for future in done:
+                future.set_result(result)
+
 class ChannelManager:
     """مدير القنوات المركزي"""
     
     def __init__(self):
+        # القاموس لا يُعدّل في مكانه أبداً: الإضافة والحذف ينشئان نسخة جديدة (نسخ عند الكتابة)
+        # فيمكن لأي خيط المرور عليه دون قفل، وتغييرات القناة نفسها تتم بقفلها الخاص
         self.channels = {}
+        self._channels_lock = threading.Lock()
+        self._channel_locks = {}
+        self.stats_sampler = ProcessStatsSampler()
+        self.log_follower = LogFollower(self.emit_log_lines)
+        self.progress = ProgressTracker()
+        self.metrics = TimeSeriesStore()
+        self._net_last = None   # (الوقت، عدادات الشبكة) لحساب المعدل
+        self._system_last = {}  # آخر عينة نظام (تُقرأ في /metrics)
+        self._playlist_validators = {}  # m3u8_url -> ETag/Last-Modified آخر مزامنة
+        self._argv_cache = {}   # channel_id -> (بصمة الإعدادات، argv)
+        self.prober = SourceProber()
+        self._encoding = {}     # channel_id -> {'mode', 'reason', 'hints'} لآخر تشغيل
+        
+        # سجل المراجعات: كل تغيير على قناة يرفع رقم المراجعة
+        # العداد في الذاكرة فقط ويبدأ من الصفر مع كل إقلاع، فحقبة الإقلاع تميز أرقامه عن السابقة
+        self.epoch = uuid.uuid4().hex[:8]
+        self.revision = 0
+        self._changes = OrderedDict()  # channel_id -> (revision, removed) بترتيب التغيير
+        self._revision_lock = threading.Lock()
+        
+        self.supervisor = ProcessSupervisor(on_exit=self.handle_exit, 
+                                            on_restart=self.restart_channel,
+                                            on_progress=self.record_progress,
+                                            on_stall=self.handle_stall)
+        
+        # نموذج سعة المعالج لقبول التشغيل
+        self.capacity = CapacityModel()
+        
+        # سجل ملفات الترميز
+        self.encoder_profiles = load_profiles()
+        self.capacity.cost_factors = {name: profile.get('cost_factor', 1.0)
+                                      for name, profile in self.encoder_profiles.items()}
+        
+        # طابور التشغيل المحدود المعدل
+        self.start_queue = StartQueue(self.start_channel)
+        
+        # العمليات المجمّعة
+        self.batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS,
+                                                 thread_name_prefix='batch')
+        self.batch_jobs = OrderedDict()  # job_id -> حالة المهمة
+        self._batch_lock = threading.Lock()
+        self.store = ChannelStore(CHANNELS_DB)
+        self.outputs = OutputAllocator(OUTPUT_POOLS)
         self.load_channels()
+        self.backfill_playlist_keys()
+        self.reserve_outputs()
+        lost = self.adopt_processes()
+        CONTROL_METRICS.collector(self.collect_metrics)
+        self.web_metrics = WorkerAggregator(WEB_METRICS, stale_after=WEB_METRICS_PUSH_SECONDS * 6)
+        
+        # محرك الجدولة: حدث لكل حافة نافذة بدلاً من مسح كل القنوات دورياً
+        self.schedule = ScheduleEngine(self.apply_schedule)
+        for channel_id in list(self.channels):
+            self.reschedule(channel_id)
+        
+        # قنوات كانت تعمل وخرجت عمليتها أثناء توقف المدير
+        for channel_id in lost:
+            channel = self.channels[channel_id]
+            if channel['enabled'] and channel.get('auto_restart', True) and channel['status'] == 'stopped':
+                self.start_queue.submit(channel_id, self.start_priority(channel))
         self.scheduler = BackgroundScheduler()
         self.setup_scheduler()
         self.scheduler.start()
     
+    def channel_lock(self, channel_id):
+        """قفل القناة (يُنشأ عند أول طلب)"""
+        return self._channel_locks.setdefault(channel_id, threading.Lock())
+    
+    def add_channels(self, channels):
+        """إضافة قنوات باستبدال القاموس بنسخة جديدة"""
+        with self._channels_lock:
+            updated = dict(self.channels)
+            for channel in channels:
+                updated[channel['id']] = channel
+            self.channels = updated
+    
+    def remove_channel(self, channel_id):
+        """إزالة قناة باستبدال القاموس بنسخة جديدة"""
+        with self._channels_lock:
+            updated = dict(self.channels)
+            channel = updated.pop(channel_id, None)
+            self.channels = updated
+        # قفل القناة يبقى: خيط يحمله الآن وطالب جديد يجب أن يتشاركا نفس القفل، والمعرف
+        # (بصمة الرابط) قد يعود بإعادة الاستيراد
+        return channel
+    
+    def transition(self, channel_id, expected, new_status, **fields):
+        """انتقال ذري للحالة (فحص ثم تعيين تحت قفل القناة)
+        
+        يُرجع الحالة السابقة، أو None إذا لم تكن الحالة الحالية ضمن expected.
+        """
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            return None
+        with self.channel_lock(channel_id):
+            previous = channel['status']
+            if previous not in expected:
+                return None
+            channel['status'] = new_status
+            channel.update(fields)
+            return previous
+    
+    def update_channel(self, channel_id, **fields):
+        """تحديث حقول قناة تحت قفلها"""
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            return None
+        with self.channel_lock(channel_id):
+            channel.update(fields)
+        return channel
+    
+    def channel_snapshot(self, channel_id):
+        """نسخة مستقلة ومتسقة من القناة"""
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            return None
+        with self.channel_lock(channel_id):
+            return copy.deepcopy(channel)
+    
     def load_channels(self):
         """تحميل إعدادات القنوات"""
         try:
-            with open(os.path.join(CONFIG_DIR, 'channels.json'), 'r', encoding='utf-8') as f:
-                config = json.load(f)
-                self.channels = {ch['id']: ch for ch in config['channels']}
-                logger.info(f"تم تحميل {len(self.channels)} قناة")
+            # ترحيل channels.json القديم عند أول تشغيل مع المخزن
+            json_file = os.path.join(CONFIG_DIR, 'channels.json')
+            if self.store.count() == 0 and os.path.exists(json_file):
+                migrated = self.store.import_json(json_file)
+                if migrated:
+                    logger.info(f"تم ترحيل {migrated} قناة من channels.json إلى {CHANNELS_DB}")
+            
+            self.channels = self.store.load()
+            logger.info(f"تم تحميل {len(self.channels)} قناة")
         except Exception as e:
             logger.error(f"خطأ في تحميل القنوات: {e}")
             self.channels = {}
     
-    def save_channels(self):
-        """حفظ إعدادات القنوات"""
+    @instrumented
+    def save_channels(self, *channel_ids):
+        """حفظ القنوات المحددة (أو جميعها إذا لم تُحدد) في المخزن"""
         try:
-            config = {
-                'last_updated': datetime.now().isoformat(),
-                'channels': list(self.channels.values())
-            }
-            with open(os.path.join(CONFIG_DIR, 'channels.json'), 'w', encoding='utf-8') as f:
-                json.dump(config, f, indent=2, ensure_ascii=False)
-            
-            # إنشاء نسخة احتياطية
-            backup_file = os.path.join(BASE_DIR, 'backups', 
-                                      f'channels_backup_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json')
-            with open(backup_file, 'w', encoding='utf-8') as f:
-                json.dump(config, f, indent=2, ensure_ascii=False)
-                
-            logger.info("تم حفظ إعدادات القنوات")
+            channels = [self.channel_snapshot(cid) for cid in (channel_ids or list(self.channels))]
+            channels = [channel for channel in channels if channel]
+            self.store.upsert(channels)
+            logger.info(f"تم حفظ {len(channels)} قناة")
             return True
         except Exception as e:
             logger.error(f"خطأ في حفظ القنوات: {e}")
             return False
     
-    def parse_m3u8(self, m3u8_url):
-        """تحليل ملف M3U8 واستخراج القنوات"""
+    def delete_channels(self, *channel_ids):
+        """حذف قنوات من المخزن"""
         try:
-            import requests
-            response = requests.get(m3u8_url, timeout=10)
-            lines = response.text.split('\n')
-            
-            parsed_channels = []
-            current_channel = {}
+            self.store.delete(*channel_ids)
+            return True
+        except Exception as e:
+            logger.error(f"خطأ في حذف القنوات: {e}")
+            return False
+    
+    def snapshot_channels(self):
+        """لقطة مجدولة للقنوات مع تطبيق حد الاحتفاظ"""
+        try:
+            path = self.store.snapshot(BACKUP_DIR, SNAPSHOT_RETENTION)
+            logger.info(f"تم حفظ لقطة القنوات: {path}")
+            return path
+        except Exception as e:
+            logger.error(f"خطأ في حفظ لقطة القنوات: {e}")
+            return None
+    
+    @instrumented
+    def parse_m3u8(self, m3u8_url, progress=None, validators=None):
+        """تحليل تدفقي لملف M3U/M3U8: يقرأ الاستجابة على دفعات ويُرجع القنوات واحدة تلو الأخرى
+        
+        validators: قاموس اختياري لـ ETag/Last-Modified؛ يُرسل كطلب شرطي ويُحدّث من الاستجابة،
+        وعند 304 يُضبط فيه not_modified ولا يُرجع أي قناة.
+        """
+        import requests
+        
+        headers = {}
+        if validators is not None:
+            validators['not_modified'] = False
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+        
+        parsed = 0
+        with requests.get(m3u8_url, stream=True, timeout=10, headers=headers) as response:
+            if response.status_code == 304:
+                validators['not_modified'] = True
+                return
+            response.raise_for_status()
+            if not response.encoding:
+                response.encoding = 'utf-8'
             
-            for line in lines:
-                line = line.strip()
+            current = {}
+            for line in response.iter_lines(chunk_size=IMPORT_CHUNK_SIZE, decode_unicode=True):
+                line = line.strip().lstrip('\ufeff')
+                if not line:
+                    continue
+                
                 if line.startswith('#EXTINF:'):
-                    # استخراج اسم القناة
-                    parts = line.split(',', 1)
-                    if len(parts) > 1:
-                        current_channel['name'] = parts[1].strip()
-                elif line.startswith('http://'):
-                    current_channel['source_url'] = line
-                    current_channel['id'] = self.generate_channel_id(line)
-                    
-                    # إعدادات افتراضية
-                    current_channel.update({
-                        'enabled': False,
-                        'auto_start': False,
-                        'transcode': True,
-                        'output': {
-                            'protocol': 'udp',
-                            'address': '239.255.100.1',
-                            'port': self.get_next_port(),
-                            'bitrate': '800k',
-                            'resolution': '720x576'
-                        },
-                        'schedule': {
-                            'daily': True,
-                            'start_time': '06:00',
-                            'stop_time': '02:00'
-                        },
-                        'status': 'stopped',
-                        'pid': None,
-                        'last_started': None,
-                        'stats': {
-                            'uptime': 0,
-                            'cpu_usage': 0,
-                            'memory_usage': 0
-                        }
-                    })
-                    
-                    parsed_channels.append(current_channel.copy())
-                    current_channel = {}
+                    current = self.parse_extinf(line)
+                elif line.startswith('#EXTGRP:'):
+                    current.setdefault('group', line[len('#EXTGRP:'):].strip())
+                elif not line.startswith('#'):
+                    yield self.new_channel(line, current)
+                    current = {}
+                    parsed += 1
+                    if progress and parsed % IMPORT_PROGRESS_EVERY == 0:
+                        progress(parsed)
             
-            return parsed_channels
-        except Exception as e:
-            logger.error(f"خطأ في تحليل M3U8: {e}")
-            return []
+            # تُحفظ بعد اكتمال القراءة فقط حتى لا يُتخطى ملف لم يُحلل كاملاً
+            if validators is not None:
+                validators['etag'] = response.headers.get('ETag')
+                validators['last_modified'] = response.headers.get('Last-Modified')
+        
+        if progress:
+            progress(parsed, done=True)
+    
+    @staticmethod
+    def parse_extinf(line):
+        """استخراج كل خصائص سطر #EXTINF (tvg-id، group-title، tvg-logo...) واسم القناة"""
+        body = line[len('#EXTINF:'):]
+        attributes = {}
+        end = 0
+        for match in EXTINF_ATTR_RE.finditer(body):
+            attributes[match.group(1).lower()] = match.group(2)
+            end = match.end()
+        
+        # الاسم بعد أول فاصلة تلي الخصائص (قد تحتوي القيم نفسها على فواصل)
+        comma = body.find(',', end)
+        info = {'attributes': attributes}
+        name = body[comma + 1:].strip() if comma >= 0 else ''
+        if name or attributes.get('tvg-name'):
+            info['name'] = name or attributes['tvg-name']
+        if attributes.get('tvg-id'):
+            info['tvg_id'] = attributes['tvg-id']
+        if attributes.get('tvg-logo'):
+            info['logo'] = attributes['tvg-logo']
+        if attributes.get('group-title'):
+            info['group'] = attributes['group-title']
+        return info
+    
+    def new_channel(self, source_url, info=None, port=None):
+        """قناة جديدة بالإعدادات الافتراضية"""
+        channel = dict(info or {})
+        channel.setdefault('name', source_url)
+        channel.update({
+            'id': self.generate_channel_id(source_url),
+            'source_url': source_url,
+            'enabled': False,
+            'auto_start': False,
+            'transcode': True,
+            'mode': 'auto',
+            'output': {
+                'protocol': 'udp',
+                'address': '239.255.100.1',
+                'port': port,
+                'bitrate': '800k',
+                'resolution': '720x576'
+            },
+            'schedule': {
+                'daily': True,
+                'start_time': '06:00',
+                'stop_time': '02:00'
+            },
+            'status': 'stopped',
+            'pid': None,
+            'last_started': None,
+            'stats': {
+                'uptime': 0,
+                'cpu_usage': 0,
+                'memory_usage': 0
+            }
+        })
+        return channel
+    
+    def import_m3u8(self, m3u8_url, progress=None):
+        """استيراد القنوات الجديدة من قائمة M3U (الموجودة بمفتاحها في القائمة لا تُكرر)"""
+        added = []
+        exhausted = 0
+        
+        playlist = self.keyed_playlist(m3u8_url, self.parse_m3u8(m3u8_url, progress))
+        parsed = len(playlist)
+        existing, claimed = self.playlist_channels(m3u8_url, playlist)
+        if claimed:
+            self.save_channels(*claimed)
+        
+        new_channels = {}
+        for key, channel in playlist.items():
+            if key in existing or channel['id'] in self.channels:
+                continue
+            if not self.assign_output(channel):
+                exhausted += 1
+                continue
+            channel['playlist'] = m3u8_url
+            new_channels[channel['id']] = channel
+            added.append(channel['id'])
+        
+        # استيراد كامل أو لا شيء: لا تُسقط قنوات بصمت عند امتلاء المجمعات
+        if exhausted:
+            for channel_id in added:
+                self.outputs.release(channel_id)
+            needed = len(added) + exhausted
+            logger.error(f"مجمعات المخارج لا تتسع للاستيراد: {needed} قناة جديدة و{len(added)} مخرج حر فقط")
+            return {'parsed': parsed, 'added': 0, 'no_output': exhausted, 'reason': 'exhausted',
+                    'message': f'مجمعات المخارج لا تتسع: {needed} قناة جديدة و{len(added)} مخرج حر فقط '
+                               f'(وسّع IPTV_OUTPUT_POOLS)'}
+        
+        if added:
+            self.add_channels(new_channels.values())
+            self.save_channels(*added)
+            from_revision = self.mark_changed(*added)
+            socketio.emit('channels_delta', self.get_changes(from_revision))
+            self.queue_probes(new_channels.values())
+        
+        return {'parsed': parsed, 'added': len(added), 'no_output': exhausted}
     
     def generate_channel_id(self, url):
         """إنشاء معرف فريد للقناة"""
         import hashlib
         return hashlib.md5(url.encode()).hexdigest()[:8]
     
-    def get_next_port(self):
-        """الحصول على المنفذ التالي المتاح"""
-        used_ports = [ch['output']['port'] for ch in self.channels.values() 
-                     if 'output' in ch and 'port' in ch['output']]
-        base_port = 6000
-        while base_port in used_ports:
-            base_port += 1
-        return base_port
+    @staticmethod
+    def playlist_base_key(channel):
+        """مفتاح القناة في قائمة المزود قبل تمييز المكرر: tvg-id، أو الاسم مع المجموعة"""
+        return channel.get('tvg_id') or f"{channel.get('name') or channel['source_url']}|{channel.get('group', '')}"
+    
+    @staticmethod
+    def playlist_key(channel):
+        """مفتاح ثابت للقناة في قائمة المزود (لا يتغير بتغير رابط المصدر)"""
+        return channel.get('playlist_key') or ChannelManager.playlist_base_key(channel)
+    
+    @staticmethod
+    def unique_key(base, taken):
+        """base، أو base#N لأول ترتيب غير مستخدم في taken (يُضاف إليها)"""
+        key, ordinal = base, 1
+        while key in taken:
+            ordinal += 1
+            key = f"{base}#{ordinal}"
+        taken.add(key)
+        return key
+    
+    def keyed_playlist(self, m3u8_url, channels):
+        """{مفتاح: قناة} لقائمة محللة؛ المكرر يُميز بترتيب ظهوره، ومعرف القناة يُشتق من المفتاح لا الرابط"""
+        playlist = {}
+        taken = set()
+        for channel in channels:
+            key = self.unique_key(self.playlist_base_key(channel), taken)
+            channel['playlist_key'] = key
+            channel['id'] = self.generate_channel_id(f"{m3u8_url}#{key}")
+            playlist[key] = channel
+        return playlist
     
+    def playlist_channels(self, m3u8_url, playlist):
+        """({مفتاح: قناة} لقنوات القائمة الموجودة، القنوات المضمومة إليها)
+        
+        القنوات المستوردة قبل تسجيل القائمة في القناة تُضم إلى أول قائمة تطابقها بمفتاحها أو برابط مصدرها.
+        """
+        existing, unowned, unowned_urls = {}, {}, {}
+        for channel in self.channels.values():
+            if channel.get('playlist') == m3u8_url:
+                existing[self.playlist_key(channel)] = channel
+            elif not channel.get('playlist'):
+                unowned.setdefault(self.playlist_key(channel), channel)
+                unowned_urls.setdefault(channel['source_url'], channel)
+        
+        claimed = []
+        for key, entry in playlist.items():
+            if key in existing:
+                continue
+            channel = unowned.get(key) or unowned_urls.get(entry['source_url'])
+            if channel is None or channel.get('playlist'):
+                continue
+            with self.channel_lock(channel['id']):
+                channel['playlist'] = m3u8_url
+                channel['playlist_key'] = key
+            existing[key] = channel
+            claimed.append(channel['id'])
+        if claimed:
+            logger.info(f"ضم {len(claimed)} قناة مستوردة سابقاً إلى قائمة المزود {m3u8_url}")
+        return existing, claimed
+    
+    def backfill_playlist_keys(self):
+        """حفظ مفتاح القائمة للقنوات المحملة بدونه (المكرر يُميز بترتيب التحميل)"""
+        taken = {}
+        for channel in self.channels.values():
+            if channel.get('playlist_key'):
+                taken.setdefault(channel.get('playlist'), set()).add(channel['playlist_key'])
+        
+        filled = []
+        for channel_id, channel in self.channels.items():
+            if channel.get('playlist_key'):
+                continue
+            keys = taken.setdefault(channel.get('playlist'), set())
+            channel['playlist_key'] = self.unique_key(self.playlist_base_key(channel), keys)
+            filled.append(channel_id)
+        if filled:
+            self.save_channels(*filled)
+    
+    def sync_playlist(self, m3u8_url=None):
+        """مزامنة شرطية مع قائمة المزود: إضافة الجديد، تحديث الروابط المتغيرة، وإيقاف المحذوف"""
+        m3u8_url = m3u8_url or PLAYLIST_URL
+        if not m3u8_url:
+            return {'success': False, 'reason': 'invalid', 'message': 'لم يُحدد رابط قائمة المزود'}
+        validators = self._playlist_validators.setdefault(m3u8_url, {})
+        
+        playlist = self.keyed_playlist(m3u8_url, self.parse_m3u8(m3u8_url, validators=validators))
+        
+        # لم تتغير القائمة منذ آخر مزامنة: لا تحليل ولا مقارنة
+        if validators.get('not_modified'):
+            logger.info(f"قائمة المزود لم تتغير: {m3u8_url}")
+            return {'not_modified': True, 'added': 0, 'removed': 0, 'changed': 0, 'restored': 0}
+        
+        existing, claimed = self.playlist_channels(m3u8_url, playlist)
+        if claimed:
+            self.save_channels(*claimed)
+        
+        added, changed, removed, restored = [], [], [], []
+        new_channels = {}
+        exhausted = 0
+        
+        for key, entry in playlist.items():
+            channel = existing.get(key)
+            if channel is None:
+                if entry['id'] in self.channels or entry['id'] in new_channels:
+                    continue
+                if not self.assign_output(entry):
+                    exhausted += 1
+                    continue
+                entry['playlist'] = m3u8_url
+                new_channels[entry['id']] = entry
+                added.append(entry['id'])
+                continue
+            
+            with self.channel_lock(channel['id']):
+                # قناة عادت إلى القائمة: استعادة حالة التفعيل السابقة
+                if channel.pop('retired', False):
+                    channel['enabled'] = channel.pop('enabled_before_retire', False)
+                    restored.append(channel['id'])
+                if channel['source_url'] != entry['source_url']:
+                    channel['source_url'] = entry['source_url']
+                    changed.append(channel['id'])
+        
+        # القنوات الجديدة كلها أو لا شيء (التحديثات والحذف تُطبق على أي حال)
+        no_output = None
+        if exhausted:
+            for channel_id in added:
+                self.outputs.release(channel_id)
+            no_output = {'no_output': exhausted, 'reason': 'exhausted',
+                         'message': f'مجمعات المخارج لا تتسع: {len(added) + exhausted} قناة جديدة '
+                                    f'و{len(added)} مخرج حر فقط (وسّع IPTV_OUTPUT_POOLS)'}
+            logger.error(f"مزامنة قائمة المزود: {no_output['message']}")
+            added, new_channels = [], {}
+            # المزامنة التالية تجلب القائمة كاملة حتى لو لم تتغير، فتُضاف القنوات بعد توسيع المجمعات
+            validators.clear()
+        
+        for key, channel in existing.items():
+            if key not in playlist and not channel.get('retired'):
+                with self.channel_lock(channel['id']):
+                    channel['retired'] = True
+                    channel['enabled_before_retire'] = channel['enabled']
+                    channel['enabled'] = False
+                removed.append(channel['id'])
+        
+        self.add_channels(new_channels.values())
+        
+        if not (added or changed or removed or restored):
+            return {'not_modified': False, 'added': 0, 'removed': 0, 'changed': 0, 'restored': 0,
+                    **(no_output or {})}
+        
+        self.save_channels(*added, *changed, *removed, *restored)
+        from_revision = self.mark_changed(*added, *changed, *removed, *restored)
+        socketio.emit('channels_delta', self.get_changes(from_revision))
+        self.queue_probes([*new_channels.values(), *(self.channels[cid] for cid in changed)])
+        
+        # إيقاف القنوات المحذوفة، وإعادة تشغيل القنوات التي تغير مصدرها فقط
+        for channel_id in removed:
+            self.stop_channel(channel_id)
+        for channel_id in changed:
+            if self.stop_channel(channel_id)['success']:
+                self.start_queue.submit(channel_id, self.start_priority(self.channels[channel_id]))
+        
+        logger.info(f"مزامنة قائمة المزود: {len(added)} جديدة، {len(changed)} تغير مصدرها، "
+                    f"{len(removed)} أُوقفت، {len(restored)} أُعيدت")
+        return {'not_modified': False, 'added': len(added), 'removed': len(removed),
+                'changed': len(changed), 'restored': len(restored), **(no_output or {})}
+    
+    def scheduled_playlist_sync(self):
+        """مهمة المزامنة المجدولة"""
+        try:
+            self.sync_playlist()
+        except Exception as e:
+            logger.error(f"خطأ في مزامنة قائمة المزود: {e}")
+    
+    def output_keys(self, channel):
+        """مفاتيح (عنوان، منفذ) لكل مخارج القناة"""
+        return {key for key in map(OutputAllocator.key, self.get_outputs(channel)) if key}
+    
+    def reserve_outputs(self):
+        """حجز مخارج القنوات المحملة في المخصص (التعارضات القديمة تُسجل ولا تُحجز)"""
+        for channel_id, channel in self.channels.items():
+            conflicts = self.outputs.assign(channel_id, self.output_keys(channel))
+            for (address, port), owner in conflicts.items():
+                logger.warning(f"تعارض مخرج: القناة {channel['name']} تستخدم {address}:{port} المحجوز للقناة {owner}")
+    
+    def assign_output(self, channel):
+        """تخصيص مخرج جديد لقناة مستوردة؛ False عند امتلاء المجمعات"""
+        key = self.outputs.allocate(channel['id'])
+        if key is None:
+            return False
+        channel['output']['address'], channel['output']['port'] = key
+        return True
+    
+    @instrumented
     def start_channel(self, channel_id):
         """تشغيل قناة محددة"""
-        if channel_id not in self.channels:
+        channel = self.channels.get(channel_id)
+        if channel is None:
             return {'success': False, 'message': 'القناة غير موجودة'}
         
-        channel = self.channels[channel_id]
+        # حجز القناة ذرياً: تشغيلان متزامنان لا يمكن أن يمرّا معاً من هنا
+        previous = self.transition(channel_id, ('stopped', 'failed'), 'starting')
+        if previous is None:
+            if channel['status'] == 'running':
+                return {'success': False, 'message': 'القناة قيد التشغيل بالفعل'}
+            return {'success': False, 'message': f"القناة في حالة انتقالية ({channel['status']})"}
+        
+        # تشغيل يدوي بعد حلقة انهيار يبدأ عدّاً جديداً
+        if previous == 'failed':
+            self.supervisor.reset_crashes(channel_id)
+        
+        started = time.perf_counter()
         
-        # التحقق إذا كانت القناة قيد التشغيل بالفعل
-        if channel['status'] == 'running':
-            return {'success': False, 'message': 'القناة قيد التشغيل بالفعل'}
+        # وضع الترميز الفعلي وتلميحات المدخل من فحص المصدر، على نسخة متسقة من الإعدادات
+        snapshot = self.channel_snapshot(channel_id)
+        encoding = self.plan_encoding(snapshot)
+        snapshot['encode_mode'] = encoding['mode']
+        snapshot['input_hints'] = encoding['hints']
         
-        # بناء أمر FFmpeg
-        cmd = self.build_ffmpeg_command(channel)
+        # قبول التشغيل حسب ميزانية المعالج
+        encoder_profile, _ = resolve_profile(self.encoder_profiles, channel.get('profile', DEFAULT_PROFILE))
+        profile = self.capacity.profile_key(snapshot, encoder_profile)
+        allocation = self.capacity.admit(channel_id, profile)
+        if allocation is None:
+            self.transition(channel_id, ('starting',), previous)
+            return {'success': False, 'reason': 'capacity',
+                    'message': f'لا توجد سعة معالج كافية ({self.capacity.cost(profile):.2f} نواة مطلوبة)'}
         
-        # تشغيل العملية
+        self.progress.clear(channel_id)
+        
+        # تشغيل العملية من argv مبني من نسخة متسقة من الإعدادات (PID المسجل هو PID الـ FFmpeg نفسه)
         try:
-            process = subprocess.Popen(
-                cmd,
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                preexec_fn=os.setsid
-            )
+            argv = self.ffmpeg_argv(snapshot, allocation)
+            process = spawn_process(argv, channel_log_path(channel_id), allocation['cpus'],
+                                    progress_fifo=channel_progress_path(channel_id))
+            self._encoding[channel_id] = encoding
             
             # حفظ معلومات العملية
-            channel['status'] = 'running'
-            channel['pid'] = process.pid
-            channel['last_started'] = datetime.now().isoformat()
-            
-            # حفظ PID في ملف
-            pid_file = os.path.join(PROCESS_DIR, f"channel_{channel_id}.pid")
-            with open(pid_file, 'w') as f:
-                f.write(str(process.pid))
-            
-            # بدء مراقبة العملية في خيط منفصل
-            monitor_thread = threading.Thread(
-                target=self.monitor_channel,
-                args=(channel_id, process)
-            )
-            monitor_thread.daemon = True
-            monitor_thread.start()
+            self.transition(channel_id, ('starting',), 'running',
+                            pid=process.pid, last_started=datetime.now().isoformat())
+            
+            # حفظ PID ووقت إنشاء العملية (لمطابقتها بعد إعادة تشغيل المدير)
+            self.write_pid_file(channel_id, process.pid)
+            
+            # تسليم العملية للمراقب المركزي
+            self.supervisor.watch(channel_id, process, channel.get('stall_timeout', STALL_TIMEOUT))
+            self.start_queue.mark_warming(channel_id)
+            CHANNEL_START_SECONDS.observe(time.perf_counter() - started)
             
             logger.info(f"تم تشغيل القناة {channel['name']} (PID: {process.pid})")
+            from_revision = self.mark_changed(channel_id)
             socketio.emit('channel_status', {
                 'channel_id': channel_id,
                 'status': 'running',
-                'pid': process.pid
+                'pid': process.pid,
+                **self.get_changes(from_revision)
             })
             
-            return {'success': True, 'pid': process.pid}
+            return {'success': True, 'pid': process.pid, 'cpus': allocation['cpus'], 'mode': encoding['mode']}
             
         except Exception as e:
+            self.capacity.release(channel_id)
+            self.transition(channel_id, ('starting',), previous)
             logger.error(f"خطأ في تشغيل القناة {channel_id}: {e}")
             return {'success': False, 'message': str(e)}
     
-    def build_ffmpeg_command(self, channel):
-        """بناء أمر FFmpeg للقناة"""
-        cmd_parts = ['ffmpeg']
+    @staticmethod
+    def configured_mode(channel):
+        """وضع الترميز المطلوب: mode أو حقل transcode القديم للقنوات التي لا تملكه"""
+        return channel.get('mode') or ('transcode' if channel.get('transcode', True) else 'copy')
+    
+    def plan_encoding(self, channel):
+        """{'mode', 'reason', 'hints'} للتشغيل من الفحص المخزن فقط؛ لا انتظار لـ ffprobe في مسار التشغيل"""
+        mode = self.configured_mode(channel)
+        if mode == 'auto':
+            probe = self.prober.lookup(channel['source_url'])
+            if probe is None:
+                # أول تشغيل قبل اكتمال الفحص: ترميز كامل آمن، والتشغيل التالي يستخدم النتيجة
+                return {'mode': 'transcode', 'reason': 'المصدر لم يُفحص بعد', 'hints': []}
+            mode, reason = choose_mode(probe, self.get_outputs(channel))
+        else:
+            probe = self.prober.get(channel['source_url'])
+            reason = 'إعداد يدوي'
+        return {'mode': mode, 'reason': reason, 'hints': input_hints(probe)}
+    
+    @staticmethod
+    def get_outputs(channel):
+        """مخرجات القناة: قائمة الدقات (renditions) إن وجدت وإلا المخرج الوحيد"""
+        return channel.get('renditions') or [channel['output']]
+    
+    @staticmethod
+    def output_url(output):
+        """رابط المخرج حسب البروتوكول"""
+        protocol = output.get('protocol', 'udp')
+        if protocol == 'udp':
+            return f"udp://{output['address']}:{output['port']}?pkt_size=1316&ttl=32"
+        return f"{protocol}://{output['address']}:{output['port']}"
+    
+    def ffmpeg_argv(self, channel, allocation=None):
+        """argv القناة من الذاكرة؛ يُعاد بناؤه فقط عند تغير الإعدادات التي تدخل فيه"""
+        config = {field: channel.get(field) for field in ARGV_FIELDS}
+        config['threads'] = allocation['threads'] if allocation else 0
+        key = hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode('utf-8')).digest()
+        cached = self._argv_cache.get(channel['id'])
+        if cached and cached[0] == key:
+            return cached[1]
+        argv = tuple(self.build_ffmpeg_command(channel, allocation))
+        self._argv_cache[channel['id']] = (key, argv)
+        return argv
+    
+    def build_ffmpeg_command(self, channel, allocation=None):
+        """بناء argv الـ FFmpeg للقناة (عملية واحدة لكل الدقات)"""
+        cmd_parts = ['ffmpeg', '-nostdin']
+        
+        # تقرير تقدم منظم على stdout (يقرؤه المراقب المركزي) بدلاً من سطر الحالة في السجل
+        cmd_parts.extend(['-nostats', '-progress', 'pipe:1', '-stats_period', str(PROGRESS_PERIOD)])
         
         # إضافة خيارات إعادة الاتصال
         cmd_parts.extend([
@@ -246,113 +1863,372 @@ class ChannelManager:
             '-reconnect_delay_max', '5'
         ])
         
-        # مصدر الفيديو
-        cmd_parts.extend(['-i', f"'{channel['source_url']}'"])
-        
-        # إذا كان التحويل مفعلاً
-        if channel.get('transcode', True):
-            cmd_parts.extend([
-                '-vf', f"scale={channel['output']['resolution']}",
-                '-c:v', 'libx264',
-                '-preset', 'veryfast',
-                '-b:v', channel['output']['bitrate'],
-                '-c:a', 'aac',
-                '-b:a', '128k',
-                '-ac', '2'
-            ])
-        else:
-            cmd_parts.extend(['-c:v', 'copy', '-c:a', 'copy'])
+        outputs = self.get_outputs(channel)
+        mode = channel.get('encode_mode') or ('transcode' if channel.get('transcode', True) else 'copy')
+        transcode = mode == 'transcode'
+        multi = len(outputs) > 1
+        threads = max(1, allocation['threads'] // len(outputs)) if allocation else 0
         
-        # المخرج
-        output = channel['output']
-        cmd_parts.extend([
-            '-f', 'mpegts',
-            f"'udp://{output['address']}:{output['port']}?pkt_size=1316&ttl=32'"
-        ])
+        # ملف الترميز (مع البديل إذا لم يتوفر المرمز على هذا الخادم)
+        _, profile = resolve_profile(self.encoder_profiles, channel.get('profile', DEFAULT_PROFILE))
+        if transcode:
+            cmd_parts.extend(profile.get('input_args', []))
+        
+        # مصدر الفيديو (مع تحليل أقصر إذا كان المصدر مفحوصاً مسبقاً)
+        cmd_parts.extend(channel.get('input_hints') or [])
+        cmd_parts.extend(['-i', channel['source_url']])
+        
+        scale_suffix = f",{profile['filter']}" if profile.get('filter') else ''
         
-        # إضافة السجلات
-        log_file = os.path.join(LOG_DIR, f"channel_{channel['id']}.log")
-        cmd_parts.extend(['2>>', f"'{log_file}'"])
+        # فك الترميز مرة واحدة ثم تفريع الصورة لكل دقة
+        if transcode and multi:
+            graph = [f"[0:v]split={len(outputs)}" + ''.join(f"[v{i}]" for i in range(len(outputs)))]
+            graph += [f"[v{i}]scale={output['resolution']}{scale_suffix}[out{i}]"
+                      for i, output in enumerate(outputs)]
+            cmd_parts.extend(['-filter_complex', ';'.join(graph)])
         
-        return ' '.join(cmd_parts)
+        for i, output in enumerate(outputs):
+            # إذا كان التحويل مفعلاً
+            if transcode:
+                if multi:
+                    cmd_parts.extend(['-map', f"[out{i}]", '-map', '0:a?'])
+                else:
+                    cmd_parts.extend(['-vf', f"scale={output['resolution']}{scale_suffix}"])
+                cmd_parts.extend(video_args(profile, output['bitrate'], threads))
+                cmd_parts.extend(audio_args(profile))
+            else:
+                if multi:
+                    cmd_parts.extend(['-map', '0:v', '-map', '0:a?'])
+                cmd_parts.extend(['-c:v', 'copy'])
+                cmd_parts.extend(audio_args(profile) if mode == 'audio' else ['-c:a', 'copy'])
+            
+            # المخرج
+            cmd_parts.extend(['-f', 'mpegts', self.output_url(output)])
+        
+        # السجلات: stderr يُوجه إلى ملف القناة عند التشغيل (spawn_process)
+        return cmd_parts
     
+    @instrumented
     def stop_channel(self, channel_id, force=False):
         """إيقاف قناة محددة"""
-        if channel_id not in self.channels:
+        channel = self.channels.get(channel_id)
+        if channel is None:
             return {'success': False, 'message': 'القناة غير موجودة'}
         
-        channel = self.channels[channel_id]
-        
-        if channel['status'] != 'running' or not channel['pid']:
-            return {'success': False, 'message': 'القناة غير قيد التشغيل'}
+        # حالة وسيطة حتى لا يُعامل الخروج كانهيار يستدعي إعادة التشغيل، ولا يُنفذ إيقافان معاً
+        with self.channel_lock(channel_id):
+            # قناة في منتصف تشغيل أو إيقاف: رد مميز بلا أي أثر جانبي (إعادة التشغيل المجدولة تبقى)
+            if channel['status'] in ('starting', 'stopping'):
+                return {'success': False, 'reason': 'busy',
+                        'message': f"القناة في حالة انتقالية ({channel['status']})، حاول مجدداً"}
+            
+            # إلغاء أي إعادة تشغيل مجدولة أو تشغيل ينتظر في الطابور حتى لو كانت القناة متوقفة حالياً
+            self.supervisor.cancel_restart(channel_id)
+            cancelled = self.start_queue.cancel(channel_id)
+            
+            if channel['status'] != 'running' or not channel['pid']:
+                if cancelled:
+                    return {'success': True, 'cancelled': True, 'message': 'أُلغي تشغيل القناة المنتظر'}
+                return {'success': False, 'message': 'القناة غير قيد التشغيل'}
+            channel['status'] = 'stopping'
+            pid = channel['pid']
         
+        started = time.perf_counter()
         try:
-            if force:
-                os.kill(channel['pid'], signal.SIGKILL)
-            else:
-                os.kill(channel['pid'], signal.SIGTERM)
-            
-            # الانتظار قليلاً والتأكد من الإيقاف
-            time.sleep(1)
             try:
-                os.kill(channel['pid'], 0)  # التحقق إذا كانت العملية لا تزال تعمل
-                os.kill(channel['pid'], signal.SIGKILL)  # إذا لا تزال تعمل، قتلها
-            except OSError:
+                os.kill(pid, signal.SIGKILL if force else signal.SIGTERM)
+                
+                # انتظار حدث الخروج من المراقب، ثم القتل إذا تجاوزت المهلة
+                if not self.supervisor.wait_for_exit(pid, STOP_TIMEOUT):
+                    os.kill(pid, signal.SIGKILL)
+                    self.supervisor.wait_for_exit(pid, 1)
+            except ProcessLookupError:
                 pass  # العملية توقفت بالفعل
             
             # تحديث الحالة
-            channel['status'] = 'stopped'
-            channel['pid'] = None
+            self.transition(channel_id, ('stopping',), 'stopped', pid=None)
+            CHANNEL_STOP_SECONDS.observe(time.perf_counter() - started)
+            self.capacity.release(channel_id)
+            self.start_queue.release(channel_id)
             
             # حذف ملف PID
-            pid_file = os.path.join(PROCESS_DIR, f"channel_{channel_id}.pid")
-            if os.path.exists(pid_file):
-                os.remove(pid_file)
+            self.remove_pid_file(channel_id)
             
             logger.info(f"تم إيقاف القناة {channel['name']}")
+            from_revision = self.mark_changed(channel_id)
             socketio.emit('channel_status', {
                 'channel_id': channel_id,
-                'status': 'stopped'
+                'status': 'stopped',
+                **self.get_changes(from_revision)
             })
             
             return {'success': True}
             
         except Exception as e:
+            self.transition(channel_id, ('stopping',), 'running')
             logger.error(f"خطأ في إيقاف القناة {channel_id}: {e}")
             return {'success': False, 'message': str(e)}
     
-    def monitor_channel(self, channel_id, process):
-        """مراقبة حالة القناة"""
-        channel = self.channels[channel_id]
+    def handle_exit(self, channel_id, process):
+        """معالجة خروج عملية قناة (يُستدعى من المراقب المركزي)"""
+        channel = self.channels.get(channel_id)
         
-        while True:
-            time.sleep(10)  # التحقق كل 10 ثواني
+        if not channel:
+            return
+        
+        # إيقاف مقصود أو عملية قديمة استُبدلت
+        with self.channel_lock(channel_id):
+            if channel['pid'] != process.pid or channel['status'] != 'running':
+                return
+            channel['status'] = 'stopped'
+            channel['pid'] = None
+        
+        logger.warning(f"القناة {channel['name']} توقفت (كود الخروج: {process.returncode})")
+        self.capacity.release(channel_id)
+        self.start_queue.release(channel_id)
+        
+        restart_in = None
+        if channel.get('auto_restart', True) and channel['enabled']:
+            restart_in = self.supervisor.schedule_restart(channel_id)
+            if restart_in is None:
+                self.transition(channel_id, ('stopped',), 'failed')
+                logger.error(f"القناة {channel['name']} تنهار بشكل متكرر، تم إيقاف إعادة التشغيل التلقائي")
+            else:
+                logger.info(f"إعادة تشغيل القناة {channel['name']} بعد {restart_in:.1f} ثانية")
+        
+        # بدون إعادة تشغيل قادمة لا تُعد القناة "كانت تعمل" عند إعادة تشغيل المدير
+        if restart_in is None:
+            self.remove_pid_file(channel_id)
+        
+        # إشعار الواجهة
+        from_revision = self.mark_changed(channel_id)
+        socketio.emit('channel_stopped', {
+            'channel_id': channel_id,
+            'exit_code': process.returncode,
+            'restart_in': restart_in,
+            **self.get_changes(from_revision)
+        })
+    
+    def write_pid_file(self, channel_id, pid):
+        try:
+            create_time = psutil.Process(pid).create_time()
+        except psutil.NoSuchProcess:
+            create_time = 0
+        with open(channel_pid_path(channel_id), 'w') as f:
+            f.write(f"{pid} {create_time!r}")
+    
+    def remove_pid_file(self, channel_id):
+        """حذف ملف PID القناة وأنبوب تقدمها"""
+        for path in (channel_pid_path(channel_id), channel_progress_path(channel_id)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    
+    def read_pid_files(self):
+        """{channel_id: (pid, create_time أو None للصيغة القديمة)} من مجلد العمليات"""
+        recorded = {}
+        for pid_file in glob.glob(os.path.join(PROCESS_DIR, 'channel_*.pid')):
+            channel_id = os.path.basename(pid_file)[len('channel_'):-len('.pid')]
+            try:
+                with open(pid_file) as f:
+                    parts = f.read().split()
+                recorded[channel_id] = (int(parts[0]), float(parts[1]) if len(parts) > 1 else None)
+            except (OSError, ValueError, IndexError):
+                recorded[channel_id] = None
+        return recorded
+    
+    def adopt_processes(self):
+        """مطابقة بدء التشغيل: إعادة ربط عمليات FFmpeg الحية من المدير السابق بدلاً من قتلها أو تكرارها
+        
+        ملفات PID ومرور واحد على جدول العمليات؛ العملية تُقبل إذا كانت ffmpeg بنفس وقت الإنشاء
+        وفي سطر أوامرها مخارج القناة الحالية. يُرجع القنوات التي كانت تعمل وفُقدت عمليتها.
+        """
+        recorded = self.read_pid_files()
+        
+        live = {}        # pid -> معلومات العملية
+        by_output = {}   # رابط مخرج في سطر الأوامر -> معلومات العملية
+        for proc in psutil.process_iter(['pid', 'cmdline', 'create_time']):
+            info = proc.info
+            cmdline = info['cmdline'] or []
+            if not cmdline or os.path.basename(cmdline[0]) != 'ffmpeg':
+                continue
+            live[info['pid']] = info
+            for arg in cmdline:
+                if '://' in arg:
+                    by_output.setdefault(arg, info)
+        
+        adopted, lost = [], []
+        claimed = set()
+        for channel_id, channel in self.channels.items():
+            outputs = [self.output_url(output) for output in self.get_outputs(channel)]
+            entry = recorded.get(channel_id)
+            info = None
+            if entry:
+                candidate = live.get(entry[0])
+                if (candidate and (entry[1] is None or abs(candidate['create_time'] - entry[1]) < 0.01)
+                        and set(outputs) <= set(candidate['cmdline'])):
+                    info = candidate
+            if info is None and outputs:
+                # PID قديم (صدفة الإصدارات السابقة) أو ملف مفقود: البحث بمخرج القناة
+                candidate = by_output.get(outputs[0])
+                if (candidate and channel['source_url'] in candidate['cmdline']
+                        and set(outputs) <= set(candidate['cmdline'])):
+                    info = candidate
             
-            # التحقق إذا كانت العملية لا تزال تعمل
-            if process.poll() is not None:
-                logger.warning(f"القناة {channel['name']} توقفت (كود الخروج: {process.returncode})")
-                
-                # تحديث الحالة
-                channel['status'] = 'stopped'
-                channel['pid'] = None
-                
-                # إشعار الواجهة
-                socketio.emit('channel_stopped', {
-                    'channel_id': channel_id,
-                    'exit_code': process.returncode
-                })
-                
-                # إعادة التشغيل التلقائي إذا مطلوب
-                if channel.get('auto_restart', True):
-                    time.sleep(5)
-                    if channel['enabled']:
-                        logger.info(f"إعادة تشغيل القناة {channel['name']} تلقائياً")
-                        self.start_channel(channel_id)
-                
-                break
+            if info is None or info['pid'] in claimed:
+                with self.channel_lock(channel_id):
+                    if channel['status'] != 'failed':
+                        channel['status'] = 'stopped'
+                    channel['pid'] = None
+                if entry is not None:
+                    self.remove_pid_file(channel_id)
+                    lost.append(channel_id)
+                continue
+            
+            claimed.add(info['pid'])
+            self.adopt(channel_id, info['pid'], info['create_time'], info['cmdline'])
+            adopted.append(channel_id)
+        
+        # عمليات سجلناها نحن (ملف PID + وقت إنشاء مطابق) لكنها لم تعد تطابق أي قناة
+        for channel_id, entry in recorded.items():
+            if not entry or entry[0] in claimed:
+                continue
+            info = live.get(entry[0])
+            if info and entry[1] is not None and abs(info['create_time'] - entry[1]) < 0.01:
+                logger.warning(f"إيقاف عملية FFmpeg يتيمة (PID: {entry[0]}) لقناة {channel_id}")
+                try:
+                    os.killpg(entry[0], signal.SIGTERM)
+                except (ProcessLookupError, PermissionError):
+                    pass
+            if channel_id not in self.channels:
+                self.remove_pid_file(channel_id)
+        
+        if adopted or lost:
+            logger.info(f"مطابقة العمليات: {len(adopted)} قناة أُعيد ربطها، {len(lost)} فقدت عمليتها")
+        return lost
+    
+    def adopt(self, channel_id, pid, create_time, cmdline=()):
+        """إعادة ربط عملية FFmpeg حية بالقناة (الحالة، وضع الترميز، السعة، المراقب)"""
+        channel = self.channels[channel_id]
+        with self.channel_lock(channel_id):
+            channel['status'] = 'running'
+            channel['pid'] = pid
+            channel['last_started'] = datetime.fromtimestamp(create_time).isoformat()
+        
+        # الكلفة حسب ما تشغله العملية فعلاً لا حسب الترميز الكامل
+        encoding = self.adopted_encoding(channel, cmdline)
+        self._encoding[channel_id] = encoding
+        if self.configured_mode(channel) == 'auto':
+            self.prober.submit(channel['source_url'])
+        
+        encoder_profile, _ = resolve_profile(self.encoder_profiles, channel.get('profile', DEFAULT_PROFILE))
+        profile = self.capacity.profile_key(dict(channel, encode_mode=encoding['mode']), encoder_profile)
+        # العملية تعمل بالفعل: تُحسب دائماً حتى لا يتجاوز التشغيل اللاحق الميزانية
+        self.capacity.admit(channel_id, profile, force=True)
+        if self.capacity.committed() > self.capacity.budget:
+            logger.warning(f"القناة {channel['name']} أُعيد ربطها فوق ميزانية المعالج")
+        
+        # أنبوب -progress المسمى بقي مع العملية: التقدم المتراكم يُقرأ ويستمر كشف التجمد
+        stdout = open_progress_reader(channel_progress_path(channel_id))
+        self.supervisor.watch(channel_id, AdoptedProcess(pid, create_time, stdout),
+                              channel.get('stall_timeout', STALL_TIMEOUT) if stdout else None)
+        self.write_pid_file(channel_id, pid)
+        logger.info(f"أُعيد ربط القناة {channel['name']} بعمليتها الحية (PID: {pid})")
+    
+    def adopted_encoding(self, channel, cmdline):
+        """{'mode', 'reason', 'hints'} لعملية أُعيد ربطها: من argv الحي إن وجد، وإلا من الإعداد والفحص المخزن"""
+        mode = self.configured_mode(channel)
+        if cmdline:
+            pairs = set(zip(cmdline, cmdline[1:]))
+            if ('-c:v', 'copy') not in pairs:
+                mode = 'transcode'
+            else:
+                mode = 'copy' if ('-c:a', 'copy') in pairs else 'audio'
+            reason = 'من سطر أوامر العملية الحية'
+        elif mode == 'auto':
+            mode, reason = choose_mode(self.prober.get(channel['source_url']), self.get_outputs(channel))
+        else:
+            reason = 'إعداد يدوي'
+        
+        hints = []
+        for i, arg in enumerate(cmdline[:-1]):
+            if arg in ('-analyzeduration', '-probesize'):
+                hints.extend([arg, cmdline[i + 1]])
+        return {'mode': mode, 'reason': reason, 'hints': hints}
+    
+    def record_progress(self, channel_id, fields):
+        """تسجيل كتلة تقدم في الحلقة الحية وفي السلاسل الزمنية"""
+        sample = self.progress.record(channel_id, fields)
+        self.metrics.add_many(channel_id, {'fps': sample.get('fps'),
+                                           'bitrate_kbps': sample.get('bitrate_kbps'),
+                                           'speed': sample.get('speed')}, sample['time'])
+    
+    def handle_stall(self, channel_id, pid, stalled_for):
+        """عملية حية بلا تقدم: قتلها ليعاملها معالج الخروج كانهيار (إعادة تشغيل مع تراجع)"""
+        channel = self.channels.get(channel_id)
+        if not channel or channel['pid'] != pid or channel['status'] != 'running':
+            return
+        
+        logger.warning(f"القناة {channel['name']} متجمدة منذ {stalled_for:.1f} ثانية، إعادة تشغيلها")
+        self.update_channel(channel_id, last_stall=datetime.now().isoformat(),
+                            stall_count=channel.get('stall_count', 0) + 1)
+        CHANNEL_STALLS.inc(channel=channel_id)
+        socketio.emit('channel_stalled', {'channel_id': channel_id, 'stalled_for': round(stalled_for, 1)})
+        try:
+            # مجموعة العمليات كاملة (FFmpeg وأي عملية فرعية له)
+            os.killpg(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    
+    def restart_channel(self, channel_id):
+        """إعادة التشغيل التلقائي عند حلول موعدها"""
+        channel = self.channels.get(channel_id)
+        if channel and channel['enabled'] and channel['status'] == 'stopped':
+            logger.info(f"إعادة تشغيل القناة {channel['name']} تلقائياً")
+            CHANNEL_RESTARTS.inc(channel=channel_id)
+            self.start_queue.submit(channel_id, self.start_priority(channel))
+    
+    def request_start(self, channel_id, timeout=START_REQUEST_TIMEOUT):
+        """تشغيل يدوي عبر طابور التشغيل: أولوية فورية بنفس حد المعدل، ورفض السعة يُرجع مباشرة"""
+        if channel_id not in self.channels:
+            return {'success': False, 'message': 'القناة غير موجودة'}
+        future = self.start_queue.submit(channel_id, PRIORITY_MANUAL, retry_capacity=False)
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            return {'success': True, 'queued': True, 'message': 'القناة في طابور التشغيل وستبدأ قريباً'}
+    
+    def start_priority(self, channel):
+        """أولوية القناة في طابور التشغيل"""
+        if channel.get('priority'):
+            return PRIORITY_FLAGGED
+        if channel.get('auto_start'):
+            return PRIORITY_AUTO_START
+        return PRIORITY_DEFAULT
     
     def setup_scheduler(self):
         """إعداد الجدولة التلقائية"""
+        # مهمة أخذ عينات إحصائيات القنوات العاملة
+        self.scheduler.add_job(
+            func=self.sample_channel_stats,
+            trigger='interval',
+            seconds=STATS_SAMPLE_INTERVAL,
+            id='sample_stats',
+            max_instances=1,
+            coalesce=True
+        )
+        
+        # مهمة عينات النظام للسلاسل الزمنية
+        self.scheduler.add_job(
+            func=self.sample_system_metrics,
+            trigger='interval',
+            seconds=SYSTEM_SAMPLE_INTERVAL,
+            id='sample_system',
+            max_instances=1,
+            coalesce=True
+        )
+        
         # مهمة تحديث إحصائيات النظام كل دقيقة
         self.scheduler.add_job(
             func=self.update_system_stats,
@@ -370,13 +2246,189 @@ class ChannelManager:
             id='cleanup_logs'
         )
         
-        # مهمة التشغيل التلقائي حسب الجدولة
-        self.scheduler.add_job(
-            func=self.auto_start_scheduled,
-            trigger='interval',
-            seconds=300,  # كل 5 دقائق
-            id='auto_start'
-        )
+        # مهمة لقطات القنوات المجدولة (بدلاً من نسخة مع كل حفظ)
+        if SNAPSHOT_INTERVAL_HOURS > 0:
+            self.scheduler.add_job(
+                func=self.snapshot_channels,
+                trigger='interval',
+                hours=SNAPSHOT_INTERVAL_HOURS,
+                id='snapshot_channels',
+                max_instances=1,
+                coalesce=True
+            )
+        
+        # مهمة مزامنة قائمة المزود
+        if PLAYLIST_URL and PLAYLIST_SYNC_MINUTES > 0:
+            self.scheduler.add_job(
+                func=self.scheduled_playlist_sync,
+                trigger='interval',
+                minutes=PLAYLIST_SYNC_MINUTES,
+                id='playlist_sync',
+                max_instances=1,
+                coalesce=True
+            )
+        
+        # مهمة تحديث فحوصات المصادر قبل انتهاء صلاحيتها
+        if PROBE_REFRESH_MINUTES > 0:
+            self.scheduler.add_job(
+                func=self.refresh_probes,
+                trigger='interval',
+                minutes=PROBE_REFRESH_MINUTES,
+                id='refresh_probes',
+                max_instances=1,
+                coalesce=True
+            )
+        
+        # قياس مدة كل مهمة في /metrics
+        for job in self.scheduler.get_jobs():
+            job.modify(func=timed_call(SCHEDULER_JOB_SECONDS, job.func, job=job.id))
+    
+    def sample_channel_stats(self):
+        """مسح واحد لإحصائيات كل عمليات FFmpeg العاملة"""
+        try:
+            targets = {channel_id: channel['pid'] 
+                       for channel_id, channel in list(self.channels.items())
+                       if channel['status'] == 'running' and channel['pid']}
+            self.stats_sampler.sweep(targets)
+            
+            # تسجيل السلاسل الزمنية وتعلم كلفة الملفات من القنوات التي تجاوزت مرحلة الإحماء
+            warm_before = (datetime.now() - timedelta(seconds=WARMUP_SECONDS)).isoformat()
+            for channel_id in targets:
+                stats = self.stats_sampler.get(channel_id)
+                if not stats:
+                    continue
+                self.metrics.add_many(channel_id, {'cpu_percent': stats['cpu_percent'],
+                                                   'rss': stats['rss']}, stats['sampled_at'])
+                channel = self.channels.get(channel_id)
+                if channel and (channel.get('last_started') or '') < warm_before:
+                    self.capacity.learn(channel_id, stats['cpu_percent'])
+            
+            # الإحصائيات الحية في حدث خفيف خاص بها؛ سجل التغييرات يبقى لتغيرات الحالة الفعلية
+            if targets:
+                now = datetime.now()
+                live = {}
+                for channel_id in targets:
+                    stats = self.stats_sampler.get(channel_id)
+                    channel = self.channels.get(channel_id)
+                    if not stats or not channel or not channel.get('last_started'):
+                        continue
+                    live[channel_id] = {
+                        'cpu_percent': stats['cpu_percent'],
+                        'memory_percent': stats['memory_percent'],
+                        'rss': stats['rss'],
+                        'uptime': round((now - datetime.fromisoformat(channel['last_started'])).total_seconds())
+                    }
+                socketio.emit('channel_stats', {'stats': live})
+        except Exception as e:
+            logger.error(f"خطأ في أخذ عينات إحصائيات القنوات: {e}")
+    
+    def sample_system_metrics(self):
+        """عينة النظام لمخزن السلاسل الزمنية (استدعاءات psutil غير حاجبة فقط)"""
+        try:
+            now = time.time()
+            net = psutil.net_io_counters()
+            values = {
+                'cpu_percent': psutil.cpu_percent(None),
+                'memory_percent': psutil.virtual_memory().percent,
+                'running_channels': sum(1 for ch in self.channels.values() if ch['status'] == 'running')
+            }
+            if self._net_last:
+                elapsed = now - self._net_last[0]
+                if elapsed > 0:
+                    values['net_rx_bps'] = (net.bytes_recv - self._net_last[1].bytes_recv) * 8 / elapsed
+                    values['net_tx_bps'] = (net.bytes_sent - self._net_last[1].bytes_sent) * 8 / elapsed
+            self._net_last = (now, net)
+            self._system_last = values
+            self.metrics.add_many('system', values, now)
+        except Exception as e:
+            logger.error(f"خطأ في أخذ عينات النظام: {e}")
+    
+    def query_metrics(self, entity, metrics=None, start=None, end=None, step=None):
+        """سلاسل كيان (قناة أو system) بين وقتين؛ القيم السالبة نسبية للآن"""
+        now = time.time()
+        end = now if end is None else (now + end if end <= 0 else end)
+        start = end - 3600 if start is None else (now + start if start <= 0 else start)
+        return {
+            'entity': entity,
+            'from': start,
+            'to': end,
+            'series': {metric: self.metrics.query(entity, metric, start, end, step)
+                       for metric in (metrics or self.metrics.metrics(entity))}
+        }
+    
+    def collect_metrics(self):
+        """مقاييس القنوات والنظام من الحالة المخزنة (آخر مسح وآخر كتلة تقدم) لـ /metrics"""
+        up = Gauge('iptv_channel_up', 'Channel FFmpeg process is running', ['channel', 'name'])
+        uptime = Gauge('iptv_channel_uptime_seconds', 'Seconds since the channel process started', ['channel'])
+        cpu = Gauge('iptv_channel_cpu_percent', 'FFmpeg CPU usage from the last stats sweep', ['channel'])
+        rss = Gauge('iptv_channel_rss_bytes', 'FFmpeg resident memory from the last stats sweep', ['channel'])
+        fps = Gauge('iptv_channel_fps', 'Encoding frames per second from -progress', ['channel'])
+        bitrate = Gauge('iptv_channel_bitrate_kbps', 'Output bitrate from -progress', ['channel'])
+        speed = Gauge('iptv_channel_speed', 'Encoding speed relative to real time', ['channel'])
+        drops = Gauge('iptv_channel_drop_frames', 'Frames dropped since the process started', ['channel'])
+        saved = Gauge('iptv_channel_cpu_saved_cores', 'Estimated cores saved by copy or audio-only mode', ['channel', 'mode'])
+        by_status = Gauge('iptv_channels', 'Channels by status', ['status'])
+        
+        now = datetime.now()
+        counts = {}
+        for channel_id, channel in list(self.channels.items()):
+            status = channel['status']
+            counts[status] = counts.get(status, 0) + 1
+            running = status == 'running' and bool(channel['pid'])
+            up.set(1 if running else 0, channel=channel_id, name=channel['name'])
+            if not running:
+                continue
+            if channel.get('last_started'):
+                uptime.set(round((now - datetime.fromisoformat(channel['last_started'])).total_seconds(), 1),
+                           channel=channel_id)
+            stats = self.stats_sampler.get(channel_id)
+            if stats:
+                cpu.set(stats['cpu_percent'], channel=channel_id)
+                rss.set(stats['rss'], channel=channel_id)
+            savings = self.encoding_savings(channel_id, channel, stats)
+            if savings and savings['mode'] != 'transcode':
+                saved.set(savings['saved_cores'], channel=channel_id, mode=savings['mode'])
+            sample = self.progress.latest(channel_id)
+            if sample:
+                for gauge, key in ((fps, 'fps'), (bitrate, 'bitrate_kbps'), (speed, 'speed'), (drops, 'drop_frames')):
+                    if sample.get(key) is not None:
+                        gauge.set(sample[key], channel=channel_id)
+        for status, count in counts.items():
+            by_status.set(count, status=status)
+        
+        queue = Gauge('iptv_start_queue_depth', 'Channels waiting in the start queue')
+        warming = Gauge('iptv_start_queue_warming', 'Channels in warm-up after start')
+        queue_metrics = self.start_queue.metrics()
+        queue.set(queue_metrics['queue_depth'])
+        warming.set(queue_metrics['warming'])
+        
+        committed = Gauge('iptv_capacity_committed_cores', 'CPU cores committed to running channels')
+        budget = Gauge('iptv_capacity_budget_cores', 'CPU cores available to channels')
+        capacity = self.capacity.report()
+        committed.set(capacity['committed_cores'])
+        budget.set(capacity['budget_cores'])
+        
+        pool_used = Gauge('iptv_output_pool_used', 'Allocated outputs per pool', ['pool'])
+        pool_size = Gauge('iptv_output_pool_size', 'Outputs per pool', ['pool'])
+        for pool in self.outputs.report()['pools']:
+            pool_used.set(pool['used'], pool=pool['pool'])
+            pool_size.set(pool['size'], pool=pool['pool'])
+        
+        host = Gauge('iptv_host', 'Last host sample (cpu_percent, memory_percent, net_rx_bps, net_tx_bps)', ['metric'])
+        for metric, value in self._system_last.items():
+            if metric != 'running_channels':
+                host.set(round(value, 2), metric=metric)
+        
+        return [up, uptime, cpu, rss, fps, bitrate, speed, drops, saved, by_status,
+                queue, warming, committed, budget, pool_used, pool_size, host]
+    
+    def render_metrics(self):
+        """نص مقاييس المتحكم وعمال الويب مجمعة بصيغة Prometheus"""
+        return CONTROL_METRICS.render() + self.web_metrics.render()
+    
+    def push_web_metrics(self, worker, snapshot):
+        """فروق مقاييس عامل ويب (WEB_METRICS.drain())"""
+        self.web_metrics.push(worker, snapshot)
     
     def update_system_stats(self):
         """تحديث إحصائيات النظام"""
@@ -387,7 +2439,8 @@ class ChannelManager:
                 'memory_percent': psutil.virtual_memory().percent,
                 'disk_usage': psutil.disk_usage('/').percent,
                 'network_io': psutil.net_io_counters()._asdict(),
-                'running_channels': sum(1 for ch in self.channels.values() if ch['status'] == 'running')
+                'running_channels': sum(1 for ch in self.channels.values() if ch['status'] == 'running'),
+                'start_queue': self.start_queue.metrics()
             }
             
             socketio.emit('system_stats', stats)
@@ -395,29 +2448,31 @@ class ChannelManager:
         except Exception as e:
             logger.error(f"خطأ في تحديث الإحصائيات: {e}")
     
-    def auto_start_scheduled(self):
-        """التشغيل التلقائي للقنوات المجدولة"""
-        current_time = datetime.now().strftime('%H:%M')
+    def reschedule(self, channel_id, reconcile=True):
+        """تسجيل جدول القناة في محرك الجدولة، أو إلغاؤه إذا لم تعد القناة مجدولة"""
+        channel = self.channels.get(channel_id)
+        if not channel or not (channel['enabled'] and channel.get('auto_start', False)):
+            self.schedule.remove(channel_id)
+            return
+        try:
+            self.schedule.update(channel_id, channel.get('schedule'), reconcile)
+        except ValueError as e:
+            self.schedule.remove(channel_id)
+            logger.error(f"جدول غير صالح للقناة {channel['name']}: {e}")
+    
+    def apply_schedule(self, channel_id, action):
+        """تنفيذ حدث جدولة (تشغيل أو إيقاف) عند حلول موعده"""
+        channel = self.channels.get(channel_id)
+        if not channel or not channel['enabled'] or not channel.get('auto_start', False):
+            return
         
-        for channel_id, channel in self.channels.items():
-            if channel['enabled'] and channel.get('auto_start', False):
-                schedule = channel.get('schedule', {})
-                
-                if schedule.get('daily', False):
-                    start_time = schedule.get('start_time', '00:00')
-                    stop_time = schedule.get('stop_time', '23:59')
-                    
-                    # إذا كان الوقت بين بداية ونهاية التشغيل والقناة متوقفة
-                    if (start_time <= current_time <= stop_time and 
-                        channel['status'] == 'stopped'):
-                        logger.info(f"تشغيل القناة {channel['name']} تلقائياً حسب الجدولة")
-                        self.start_channel(channel_id)
-                    
-                    # إذا كان الوقت خارج ساعات التشغيل والقناة تعمل
-                    elif ((current_time < start_time or current_time > stop_time) and 
-                          channel['status'] == 'running'):
-                        logger.info(f"إيقاف القناة {channel['name']} تلقائياً حسب الجدولة")
-                        self.stop_channel(channel_id)
+        if action == 'start' and channel['status'] == 'stopped':
+            logger.info(f"تشغيل القناة {channel['name']} تلقائياً حسب الجدولة")
+            self.start_queue.submit(channel_id, self.start_priority(channel))
+        elif action == 'stop' and channel['status'] == 'running':
+            logger.info(f"إيقاف القناة {channel['name']} تلقائياً حسب الجدولة")
+            # الإيقاف ينتظر خروج العملية: خارج خيط الجدولة حتى لا تتأخر الأحداث الأخرى
+            self.batch_executor.submit(self.stop_channel, channel_id)
     
     def cleanup_old_logs(self, days=7):
         """تنظيف السجلات القديمة"""
@@ -436,34 +2491,501 @@ class ChannelManager:
         except Exception as e:
             logger.error(f"خطأ في تنظيف السجلات: {e}")
     
+    @instrumented
     def get_channel_info(self, channel_id):
         """الحصول على معلومات القناة"""
         if channel_id in self.channels:
-            channel = self.channels[channel_id].copy()
+            channel = self.channel_snapshot(channel_id)
             
-            # إضافة معلومات حية إذا كانت القناة تعمل
+            # إضافة آخر إحصائيات حية من جامع العينات إذا كانت القناة تعمل
             if channel['status'] == 'running' and channel['pid']:
+                stats = self.stats_sampler.get(channel_id)
+                channel['stats'] = dict(stats) if stats else {
+                    'cpu_percent': 0, 'memory_percent': 0, 'rss': 0}
                 try:
-                    process = psutil.Process(channel['pid'])
-                    channel['stats'] = {
-                        'cpu_percent': process.cpu_percent(),
-                        'memory_percent': process.memory_percent(),
-                        'uptime': (datetime.now() - 
-                                  datetime.fromisoformat(channel['last_started'])).total_seconds()
-                    }
-                except:
-                    channel['stats'] = {'cpu_percent': 0, 'memory_percent': 0, 'uptime': 0}
+                    channel['stats']['uptime'] = (datetime.now() - 
+                        datetime.fromisoformat(channel['last_started'])).total_seconds()
+                except (TypeError, ValueError):
+                    channel['stats']['uptime'] = 0
+                channel['progress'] = self.progress.latest(channel_id)
+            
+            channel['next_schedule'] = self.schedule.next_event(channel_id)
+            channel['encoding'] = self.channel_encoding(channel_id, channel)
+            
+            # حالة كل دقة: كل الدقات تخرج من نفس العملية
+            if channel.get('renditions'):
+                channel['renditions'] = [
+                    dict(rendition, status=channel['status'], url=self.output_url(rendition))
+                    for rendition in channel['renditions']
+                ]
             
             return channel
         return None
+    
+    def get_all_channels_info(self):
+        """معلومات كل القنوات في مرور واحد على اللقطة المخزنة"""
+        return [self.get_channel_info(channel_id) for channel_id in list(self.channels)]
+    
+    def run_batch(self, action, channel_ids, concurrency=BATCH_DEFAULT_CONCURRENCY, **options):
+        """تنفيذ تشغيل/إيقاف مجموعة قنوات في الخلفية وإرجاع معرف المهمة"""
+        channel_ids = [cid for cid in channel_ids if cid in self.channels]
+        job = {
+            'job_id': uuid.uuid4().hex[:12],
+            'action': action,
+            'status': 'running',
+            'total': len(channel_ids),
+            'completed': 0,
+            'succeeded': 0,
+            'failed': 0,
+            'results': [],
+            'created_at': datetime.now().isoformat(),
+            'finished_at': None
+        }
+        pending = deque(channel_ids)
+        
+        with self._batch_lock:
+            self.batch_jobs[job['job_id']] = job
+            while len(self.batch_jobs) > BATCH_JOBS_RETAINED:
+                self.batch_jobs.popitem(last=False)
+        
+        def submit_next():
+            # كل مهمة منتهية تُطلق التالية، فلا يتجاوز التوازي الحد المطلوب
+            with self._batch_lock:
+                if not pending:
+                    return
+                channel_id = pending.popleft()
+            self.batch_executor.submit(run_one, channel_id)
+        
+        def run_one(channel_id):
+            try:
+                result = self.stop_channel(channel_id, options.get('force', False))
+            except Exception as e:
+                result = {'success': False, 'message': str(e)}
+            record(channel_id, result)
+            submit_next()
+        
+        def record(channel_id, result):
+            result = dict(result, channel_id=channel_id)
+            with self._batch_lock:
+                job['results'].append(result)
+                job['completed'] += 1
+                job['succeeded' if result.get('success') else 'failed'] += 1
+                completed = job['completed']
+                done = completed == job['total']
+                if done:
+                    job['status'] = 'done'
+                    job['finished_at'] = datetime.now().isoformat()
+            
+            socketio.emit('batch_progress', {
+                'job_id': job['job_id'],
+                'result': result,
+                'completed': completed,
+                'total': job['total']
+            })
+            if done:
+                socketio.emit('batch_done', self.get_batch_job(job['job_id'], include_results=False))
+        
+        if not channel_ids:
+            job['status'] = 'done'
+            job['finished_at'] = job['created_at']
+        
+        if action == 'start':
+            # التشغيل يمر عبر طابور التشغيل الذي يحدد المعدل والأولوية
+            for channel_id in channel_ids:
+                future = self.start_queue.submit(channel_id, 
+                                                 self.start_priority(self.channels.get(channel_id, {})))
+                future.add_done_callback(lambda f, cid=channel_id: record(cid, f.result()))
+        else:
+            for _ in range(max(1, min(concurrency, BATCH_MAX_WORKERS))):
+                submit_next()
+        
+        return job['job_id']
+    
+    def get_batch_job(self, job_id, include_results=True):
+        """حالة مهمة مجمّعة"""
+        with self._batch_lock:
+            job = self.batch_jobs.get(job_id)
+            if job is None:
+                return None
+            job = dict(job)
+            job['results'] = list(job['results']) if include_results else None
+            return job
+    
+    def mark_changed(self, *channel_ids, removed=False):
+        """تسجيل تغيير على قنوات وإرجاع رقم المراجعة السابق للتغيير"""
+        with self._revision_lock:
+            from_revision = self.revision
+            for channel_id in channel_ids:
+                self.revision += 1
+                self._changes.pop(channel_id, None)
+                self._changes[channel_id] = (self.revision, removed)
+            return from_revision
+    
+    def get_changes(self, since):
+        """القنوات المتغيرة والمحذوفة بعد مراجعة معينة - O(عدد التغييرات)"""
+        changed = []
+        removed = []
+        with self._revision_lock:
+            revision = self.revision
+            for channel_id in reversed(self._changes):
+                channel_revision, is_removed = self._changes[channel_id]
+                if channel_revision <= since:
+                    break
+                (removed if is_removed else changed).append(channel_id)
+        
+        channels = []
+        for channel_id in changed:
+            info = self.get_channel_info(channel_id)
+            if info:
+                channels.append(info)
+            else:
+                removed.append(channel_id)
+        
+        return {
+            'epoch': self.epoch,
+            'from_revision': since,
+            'revision': revision,
+            'channels': channels,
+            'removed': removed
+        }
+    
+    # ------------------------------------------------------------------
+    # عمليات كاملة تستدعيها الواجهات (محلياً أو عبر RPC من عمال الويب)
+    
+    def current_revision(self):
+        """(حقبة الإقلاع، رقم المراجعة الحالي)"""
+        return self.epoch, self.revision
+    
+    def has_channel(self, channel_id):
+        """هل القناة موجودة"""
+        return channel_id in self.channels
+    
+    def channel_count(self):
+        """عدد القنوات"""
+        return len(self.channels)
+    
+    def import_playlist(self, m3u8_url):
+        """استيراد قائمة مع بث التقدم للواجهات"""
+        def report_progress(parsed, done=False):
+            socketio.emit('import_progress', {'m3u8_url': m3u8_url, 'parsed': parsed, 'done': done})
+        
+        result = self.import_m3u8(m3u8_url, report_progress)
+        return dict(result, total=len(self.channels))
+    
+    def update_channel_config(self, channel_id, data):
+        """تحديث الإعدادات المسموح بها للقناة وحفظها"""
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            return {'success': False, 'message': 'القناة غير موجودة'}
+        
+        updatable_fields = ['enabled', 'auto_start', 'transcode', 'mode', 'output', 'schedule', 'priority', 'renditions', 'profile', 'stall_timeout']
+        if 'mode' in data and data['mode'] not in ENCODE_MODES:
+            return {'success': False, 'reason': 'invalid',
+                    'message': f"وضع ترميز غير صالح: {data['mode']} ({', '.join(ENCODE_MODES)})"}
+        if 'schedule' in data:
+            try:
+                CompiledSchedule(data['schedule'])
+            except (ValueError, TypeError, AttributeError) as e:
+                return {'success': False, 'reason': 'invalid', 'message': f'جدول غير صالح: {e}'}
+        if data.get('renditions'):
+            error = self.validate_renditions(data['renditions'])
+            if error:
+                return {'success': False, 'reason': 'invalid', 'message': f'دقات غير صالحة: {error}'}
+        
+        fields = {}
+        for field in updatable_fields:
+            if field in data:
+                if field == 'output':
+                    # مخرج جديد بدلاً من التعديل في المكان حتى لا يرى القراء مخرجاً نصف محدث
+                    fields['output'] = {**channel['output'], **data['output']}
+                else:
+                    fields[field] = data[field]
+        # تبديل transcode القديم يعني وضعاً يدوياً صريحاً
+        if 'transcode' in data and 'mode' not in data:
+            fields['mode'] = 'transcode' if data['transcode'] else 'copy'
+        
+        # مخرج مستخدم من قناة أخرى يُرفض قبل أي تعديل
+        if 'output' in fields or 'renditions' in fields:
+            conflicts = self.outputs.assign(channel_id, self.output_keys({**channel, **fields}))
+            if conflicts:
+                (address, port), owner = next(iter(conflicts.items()))
+                return {'success': False, 'reason': 'conflict',
+                        'message': f'المخرج {address}:{port} مستخدم من القناة {owner}'}
+        
+        self.update_channel(channel_id, **fields)
+        
+        # إذا تم تعطيل القناة، أوقفها إذا كانت تعمل
+        if not data.get('enabled', True):
+            self.stop_channel(channel_id)
+        
+        # إعادة بناء أحداث هذه القناة فقط
+        if {'schedule', 'enabled', 'auto_start'} & data.keys():
+            self.reschedule(channel_id)
+        
+        # فحص المصدر في الخلفية ليكون جاهزاً عند التشغيل التالي
+        if fields.get('mode') == 'auto':
+            self.prober.submit(channel['source_url'])
+        
+        self.save_channels(channel_id)
+        from_revision = self.mark_changed(channel_id)
+        socketio.emit('channels_delta', self.get_changes(from_revision))
+        
+        return {'success': True, 'channel': self.channel_snapshot(channel_id)}
+    
+    @staticmethod
+    def validate_renditions(renditions):
+        """سبب رفض قائمة الدقات أو None: كل دقة تحتاج resolution و bitrate ومخرجاً كاملاً"""
+        if not isinstance(renditions, list):
+            return 'يجب أن تكون قائمة'
+        for i, rendition in enumerate(renditions, 1):
+            if not isinstance(rendition, dict):
+                return f'الدقة {i} ليست كائناً'
+            if not RESOLUTION_RE.match(str(rendition.get('resolution', ''))):
+                return f"الدقة {i}: resolution غير صالح ({rendition.get('resolution')}، الصيغة WxH)"
+            if not (parse_bitrate(rendition.get('bitrate')) or 0) > 0:
+                return f"الدقة {i}: bitrate غير صالح ({rendition.get('bitrate')})"
+            if not rendition.get('address'):
+                return f'الدقة {i}: address مطلوب'
+            try:
+                port = int(rendition.get('port'))
+            except (TypeError, ValueError):
+                port = 0
+            if not 0 < port < 65536:
+                return f"الدقة {i}: port غير صالح ({rendition.get('port')})"
+        return None
+    
+    def delete_channel(self, channel_id):
+        """إيقاف القناة وحذفها مع ملفاتها"""
+        if channel_id not in self.channels:
+            return {'success': False, 'message': 'القناة غير موجودة'}
+        
+        # إيقاف القناة إذا كانت تعمل
+        self.stop_channel(channel_id)
+        
+        # لا تُحذف قناة في منتصف تشغيل أو إيقاف حتى لا تبقى عملية يتيمة
+        if self.channels[channel_id]['status'] in ('starting', 'stopping'):
+            return {'success': False, 'reason': 'busy', 'message': 'القناة في حالة انتقالية، حاول مجدداً'}
+        
+        self.remove_channel(channel_id)
+        self.schedule.remove(channel_id)
+        self.outputs.release(channel_id)
+        self._argv_cache.pop(channel_id, None)
+        self._encoding.pop(channel_id, None)
+        
+        # حذف ملفات القناة
+        self.remove_pid_file(channel_id)
+        log_path = channel_log_path(channel_id)
+        if os.path.exists(log_path):
+            os.remove(log_path)
+        
+        self.delete_channels(channel_id)
+        self.metrics.drop(channel_id)
+        self.progress.clear(channel_id)
+        CHANNEL_RESTARTS.remove(channel=channel_id)
+        CHANNEL_STALLS.remove(channel=channel_id)
+        from_revision = self.mark_changed(channel_id, removed=True)
+        socketio.emit('channels_delta', self.get_changes(from_revision))
+        
+        return {'success': True, 'message': 'تم حذف القناة'}
+    
+    def get_progress(self, channel_id, limit=None):
+        """آخر عينة تقدم مع تقييم الصحة وسلسلة العينات"""
+        return {
+            'channel_id': channel_id,
+            'latest': self.progress.latest(channel_id),
+            'history': self.progress.get_history(channel_id, limit)
+        }
+    
+    def emit_log_lines(self, channel_id, lines, offset):
+        """إرسال أسطر السجل الجديدة لكل متابعيه دفعة واحدة"""
+        socketio.emit('log_lines', {'channel_id': channel_id, 'lines': lines, 'offset': offset},
+                      to=f"logs:{channel_id}")
+    
+    def follow_log(self, channel_id, sid):
+        """اشتراك عميل في سجل قناة حي"""
+        return self.log_follower.follow(channel_id, sid)
+    
+    def unfollow_log(self, sid, channel_id=None):
+        """إلغاء اشتراك عميل"""
+        self.log_follower.unfollow(sid, channel_id)
+    
+    def list_encoder_profiles(self):
+        """ملفات الترميز مع البديل المستخدم فعلاً ونتائج القياس على هذا الخادم"""
+        benchmarks = load_benchmarks().get(os.uname().nodename, {})
+        profiles = {}
+        for name, profile in self.encoder_profiles.items():
+            resolved, _ = resolve_profile(self.encoder_profiles, name)
+            profiles[name] = dict(profile, resolved=resolved, benchmarks=[
+                result for key, result in benchmarks.items() if key.startswith(f"{name}@")])
+        return {'default': DEFAULT_PROFILE, 'profiles': profiles}
+    
+    def output_pools_report(self):
+        """استخدام مجمعات المخارج"""
+        return self.outputs.report()
+    
+    def queue_probes(self, channels):
+        """فحص مصادر القنوات الجديدة في الوضع التلقائي في الخلفية ليجدها أول تشغيل جاهزة"""
+        for channel in channels:
+            if self.configured_mode(channel) == 'auto':
+                self.prober.submit(channel['source_url'])
+    
+    def refresh_probes(self):
+        """فحص مصادر القنوات المفعلة في الوضع التلقائي التي قدمت نتائجها (في مجمع الفحص المحدود)"""
+        for channel in list(self.channels.values()):
+            if channel['enabled'] and self.configured_mode(channel) == 'auto':
+                cached = self.prober.get(channel['source_url'])
+                if cached is None or not self.prober.fresh(cached):
+                    self.prober.submit(channel['source_url'])
+    
+    def encoding_savings(self, channel_id, channel, stats=None):
+        """الأنوية الموفرة لقناة عاملة: كلفة الترميز الكامل المقدرة ناقص الاستهلاك المقاس"""
+        encoding = self._encoding.get(channel_id)
+        if encoding is None or channel['status'] != 'running':
+            return None
+        encoder_profile, _ = resolve_profile(self.encoder_profiles, channel.get('profile', DEFAULT_PROFILE))
+        transcode_cores = self.capacity.cost(
+            self.capacity.profile_key(dict(channel, encode_mode='transcode'), encoder_profile))
+        cpu_cores = stats['cpu_percent'] / 100.0 if stats else None
+        if encoding['mode'] == 'transcode' or cpu_cores is None:
+            saved_cores = 0.0
+        else:
+            saved_cores = max(0.0, transcode_cores - cpu_cores)
+        return {
+            'mode': encoding['mode'],
+            'cpu_cores': None if cpu_cores is None else round(cpu_cores, 3),
+            'transcode_cores': round(transcode_cores, 3),
+            'saved_cores': round(saved_cores, 3)
+        }
+    
+    def channel_encoding(self, channel_id, channel):
+        """الوضع المطلوب والفعلي ونتيجة فحص المصدر والتوفير لقناة"""
+        encoding = self._encoding.get(channel_id) if channel['status'] == 'running' else None
+        return {
+            'configured': self.configured_mode(channel),
+            'mode': encoding['mode'] if encoding else None,
+            'reason': encoding['reason'] if encoding else None,
+            'input_hints': encoding['hints'] if encoding else [],
+            'probe': self.prober.get(channel['source_url']),
+            'savings': self.encoding_savings(channel_id, channel, self.stats_sampler.get(channel_id))
+        }
+    
+    def probe_channel(self, channel_id, refresh=False):
+        """نتيجة فحص مصدر القناة والوضع الذي سيختاره الوضع التلقائي؛ refresh=True يفحص من جديد"""
+        channel = self.channel_snapshot(channel_id)
+        if channel is None:
+            return {'success': False, 'message': 'القناة غير موجودة'}
+        try:
+            probe = self.prober.submit(channel['source_url'], force=refresh).result(self.prober.timeout + 5)
+        except Exception as e:
+            return {'success': False, 'message': f'انتهت مهلة فحص المصدر: {e}'}
+        mode, reason = choose_mode(probe, self.get_outputs(channel))
+        return {'success': probe['ok'], 'probe': probe, 'auto_mode': mode, 'reason': reason,
+                'configured': self.configured_mode(channel), 'input_hints': input_hints(probe)}
+    
+    def encoding_report(self):
+        """توزيع القنوات العاملة على أوضاع الترميز والأنوية الموفرة، مع حالة مجمع الفحص"""
+        modes = {}
+        channels = []
+        total_saved = 0.0
+        for channel_id, channel in list(self.channels.items()):
+            savings = self.encoding_savings(channel_id, channel, self.stats_sampler.get(channel_id))
+            if savings is None:
+                continue
+            modes[savings['mode']] = modes.get(savings['mode'], 0) + 1
+            total_saved += savings['saved_cores']
+            channels.append({'channel_id': channel_id, 'name': channel['name'],
+                             'reason': self._encoding.get(channel_id, {}).get('reason'), **savings})
+        channels.sort(key=lambda c: c['saved_cores'], reverse=True)
+        return {'modes': modes, 'saved_cores': round(total_saved, 3),
+                'probes': self.prober.stats(), 'channels': channels}
+    
+    def capacity_report(self):
+        """سعة المعالج المحجوزة والمتاحة"""
+        return self.capacity.report()
+    
+    def start_queue_metrics(self):
+        """مقاييس طابور التشغيل"""
+        return self.start_queue.metrics()
+    
+    def profile_threads(self, seconds=10, interval=PROFILE_DEFAULT_INTERVAL, idle=False):
+        """عينات مكدسات خيوط المتحكم (مجدول، مراقب، طابور التشغيل...) بصيغة مطوية"""
+        return capture_profile(seconds, interval, idle)
+    
+    def backup_channels(self, backup_dir):
+        """تصدير القنوات كلقطة JSON في مجلد النسخة الاحتياطية"""
+        return self.store.snapshot(backup_dir)
 
-# إنشاء مدير القنوات
-channel_manager = ChannelManager()
+# إنشاء مدير القنوات (عمال الويب يستخدمون وكيلاً للمتحكم بدلاً من نسخة خاصة بهم)
+if IPTV_ROLE == 'web':
+    from controller import ControllerClient
+    channel_manager = ControllerClient(CONTROL_SOCKET)
+else:
+    channel_manager = ChannelManager()
 
 # ============================================================================
 # واجهات API
 # ============================================================================
 
+def push_web_metrics():
+    """إرسال فروق مقاييس هذا العامل إلى المتحكم؛ عند الفشل تُعاد لتُرسل مع الدفعة التالية"""
+    snapshot = WEB_METRICS.drain()
+    try:
+        channel_manager.push_web_metrics(f"{os.uname().nodename}:{os.getpid()}", snapshot)
+    except Exception as e:
+        WEB_METRICS.restore(snapshot)
+        logger.debug(f"تعذر دفع مقاييس العامل: {e}")
+
+def ensure_metrics_pusher():
+    """خيط دفع المقاييس لهذه العملية (يُنشأ بعد fork في كل عامل gunicorn)"""
+    global _metrics_pusher_pid
+    if _metrics_pusher_pid == os.getpid():
+        return
+    _metrics_pusher_pid = os.getpid()
+    
+    def run():
+        while True:
+            time.sleep(WEB_METRICS_PUSH_SECONDS)
+            push_web_metrics()
+    threading.Thread(target=run, name='metrics-push', daemon=True).start()
+
+@app.before_request
+def start_request_timer():
+    if INSTRUMENT:
+        ensure_metrics_pusher()
+        g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    """زمن الطلب لكل مسار (قالب المسار وليس الرابط الفعلي حتى يبقى عدد السلاسل محدوداً)"""
+    started = g.pop('request_started', None)
+    if INSTRUMENT and started is not None and request.url_rule is not None:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, method=request.method,
+                                     route=request.url_rule.rule, status=response.status_code)
+    return response
+
+def local_request():
+    """طلب من نفس الجهاز مباشرة (لا عبر وكيل عكسي يضيف ترويسات التمرير)"""
+    if request.headers.get('X-Forwarded-For') or request.headers.get('X-Real-IP'):
+        return False
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+if IPTV_ROLE != 'controller' and not METRICS_TOKEN:
+    logger.warning("IPTV_METRICS_TOKEN غير محدد: /metrics (بأسماء كل القنوات) يُخدم للطلبات المحلية فقط؛ "
+                   "خلف وكيل عكسي يجب أن يضيف X-Forwarded-For وإلا اضبط الرمز")
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """مقاييس Prometheus: المتحكم + طلبات ومقابس كل العمال (مجمعة في المتحكم)"""
+    if METRICS_TOKEN:
+        if request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+            return 'unauthorized\n', 401
+    elif not local_request():
+        return 'forbidden: set IPTV_METRICS_TOKEN for remote scrapes\n', 403
+    # فروق هذا العامل حتى الآن، والبقية حتى WEB_METRICS_PUSH_SECONDS
+    push_web_metrics()
+    text = channel_manager.render_metrics()
+    return app.response_class(text, content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/')
 @login_required
 def index():
@@ -500,14 +3022,19 @@ def logout():
 @login_required
 def system_info():
     """معلومات النظام"""
+    # بدون عمليات فرعية في مسار الطلب: psutil ونظام الملفات مباشرة، ونسخة FFmpeg مخزنة
+    uptime = int(time.time() - psutil.boot_time())
+    days, hours, minutes = uptime // 86400, uptime % 86400 // 3600, uptime % 3600 // 60
+    disk = shutil.disk_usage('/')
     info = {
         'hostname': os.uname().nodename,
         'system': os.uname().sysname,
         'release': os.uname().release,
         'python_version': sys.version,
-        'ffmpeg_version': subprocess.getoutput('ffmpeg -version | head -n1'),
-        'uptime': subprocess.getoutput('uptime -p'),
-        'disk_space': subprocess.getoutput('df -h /').split('\n')[1],
+        'ffmpeg_version': run_blocking(ffmpeg_version),
+        'uptime': f"up {days} days, {hours} hours, {minutes} minutes",
+        'disk_space': f"{disk.total / 1e9:.1f}G {disk.used / 1e9:.1f}G {disk.free / 1e9:.1f}G "
+                      f"{disk.used * 100 // disk.total}% /",
         'load_average': os.getloadavg()
     }
     return jsonify(info)
@@ -515,17 +3042,35 @@ def system_info():
 @app.route('/api/channels', methods=['GET'])
 @login_required
 def get_all_channels():
-    """جلب جميع القنوات"""
-    channels = []
-    for channel_id, channel in channel_manager.channels.items():
-        channel_info = channel_manager.get_channel_info(channel_id)
-        channels.append(channel_info)
+    """جلب جميع القنوات أو التغييرات فقط منذ مراجعة معينة (?epoch=<epoch>&since=<rev>)"""
+    epoch, revision = channel_manager.current_revision()
+    etag = f"{epoch}-{revision}"
     
-    return jsonify({
-        'count': len(channels),
-        'channels': channels,
-        'timestamp': datetime.now().isoformat()
-    })
+    # لا تغييرات منذ آخر طلب
+    if request.if_none_match.contains(etag):
+        return '', 304, {'ETag': f'"{etag}"'}
+    
+    # مراجعة من حقبة سابقة (أعيد تشغيل المتحكم) لا تقارن بالعداد الحالي: القائمة كاملة
+    since = request.args.get('since', type=int)
+    if request.args.get('epoch') == epoch and since is not None and 0 <= since <= revision:
+        response = jsonify({
+            **channel_manager.get_changes(since),
+            'full': False,
+            'timestamp': datetime.now().isoformat()
+        })
+    else:
+        channels = channel_manager.get_all_channels_info()
+        response = jsonify({
+            'count': len(channels),
+            'channels': channels,
+            'epoch': epoch,
+            'revision': revision,
+            'full': True,
+            'timestamp': datetime.now().isoformat()
+        })
+    
+    response.set_etag(etag)
+    return response
 
 @app.route('/api/channels/import', methods=['POST'])
 @login_required
@@ -534,25 +3079,48 @@ def import_channels():
     if current_user.role != 'admin':
         return jsonify({'success': False, 'message': 'صلاحيات غير كافية'}), 403
     
-    data = request.get_json()
-    m3u8_url = data.get('m3u8_url', 'http://192.168.3.2:800/playlist.m3u8')
-    
-    parsed_channels = channel_manager.parse_m3u8(m3u8_url)
+    data = request.get_json(silent=True) or {}
+    m3u8_url = data.get('m3u8_url') or PLAYLIST_URL
+    if not m3u8_url:
+        return jsonify({'success': False, 'message': 'رابط ملف M3U8 مطلوب'}), 400
     
-    # إضافة القنوات الجديدة
-    for channel in parsed_channels:
-        if channel['id'] not in channel_manager.channels:
-            channel_manager.channels[channel['id']] = channel
+    try:
+        result = channel_manager.import_playlist(m3u8_url)
+    except Exception as e:
+        logger.error(f"خطأ في تحليل M3U8: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 502
     
-    # حفظ التغييرات
-    channel_manager.save_channels()
+    if result.get('reason') == 'exhausted':
+        return jsonify({'success': False, **result}), 409
     
     return jsonify({
         'success': True,
-        'imported': len(parsed_channels),
-        'total': len(channel_manager.channels)
+        'parsed': result['parsed'],
+        'imported': result['added'],
+        'no_output': result['no_output'],
+        'total': result['total']
     })
 
+@app.route('/api/channels/sync', methods=['POST'])
+@login_required
+def sync_channels():
+    """مزامنة فورية مع قائمة المزود"""
+    if current_user.role != 'admin':
+        return jsonify({'success': False, 'message': 'صلاحيات غير كافية'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        result = channel_manager.sync_playlist(data.get('m3u8_url'))
+    except Exception as e:
+        logger.error(f"خطأ في مزامنة قائمة المزود: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 502
+    
+    if result.get('reason') == 'invalid':
+        return jsonify(result), 400
+    if result.get('reason') == 'exhausted':
+        return jsonify({'success': False, **result}), 409
+    return jsonify({'success': True, **result})
+
 @app.route('/api/channels/<channel_id>', methods=['GET'])
 @login_required
 def get_channel(channel_id):
@@ -562,6 +3130,25 @@ def get_channel(channel_id):
         return jsonify(channel_info)
     return jsonify({'success': False, 'message': 'القناة غير موجودة'}), 404
 
+@app.route('/api/channels/<channel_id>/progress')
+@login_required
+def get_channel_progress(channel_id):
+    """تقدم FFmpeg الحي للقناة (?limit=N لآخر N عينة)"""
+    if not channel_manager.has_channel(channel_id):
+        return jsonify({'success': False, 'message': 'القناة غير موجودة'}), 404
+    return jsonify(channel_manager.get_progress(channel_id, request.args.get('limit', type=int)))
+
+@app.route('/api/channels/<channel_id>/probe', methods=['GET', 'POST'])
+@login_required
+def probe_channel_source(channel_id):
+    """فحص مصدر القناة بـ ffprobe (GET من الذاكرة إن كانت صالحة، POST فحص جديد)"""
+    if request.method == 'POST' and current_user.role not in ['admin', 'operator']:
+        return jsonify({'success': False, 'message': 'صلاحيات غير كافية'}), 403
+    
+    if not channel_manager.has_channel(channel_id):
+        return jsonify({'success': False, 'message': 'القناة غير موجودة'}), 404
+    return jsonify(channel_manager.probe_channel(channel_id, refresh=request.method == 'POST'))
+
 @app.route('/api/channels/<channel_id>/start', methods=['POST'])
 @login_required
 def start_channel_api(channel_id):
@@ -569,7 +3156,7 @@ def start_channel_api(channel_id):
     if current_user.role not in ['admin', 'operator']:
         return jsonify({'success': False, 'message': 'صلاحيات غير كافية'}), 403
     
-    result = channel_manager.start_channel(channel_id)
+    result = channel_manager.request_start(channel_id)
     return jsonify(result)
 
 @app.route('/api/channels/<channel_id>/stop', methods=['POST'])
@@ -581,6 +3168,8 @@ def stop_channel_api(channel_id):
     
     force = request.get_json().get('force', False)
     result = channel_manager.stop_channel(channel_id, force)
+    if result.get('reason') == 'busy':
+        return jsonify(result), 409
     return jsonify(result)
 
 @app.route('/api/channels/<channel_id>', methods=['PUT'])
@@ -590,29 +3179,15 @@ def update_channel(channel_id):
     if current_user.role != 'admin':
         return jsonify({'success': False, 'message': 'صلاحيات غير كافية'}), 403
     
-    if channel_id not in channel_manager.channels:
+    if not channel_manager.has_channel(channel_id):
         return jsonify({'success': False, 'message': 'القناة غير موجودة'}), 404
     
-    data = request.get_json()
-    channel = channel_manager.channels[channel_id]
-    
-    # تحديث الإعدادات المسموح بها
-    updatable_fields = ['enabled', 'auto_start', 'transcode', 'output', 'schedule']
-    for field in updatable_fields:
-        if field in data:
-            if field == 'output':
-                channel['output'].update(data['output'])
-            else:
-                channel[field] = data[field]
-    
-    # إذا تم تعطيل القناة، أوقفها إذا كانت تعمل
-    if not data.get('enabled', True) and channel['status'] == 'running':
-        channel_manager.stop_channel(channel_id)
-    
-    # حفظ التغييرات
-    channel_manager.save_channels()
-    
-    return jsonify({'success': True, 'channel': channel})
+    result = channel_manager.update_channel_config(channel_id, request.get_json())
+    if result.get('reason') == 'invalid':
+        return jsonify(result), 400
+    if result.get('reason') == 'conflict':
+        return jsonify(result), 409
+    return jsonify(result)
 
 @app.route('/api/channels/<channel_id>', methods=['DELETE'])
 @login_required
@@ -621,73 +3196,63 @@ def delete_channel(channel_id):
     if current_user.role != 'admin':
         return jsonify({'success': False, 'message': 'صلاحيات غير كافية'}), 403
     
-    if channel_id not in channel_manager.channels:
+    if not channel_manager.has_channel(channel_id):
         return jsonify({'success': False, 'message': 'القناة غير موجودة'}), 404
     
-    # إيقاف القناة إذا كانت تعمل
-    if channel_manager.channels[channel_id]['status'] == 'running':
-        channel_manager.stop_channel(channel_id)
-    
-    # حذف القناة
-    del channel_manager.channels[channel_id]
-    
-    # حذف ملفات القناة
-    for file_type in ['.pid', '.log']:
-        file_path = os.path.join(PROCESS_DIR if file_type == '.pid' else LOG_DIR, 
-                                f"channel_{channel_id}{file_type}")
-        if os.path.exists(file_path):
-            os.remove(file_path)
-    
-    # حفظ التغييرات
-    channel_manager.save_channels()
-    
-    return jsonify({'success': True, 'message': 'تم حذف القناة'})
+    result = channel_manager.delete_channel(channel_id)
+    if not result['success']:
+        return jsonify(result), 409
+    return jsonify(result)
 
 @app.route('/api/batch/start', methods=['POST'])
 @login_required
 def batch_start():
-    """تشغيل مجموعة من القنوات"""
+    """تشغيل مجموعة من القنوات (مهمة في الخلفية)"""
     if current_user.role not in ['admin', 'operator']:
         return jsonify({'success': False, 'message': 'صلاحيات غير كافية'}), 403
     
     data = request.get_json()
     channel_ids = data.get('channels', [])
+    concurrency = int(data.get('concurrency', BATCH_DEFAULT_CONCURRENCY))
     
-    results = []
-    for channel_id in channel_ids:
-        if channel_id in channel_manager.channels:
-            result = channel_manager.start_channel(channel_id)
-            result['channel_id'] = channel_id
-            results.append(result)
+    job_id = channel_manager.run_batch('start', channel_ids, concurrency)
+    job = channel_manager.get_batch_job(job_id, include_results=False)
     
     return jsonify({
         'success': True,
-        'results': results,
-        'total': len(results)
-    })
+        'job_id': job_id,
+        'total': job['total']
+    }), 202
 
 @app.route('/api/batch/stop', methods=['POST'])
 @login_required
 def batch_stop():
-    """إيقاف مجموعة من القنوات"""
+    """إيقاف مجموعة من القنوات (مهمة في الخلفية)"""
     if current_user.role not in ['admin', 'operator']:
         return jsonify({'success': False, 'message': 'صلاحيات غير كافية'}), 403
     
     data = request.get_json()
     channel_ids = data.get('channels', [])
+    concurrency = int(data.get('concurrency', BATCH_DEFAULT_CONCURRENCY))
     
-    results = []
-    for channel_id in channel_ids:
-        if channel_id in channel_manager.channels:
-            result = channel_manager.stop_channel(channel_id)
-            result['channel_id'] = channel_id
-            results.append(result)
+    job_id = channel_manager.run_batch('stop', channel_ids, concurrency,
+                                       force=data.get('force', False))
+    job = channel_manager.get_batch_job(job_id, include_results=False)
     
     return jsonify({
         'success': True,
-        'results': results,
-        'total': len(results)
-    })
+        'job_id': job_id,
+        'total': job['total']
+    }), 202
+
+@app.route('/api/batch/<job_id>')
+@login_required
+def batch_status(job_id):
+    """حالة مهمة مجمّعة ونتائجها حتى الآن"""
+    job = channel_manager.get_batch_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'المهمة غير موجودة'}), 404
+    return jsonify(job)
 
 @app.route('/api/system/stats')
 @login_required
@@ -695,29 +3260,90 @@ def system_stats():
     """إحصائيات النظام"""
     return jsonify(channel_manager.update_system_stats())
 
+@app.route('/api/profiles')
+@login_required
+def encoder_profiles_list():
+    """ملفات الترميز المتاحة ونتائج قياسها على هذا الخادم"""
+    return jsonify(channel_manager.list_encoder_profiles())
+
+@app.route('/api/metrics')
+@login_required
+def query_metrics():
+    """سلاسل زمنية: ?channel=<id|system>&metric=a,b&from=&to=&step= (أوقات epoch أو سالبة نسبية)"""
+    entity = request.args.get('channel', 'system')
+    metrics = [m for m in request.args.get('metric', '').split(',') if m] or None
+    return jsonify(channel_manager.query_metrics(
+        entity, metrics,
+        request.args.get('from', type=float),
+        request.args.get('to', type=float),
+        request.args.get('step', type=float)
+    ))
+
+@app.route('/api/system/capacity')
+@login_required
+def capacity_stats():
+    """سعة المعالج المحجوزة والمتاحة لكل ملف تحويل"""
+    return jsonify(channel_manager.capacity_report())
+
+@app.route('/api/system/outputs')
+@login_required
+def output_pools_stats():
+    """استخدام مجمعات المخارج (عنوان، منفذ)"""
+    return jsonify(channel_manager.output_pools_report())
+
+@app.route('/api/system/encoding')
+@login_required
+def encoding_stats():
+    """أوضاع الترميز للقنوات العاملة والأنوية الموفرة بالنسخ المباشر"""
+    return jsonify(channel_manager.encoding_report())
+
+@app.route('/api/system/start-queue')
+@login_required
+def start_queue_stats():
+    """مقاييس طابور التشغيل"""
+    return jsonify(channel_manager.start_queue_metrics())
+
 @app.route('/api/logs/<channel_id>')
 @login_required
 def get_channel_logs(channel_id):
-    """الحصول على سجلات القناة"""
-    log_file = os.path.join(LOG_DIR, f"channel_{channel_id}.log")
+    """آخر أسطر سجل القناة (?lines=N) وصفحات أقدم (?before=<offset>)"""
+    log_file = channel_log_path(channel_id)
     
     if not os.path.exists(log_file):
-        return jsonify({'logs': []})
+        return jsonify({'logs': [], 'offset': 0, 'end': 0})
     
-    try:
-        with open(log_file, 'r', encoding='utf-8', errors='ignore') as f:
-            # آخر 100 سطر
-            lines = f.readlines()[-100:]
-        
-        logs = []
-        for line in lines:
-            logs.append(line.strip())
-        
-        return jsonify({'logs': logs})
+    lines = max(0, min(request.args.get('lines', LOG_TAIL_LINES, type=int), LOG_TAIL_MAX_LINES))
+    before = request.args.get('before', type=int)
     
+    try:
+        return jsonify(run_blocking(read_log_tail, log_file, lines, before))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/admin/profile')
+@login_required
+def profile_threads():
+    """التقاط عينات مكدسات لمدة محددة وإرجاعها كملف collapsed لـ flamegraph"""
+    if current_user.role != 'admin':
+        return jsonify({'success': False, 'message': 'صلاحيات غير كافية'}), 403
+    
+    seconds = request.args.get('seconds', 10, type=float)
+    interval = request.args.get('interval', PROFILE_DEFAULT_INTERVAL, type=float)
+    idle = request.args.get('idle') == '1'
+    # process=web يلتقط خيوط هذا العامل نفسه بدلاً من المتحكم
+    if request.args.get('process') == 'web':
+        result = run_blocking(capture_profile, seconds, interval, idle)
+    else:
+        result = channel_manager.profile_threads(seconds, interval, idle)
+    if not result['success']:
+        return jsonify(result), 409
+    
+    if request.args.get('format') == 'json':
+        return jsonify(result)
+    filename = f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.collapsed"
+    return app.response_class(result['collapsed'], content_type='text/plain; charset=utf-8',
+                              headers={'Content-Disposition': f'attachment; filename={filename}'})
+
 @app.route('/api/backup', methods=['POST'])
 @login_required
 def create_backup():
@@ -727,16 +3353,11 @@ def create_backup():
     
     try:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_dir = os.path.join(BASE_DIR, 'backups', timestamp)
+        backup_dir = os.path.join(BACKUP_DIR, timestamp)
         os.makedirs(backup_dir, exist_ok=True)
         
-        # نسخ ملفات التكوين
-        import shutil
-        shutil.copy(os.path.join(CONFIG_DIR, 'channels.json'), 
-                   os.path.join(backup_dir, 'channels.json'))
-        
-        # تصدير قاعدة البيانات (إذا كانت موجودة)
-        # ... إضافة كود التصدير ...
+        # تصدير القنوات من المخزن كلقطة JSON
+        channel_manager.backup_channels(backup_dir)
         
         return jsonify({
             'success': True,
@@ -754,21 +3375,42 @@ def create_backup():
 def handle_connect():
     """اتصال عميل جديد"""
     logger.info(f"عميل متصل: {request.sid}")
+    SOCKETIO_CLIENTS.inc()
     emit('connected', {'message': 'مرحباً في نظام IPTV'})
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """انفصال عميل"""
     logger.info(f"عميل منفصل: {request.sid}")
+    SOCKETIO_CLIENTS.dec()
+    channel_manager.unfollow_log(request.sid)
+
+@socketio.on('follow_logs')
+def handle_follow_logs(data):
+    """متابعة سجل قناة حياً (غرفة مشتركة لكل متابعي نفس السجل)"""
+    channel_id = (data or {}).get('channel_id')
+    if not channel_id or not current_user.is_authenticated:
+        return
+    join_room(f"logs:{channel_id}")
+    offset = channel_manager.follow_log(channel_id, request.sid)
+    emit('log_follow', {'channel_id': channel_id, 'offset': offset})
+
+@socketio.on('unfollow_logs')
+def handle_unfollow_logs(data):
+    """إيقاف متابعة سجل"""
+    channel_id = (data or {}).get('channel_id')
+    if not channel_id:
+        return
+    leave_room(f"logs:{channel_id}")
+    channel_manager.unfollow_log(request.sid, channel_id)
 
 @socketio.on('get_channels')
 def handle_get_channels():
     """إرسال قائمة القنوات للعميل"""
-    channels = []
-    for channel_id, channel in channel_manager.channels.items():
-        channels.append(channel_manager.get_channel_info(channel_id))
+    epoch, revision = channel_manager.current_revision()
+    channels = channel_manager.get_all_channels_info()
     
-    emit('channels_list', {'channels': channels})
+    emit('channels_list', {'channels': channels, 'epoch': epoch, 'revision': revision})
 
 # ============================================================================
 # تشغيل التطبيق
@@ -776,24 +3418,9 @@ def handle_get_channels():
 
 if __name__ == '__main__':
     # إنشاء المجلدات المطلوبة
-    for directory in [CONFIG_DIR, LOG_DIR, PROCESS_DIR, os.path.join(BASE_DIR, 'backups')]:
+    for directory in [CONFIG_DIR, LOG_DIR, PROCESS_DIR, BACKUP_DIR]:
         os.makedirs(directory, exist_ok=True)
     
-    # ملفات التكوين الافتراضية إذا لم تكن موجودة
-    default_config = {
-        'channels': [],
-        'system': {
-            'max_channels': 50,
-            'auto_backup': True,
-            'backup_retention_days': 30
-        }
-    }
-    
-    config_file = os.path.join(CONFIG_DIR, 'channels.json')
-    if not os.path.exists(config_file):
-        with open(config_file, 'w', encoding='utf-8') as f:
-            json.dump(default_config, f, indent=2, ensure_ascii=False)
-    
     # تشغيل التطبيق
     logger.info("بدء تشغيل نظام IPTV Manager...")
     socketio.run(app, 
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+اختبار حمل طبقة الويب: فتح آلاف مقابس SocketIO على مراحل وقياس
+ذاكرة الخادم (RSS) وعدد خيوطه وزمن استجابة HTTP والمقبس عند كل مرحلة
+
+مثال:
+    python3 bin/loadtest.py --url http://127.0.0.1:5000 --pid <gunicorn-master-pid> --steps 100,500,1000,2000
+"""
+
+import sys
+import json
+import time
+import argparse
+import resource
+import selectors
+import statistics
+
+import psutil
+import requests
+import websocket
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def server_usage(pid):
+    """مجموع RSS والخيوط للعملية الرئيسية وكل عمالها"""
+    try:
+        root = psutil.Process(pid)
+        procs = [root] + root.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return 0, 0
+    rss = threads = 0
+    for proc in procs:
+        try:
+            rss += proc.memory_info().rss
+            threads += proc.num_threads()
+        except psutil.NoSuchProcess:
+            pass
+    return rss, threads
+
+
+class SocketPool:
+    """مقابس engine.io خام (websocket) بدون خيط لكل مقبس: حلقة selectors واحدة ترد على ping"""
+
+    def __init__(self, ws_url, cookie):
+        self.ws_url = ws_url
+        self.cookie = cookie
+        self.sockets = []
+        self.selector = selectors.DefaultSelector()
+
+    def open(self):
+        ws = websocket.create_connection(self.ws_url, cookie=self.cookie, timeout=10)
+        ws.recv()            # حزمة الفتح من engine.io
+        ws.send('40')        # الاتصال بمساحة الأسماء الافتراضية
+        while not ws.recv().startswith('40'):
+            pass
+        ws.sock.setblocking(False)
+        self.selector.register(ws.sock, selectors.EVENT_READ, ws)
+        self.sockets.append(ws)
+        return ws
+
+    def pump(self, timeout=0):
+        """قراءة ما وصل والرد على ping حتى لا يغلق الخادم المقابس الخاملة"""
+        for key, _ in self.selector.select(timeout):
+            ws = key.data
+            try:
+                ws.sock.setblocking(True)
+                message = ws.recv()
+                ws.sock.setblocking(False)
+            except Exception:
+                self.selector.unregister(ws.sock)
+                self.sockets.remove(ws)
+                continue
+            if message == '2':
+                ws.send('3')
+
+    def round_trip(self, ws):
+        """زمن طلب get_channels حتى وصول channels_list (ms)"""
+        self.selector.unregister(ws.sock)
+        ws.sock.setblocking(True)
+        started = time.perf_counter()
+        ws.send('42' + json.dumps(['get_channels']))
+        while True:
+            message = ws.recv()
+            if message == '2':
+                ws.send('3')
+            elif message.startswith('42["channels_list"'):
+                break
+        elapsed = (time.perf_counter() - started) * 1000
+        ws.sock.setblocking(False)
+        self.selector.register(ws.sock, selectors.EVENT_READ, ws)
+        return elapsed
+
+    def close(self):
+        for ws in self.sockets:
+            try:
+                ws.close()
+            except Exception:
+                pass
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='loadtest.py')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--pid', type=int, help='PID الخادم (gunicorn master) لقياس الذاكرة')
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='admin123')
+    parser.add_argument('--steps', default='100,500,1000')
+    parser.add_argument('--samples', type=int, default=50, help='عدد طلبات القياس في كل مرحلة')
+    args = parser.parse_args(argv)
+
+    # كل مقبس = واصف ملف
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    session = requests.Session()
+    session.post(f"{args.url}/login", data={'username': args.username, 'password': args.password},
+                 allow_redirects=False)
+    cookie = '; '.join(f"{k}={v}" for k, v in session.cookies.items())
+    ws_url = args.url.replace('http', 'ws', 1) + '/socket.io/?EIO=4&transport=websocket'
+
+    pool = SocketPool(ws_url, cookie)
+    print(f"{'sockets':>8} {'rss_mb':>8} {'threads':>8} {'http_p50':>9} {'http_p95':>9} "
+          f"{'ws_p50':>8} {'ws_p95':>8}")
+
+    try:
+        for target in (int(step) for step in args.steps.split(',')):
+            while len(pool.sockets) < target:
+                pool.open()
+                if len(pool.sockets) % 50 == 0:
+                    pool.pump()
+
+            http_times, ws_times = [], []
+            for i in range(args.samples):
+                started = time.perf_counter()
+                session.get(f"{args.url}/api/channels")
+                http_times.append((time.perf_counter() - started) * 1000)
+                ws_times.append(pool.round_trip(pool.sockets[i % len(pool.sockets)]))
+                pool.pump()
+
+            rss, threads = server_usage(args.pid) if args.pid else (0, 0)
+            print(f"{len(pool.sockets):>8} {rss / 1048576:>8.1f} {threads:>8} "
+                  f"{statistics.median(http_times):>9.1f} {percentile(http_times, 95):>9.1f} "
+                  f"{statistics.median(ws_times):>8.1f} {percentile(ws_times, 95):>8.1f}")
+    finally:
+        pool.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+مخزن القنوات الدائم: SQLite بوضع WAL مع كتابة لكل قناة ولقطات مجدولة
+"""
+
+import os
+import json
+import glob
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger('IPTV-Manager')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS channels (
+    id         TEXT PRIMARY KEY,
+    port       INTEGER,
+    enabled    INTEGER NOT NULL DEFAULT 0,
+    data       TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_channels_port ON channels(port);
+CREATE INDEX IF NOT EXISTS idx_channels_enabled ON channels(enabled);
+"""
+
+
+class ChannelStore:
+    """تخزين القنوات كصفوف مستقلة: تعديل قناة واحدة = كتابة صف واحد"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # WAL: الكتابة ذرية ولا تحجب القراءة، وNORMAL كافٍ لعدم فقدان الاتساق عند الانهيار
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+
+    @staticmethod
+    def _row(channel, now):
+        return (channel['id'],
+                (channel.get('output') or {}).get('port'),
+                1 if channel.get('enabled') else 0,
+                json.dumps(channel, ensure_ascii=False, separators=(',', ':')),
+                now)
+
+    def count(self):
+        """عدد القنوات المخزنة"""
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM channels').fetchone()[0]
+
+    def load(self):
+        """تحميل جميع القنوات كقاموس id -> قناة"""
+        with self._lock:
+            rows = self._conn.execute('SELECT data FROM channels').fetchall()
+        channels = {}
+        for (data,) in rows:
+            channel = json.loads(data)
+            channels[channel['id']] = channel
+        return channels
+
+    def upsert(self, channels):
+        """إدراج أو تحديث مجموعة قنوات في معاملة واحدة"""
+        now = datetime.now().isoformat()
+        rows = [self._row(channel, now) for channel in channels]
+        if not rows:
+            return 0
+        with self._lock:
+            with self._transaction():
+                self._conn.executemany(
+                    'INSERT INTO channels (id, port, enabled, data, updated_at) VALUES (?, ?, ?, ?, ?) '
+                    'ON CONFLICT(id) DO UPDATE SET port=excluded.port, enabled=excluded.enabled, '
+                    'data=excluded.data, updated_at=excluded.updated_at',
+                    rows)
+        return len(rows)
+
+    def delete(self, *channel_ids):
+        """حذف قنوات بالمعرف"""
+        if not channel_ids:
+            return 0
+        with self._lock:
+            with self._transaction():
+                self._conn.executemany('DELETE FROM channels WHERE id = ?',
+                                       [(channel_id,) for channel_id in channel_ids])
+        return len(channel_ids)
+
+    @contextmanager
+    def _transaction(self):
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except Exception:
+            self._conn.execute('ROLLBACK')
+            raise
+        self._conn.execute('COMMIT')
+
+    def import_json(self, json_file):
+        """ترحيل channels.json القديم إلى المخزن (مرة واحدة عند أول تشغيل)"""
+        with open(json_file, 'r', encoding='utf-8') as f:
+            channels = json.load(f).get('channels', [])
+        return self.upsert(channels)
+
+    def snapshot(self, directory, retention=None):
+        """لقطة JSON كاملة للقنوات مع حذف اللقطات الأقدم من حد الاحتفاظ"""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'channels_backup_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json')
+        config = {
+            'last_updated': datetime.now().isoformat(),
+            'channels': list(self.load().values())
+        }
+
+        # كتابة ذرية: ملف مؤقت ثم إعادة تسمية، فلا تظهر لقطة مبتورة أبداً
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(config, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+        if retention:
+            snapshots = sorted(glob.glob(os.path.join(directory, 'channels_backup_*.json')))
+            for old in snapshots[:-retention]:
+                os.remove(old)
+
+        return path
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+المتحكم المركزي: عملية واحدة تملك القنوات وعمليات FFmpeg والجدولة،
+وتخدم عمال الويب عبر RPC على مقبس Unix (سطر JSON لكل طلب ورد)
+"""
+
+import os
+import sys
+import json
+import socket
+import logging
+import threading
+import socketserver
+
+logger = logging.getLogger('IPTV-Manager')
+
+RPC_TIMEOUT = float(os.environ.get('IPTV_RPC_TIMEOUT', 120))
+# استيراد ومزامنة قائمة بعشرات آلاف القنوات تتجاوز المهلة العادية، فلها مهلتها الخاصة
+RPC_LONG_TIMEOUT = float(os.environ.get('IPTV_RPC_LONG_TIMEOUT', 1800))
+RPC_LONG_METHODS = frozenset({'import_playlist', 'sync_playlist'})
+RPC_POOL_IDLE = int(os.environ.get('IPTV_RPC_POOL_IDLE', 16))
+
+
+# دوال ChannelManager التي يستدعيها عمال الويب؛ غيرها (adopt، write_pid_file...) لا يُكشف عبر المقبس
+RPC_METHODS = frozenset({
+    'backup_channels', 'capacity_report', 'current_revision', 'delete_channel', 'encoding_report',
+    'follow_log', 'get_all_channels_info', 'get_batch_job', 'get_changes', 'get_channel_info',
+    'get_progress', 'has_channel', 'import_playlist', 'list_encoder_profiles', 'output_pools_report',
+    'probe_channel', 'profile_threads', 'push_web_metrics', 'query_metrics', 'render_metrics',
+    'request_start', 'run_batch', 'start_queue_metrics', 'stop_channel', 'sync_playlist',
+    'unfollow_log', 'update_channel_config', 'update_system_stats',
+})
+
+
+class ControllerError(Exception):
+    """خطأ أثناء تنفيذ استدعاء في المتحكم أو تعذر الوصول إليه"""
+
+
+def _encode(value):
+    """ترميز القيم غير المدعومة في JSON (مجموعات، تواريخ...)"""
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    return str(value)
+
+
+class _RPCHandler(socketserver.StreamRequestHandler):
+    """اتصال عامل ويب واحد: عدة طلبات متتالية على نفس المقبس"""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                call = json.loads(line)
+                method = call['method']
+                # الدوال المسموح بها فقط؛ بقية دوال المدير وحالته الداخلية لا تُكشف عبر المقبس
+                if method not in RPC_METHODS or not callable(getattr(self.server.target, method, None)):
+                    raise AttributeError(f'دالة غير معروفة: {method}')
+                result = getattr(self.server.target, method)(*call.get('args', []), **call.get('kwargs', {}))
+                reply = {'result': result}
+            except Exception as e:
+                reply = {'error': f'{type(e).__name__}: {e}'}
+            self.wfile.write(json.dumps(reply, ensure_ascii=False, default=_encode).encode('utf-8') + b'\n')
+
+
+class _RPCServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(target, path):
+    """خدمة دوال RPC_METHODS لـ target على مقبس Unix (تحجب حتى الإيقاف)"""
+    if os.path.exists(path):
+        os.remove(path)
+    server = _RPCServer(path, _RPCHandler)
+    server.target = target
+    os.chmod(path, 0o660)
+    logger.info(f"المتحكم يستمع على {path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class ControllerClient:
+    """وكيل ChannelManager لعمال الويب: كل دالة في RPC_METHODS تُنفذ في المتحكم"""
+
+    def __init__(self, path, timeout=RPC_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        # مجمع اتصالات خاملة يُعاد استخدامها؛ عددها = أقصى عدد استدعاءات متزامنة فعلاً
+        # (وليس عدد الخيوط أو الـ greenlets، وهو ما يهم تحت gevent مع آلاف المقابس)
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.path)
+        return sock, sock.makefile('rb')
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._idle) < RPC_POOL_IDLE:
+                self._idle.append(conn)
+                return
+        self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        conn[1].close()
+        conn[0].close()
+
+    def call(self, method, *args, **kwargs):
+        """استدعاء دالة في المتحكم مع إعادة الاتصال مرة واحدة إذا كان الاتصال المخزن منقطعاً"""
+        request = json.dumps({'method': method, 'args': args, 'kwargs': kwargs},
+                             ensure_ascii=False, default=_encode).encode('utf-8') + b'\n'
+        timeout = RPC_LONG_TIMEOUT if method in RPC_LONG_METHODS else self.timeout
+        for attempt in (1, 2):
+            conn = None
+            try:
+                conn = self._acquire()
+                conn[0].settimeout(timeout)
+                conn[0].sendall(request)
+                line = conn[1].readline()
+                if not line:
+                    raise ConnectionError('أغلق المتحكم الاتصال')
+                break
+            except OSError as e:
+                if conn:
+                    self._close(conn)
+                # انتهاء المهلة يعني أن الطلب وصل وما زال يُنفذ: إعادة إرساله تنفذه مرتين
+                if attempt == 2 or isinstance(e, socket.timeout):
+                    raise ControllerError(f'تعذر الاتصال بالمتحكم ({self.path}): {e}')
+
+        self._release(conn)
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise ControllerError(reply['error'])
+        return reply['result']
+
+    def __getattr__(self, method):
+        if method not in RPC_METHODS:
+            raise AttributeError(method)
+        return lambda *args, **kwargs: self.call(method, *args, **kwargs)
+
+
+def main():
+    os.environ['IPTV_ROLE'] = 'controller'
+    import app
+
+    # التوقف النظيف عند SIGTERM من supervisor
+    import signal
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    if not app.MESSAGE_QUEUE:
+        logger.warning("IPTV_MESSAGE_QUEUE غير محدد: أحداث SocketIO من المتحكم لن تصل إلى عمال الويب")
+
+    serve(app.channel_manager, app.CONTROL_SOCKET)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+سجل ملفات الترميز (Encoder Profiles) وقياس أدائها على الخادم الحالي
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import resource
+import subprocess
+from datetime import datetime
+from functools import lru_cache
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_DIR = os.path.join(BASE_DIR, 'etc')
+PROFILES_FILE = os.path.join(CONFIG_DIR, 'encoder_profiles.json')
+BENCHMARKS_FILE = os.path.join(CONFIG_DIR, 'profile_benchmarks.json')
+
+DEFAULT_PROFILE = 'x264-veryfast'
+
+logger = logging.getLogger('IPTV-Manager')
+
+# الملفات المدمجة؛ يمكن تعديلها أو إضافة غيرها في etc/encoder_profiles.json
+DEFAULT_PROFILES = {
+    'x264-veryfast': {
+        'codec': 'libx264',
+        'preset': 'veryfast',
+        'tune': None,
+        'gop': 50,
+        'rate_control': 'abr',      # abr | cbr | vbv
+        'threads': None,            # None = حسب نموذج السعة
+        'audio': {'codec': 'aac', 'bitrate': '128k', 'channels': 2},
+        'cost_factor': 1.0
+    },
+    'x264-superfast': {
+        'codec': 'libx264',
+        'preset': 'superfast',
+        'tune': 'zerolatency',
+        'gop': 50,
+        'rate_control': 'vbv',
+        'threads': None,
+        'audio': {'codec': 'aac', 'bitrate': '96k', 'channels': 2},
+        'cost_factor': 0.7
+    },
+    'x264-ultrafast': {
+        'codec': 'libx264',
+        'preset': 'ultrafast',
+        'tune': 'zerolatency',
+        'gop': 50,
+        'rate_control': 'vbv',
+        'threads': None,
+        'audio': {'codec': 'aac', 'bitrate': '96k', 'channels': 2},
+        'cost_factor': 0.45
+    },
+    'nvenc': {
+        'codec': 'h264_nvenc',
+        'preset': 'p4',
+        'tune': 'll',
+        'gop': 50,
+        'rate_control': 'cbr',
+        'threads': 1,
+        'audio': {'codec': 'aac', 'bitrate': '128k', 'channels': 2},
+        'cost_factor': 0.15,
+        'fallback': 'x264-superfast'
+    },
+    'vaapi': {
+        'codec': 'h264_vaapi',
+        'preset': None,
+        'tune': None,
+        'gop': 50,
+        'rate_control': 'cbr',
+        'threads': 1,
+        'input_args': ['-vaapi_device', '/dev/dri/renderD128'],
+        'filter': 'format=nv12,hwupload',
+        'audio': {'codec': 'aac', 'bitrate': '128k', 'channels': 2},
+        'cost_factor': 0.2,
+        'fallback': 'x264-superfast'
+    }
+}
+
+
+def load_profiles(path=PROFILES_FILE):
+    """تحميل الملفات المدمجة مع تعديلات ملف التكوين"""
+    profiles = {name: dict(profile) for name, profile in DEFAULT_PROFILES.items()}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for name, overrides in json.load(f).get('profiles', {}).items():
+                profiles[name] = {**profiles.get(name, DEFAULT_PROFILES[DEFAULT_PROFILE]), **overrides}
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.error(f"خطأ في تحميل ملفات الترميز: {e}")
+    return profiles
+
+
+@lru_cache(maxsize=1)
+def available_encoders():
+    """المرمزات المتوفرة في FFmpeg المثبت (مجموعة فارغة إذا تعذر الفحص)"""
+    try:
+        output = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'],
+                                capture_output=True, text=True, timeout=10).stdout
+    except (OSError, subprocess.TimeoutExpired):
+        return frozenset()
+
+    encoders = set()
+    for line in output.splitlines():
+        parts = line.split()
+        # السطور بالشكل: " V....D libx264  libx264 H.264 ..."
+        if len(parts) >= 2 and len(parts[0]) == 6 and parts[0][0] in 'VAS':
+            encoders.add(parts[1])
+    return frozenset(encoders)
+
+
+_warned_fallbacks = set()
+
+
+def resolve_profile(profiles, name):
+    """الملف المطلوب أو أول بديل متوفر في سلسلة fallback"""
+    encoders = available_encoders()
+    seen = set()
+    current = name if name in profiles else DEFAULT_PROFILE
+
+    while current not in seen:
+        seen.add(current)
+        profile = profiles[current]
+        # إذا تعذر فحص المرمزات نفترض أنها متوفرة
+        if not encoders or profile['codec'] in encoders:
+            return current, profile
+        fallback = profile.get('fallback', DEFAULT_PROFILE)
+        if current not in _warned_fallbacks:
+            _warned_fallbacks.add(current)
+            logger.warning(f"المرمز {profile['codec']} غير متوفر، استخدام {fallback} بدلاً من {current}")
+        current = fallback if fallback in profiles else DEFAULT_PROFILE
+
+    return DEFAULT_PROFILE, profiles[DEFAULT_PROFILE]
+
+
+def parse_bitrate(bitrate):
+    """تحويل '800k' أو '2M' إلى بت/ثانية"""
+    value = str(bitrate).strip().lower()
+    multiplier = {'k': 1000, 'm': 1000000}.get(value[-1:], 1)
+    return int(float(value.rstrip('km')) * multiplier)
+
+
+def video_args(profile, bitrate, threads=None):
+    """خيارات ترميز الفيديو لملف ومعدل بت"""
+    args = ['-c:v', profile['codec']]
+    if profile.get('preset'):
+        args.extend(['-preset', profile['preset']])
+    if profile.get('tune'):
+        args.extend(['-tune', profile['tune']])
+    if profile.get('gop'):
+        args.extend(['-g', str(profile['gop'])])
+
+    threads = profile.get('threads') or threads
+    if threads is not None:
+        args.extend(['-threads', str(threads)])
+
+    args.extend(['-b:v', bitrate])
+    rate = parse_bitrate(bitrate)
+    if profile.get('rate_control') == 'cbr':
+        args.extend(['-minrate', bitrate, '-maxrate', bitrate, '-bufsize', str(rate * 2)])
+        if profile['codec'] == 'libx264':
+            args.extend(['-x264-params', 'nal-hrd=cbr'])
+    elif profile.get('rate_control') == 'vbv':
+        args.extend(['-maxrate', str(int(rate * 1.2)), '-bufsize', str(rate * 2)])
+
+    return args
+
+
+def audio_args(profile):
+    """خيارات ترميز الصوت"""
+    audio = profile.get('audio', {})
+    return ['-c:a', audio.get('codec', 'aac'),
+            '-b:a', audio.get('bitrate', '128k'),
+            '-ac', str(audio.get('channels', 2))]
+
+
+def benchmark_profile(name, profile, resolution='1280x720', duration=20, fps=25, bitrate='2500k'):
+    """ترميز مقطع اختباري (lavfi testsrc) وقياس معامل الزمن الحقيقي واستهلاك المعالج"""
+    cmd = ['ffmpeg', '-hide_banner', '-nostats', '-loglevel', 'error']
+    cmd += profile.get('input_args', [])
+    cmd += ['-f', 'lavfi', '-i', f"testsrc2=size={resolution}:rate={fps}",
+            '-f', 'lavfi', '-i', 'sine=frequency=1000:sample_rate=48000',
+            '-t', str(duration)]
+
+    video_filter = profile.get('filter')
+    if video_filter:
+        cmd += ['-vf', video_filter]
+    cmd += video_args(profile, bitrate) + audio_args(profile) + ['-f', 'null', '-']
+
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    started = time.monotonic()
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    wall = time.monotonic() - started
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    if result.returncode != 0:
+        return {'profile': name, 'success': False, 'error': result.stderr.strip()[-500:]}
+
+    cpu_seconds = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    return {
+        'profile': name,
+        'success': True,
+        'resolution': resolution,
+        'bitrate': bitrate,
+        'duration': duration,
+        'wall_seconds': round(wall, 2),
+        'realtime_factor': round(duration / wall, 2) if wall else None,
+        # الأنوية اللازمة للحفاظ على الزمن الحقيقي لقناة واحدة
+        'cpu_cores': round(cpu_seconds / duration, 3),
+        'timestamp': datetime.now().isoformat()
+    }
+
+
+def load_benchmarks(path=BENCHMARKS_FILE):
+    """نتائج القياس المسجلة لكل خادم"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_benchmark(result, path=BENCHMARKS_FILE):
+    """تسجيل نتيجة قياس تحت اسم الخادم الحالي"""
+    benchmarks = load_benchmarks(path)
+    host = benchmarks.setdefault(socket.gethostname(), {})
+    host[f"{result['profile']}@{result['resolution']}"] = result
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(benchmarks, f, indent=2, ensure_ascii=False)
+
+
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='encoder_profiles.py')
+    sub = parser.add_subparsers(dest='command', required=True)
+    bench = sub.add_parser('benchmark-profile', help='قياس أداء ملفات الترميز على هذا الخادم')
+    bench.add_argument('profiles', nargs='*', help='أسماء الملفات (الكل افتراضياً)')
+    bench.add_argument('--resolution', default='1280x720')
+    bench.add_argument('--bitrate', default='2500k')
+    bench.add_argument('--duration', type=int, default=20)
+    sub.add_parser('list', help='عرض ملفات الترميز المتاحة')
+    args = parser.parse_args(argv)
+
+    profiles = load_profiles()
+
+    if args.command == 'list':
+        for name in profiles:
+            resolved, _ = resolve_profile(profiles, name)
+            suffix = '' if resolved == name else f' -> {resolved}'
+            print(f"{name}: {profiles[name]['codec']}{suffix}")
+        return 0
+
+    for name in args.profiles or list(profiles):
+        if name not in profiles:
+            print(f"❌ ملف غير معروف: {name}")
+            continue
+        resolved, profile = resolve_profile(profiles, name)
+        if resolved != name:
+            print(f"⚠️  {name} غير متوفر على هذا الخادم، تم تخطيه")
+            continue
+
+        print(f"⏱  قياس {name} ({args.resolution}, {args.duration}s)...")
+        result = benchmark_profile(name, profile, args.resolution, args.duration, bitrate=args.bitrate)
+        if result['success']:
+            save_benchmark(result)
+            realtime = '✅' if result['realtime_factor'] >= 1 else '❌'
+            print(f"   {realtime} x{result['realtime_factor']} الزمن الحقيقي، {result['cpu_cores']} نواة")
+        else:
+            print(f"   ❌ فشل: {result['error']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
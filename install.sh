@@ -9,7 +9,7 @@ sudo apt update && sudo apt upgrade -y
 # 2. تثبيت المتطلبات
 sudo apt install -y \
     python3 python3-pip python3-venv \
-    ffmpeg nginx supervisor \
+    ffmpeg nginx supervisor redis-server \
     sqlite3 curl git
 
 # 3. إنشاء هيكل المجلدات
@@ -28,6 +28,13 @@ sudo cp -r /tmp/iptv-manager/* /opt/iptv-manager/
 sudo chown -R iptvmanager:iptvmanager /opt/iptv-manager
 sudo chmod +x /opt/iptv-manager/bin/*
 
+# 6.1 مفتاح جلسات خاص بهذا التثبيت يشترك فيه كل عمال الويب (لا يُستبدل عند إعادة التثبيت)
+if [ ! -s /opt/iptv-manager/etc/secret_key ]; then
+    python3 -c 'import secrets; print(secrets.token_hex(32))' | sudo tee /opt/iptv-manager/etc/secret_key > /dev/null
+    sudo chown iptvmanager:iptvmanager /opt/iptv-manager/etc/secret_key
+    sudo chmod 600 /opt/iptv-manager/etc/secret_key
+fi
+
 # 7. إنشاء بيئة Python
 cd /opt/iptv-manager
 python3 -m venv venv
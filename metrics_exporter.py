@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+مقاييس بصيغة Prometheus/OpenMetrics: عدادات ومقاييس ومدرجات بسيطة بدون اعتماديات،
+تُقرأ من الذاكرة فقط عند الجمع
+"""
+
+import time
+import bisect
+import threading
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labels):
+    """{'a': 1} -> '{a="1"}'"""
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}   # tuple(قيم التسميات) -> قيمة
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def remove(self, **labels):
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+    def export(self):
+        """القيم بصيغة JSON: [[قيم التسميات، قيمة]، ...]"""
+        with self._lock:
+            return [[list(key), self._copy(value)] for key, value in self._values.items()]
+    
+    def drain(self):
+        """تصدير القيم وتصفيرها (الفروق منذ آخر تصريف)؛ المقاييس اللحظية لا تُصفر"""
+        with self._lock:
+            values = [[list(key), value] for key, value in self._values.items()]
+            self._values = {}
+        return values
+    
+    def restore(self, values):
+        """إعادة فروق لم تصل (تصريف فشل إرساله)"""
+        with self._lock:
+            for key, value in values:
+                key = tuple(key)
+                self._values[key] = self._combine(self._values.get(key), value)
+    
+    def merged(self, exports):
+        """نسخة من المقياس بقيم مجموعة من عدة تصديرات"""
+        metric = self.__class__.__new__(self.__class__)
+        metric.__dict__.update(self.__dict__, _lock=threading.Lock(), _values={})
+        metric.restore([item for values in exports for item in values])
+        return metric
+    
+    @staticmethod
+    def _copy(value):
+        return value
+    
+    @staticmethod
+    def _combine(current, value):
+        return value if current is None else current + value
+    
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in items]
+
+    def render(self):
+        lines = self.header()
+        for name, labels, value in self.samples():
+            lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+    
+    def drain(self):
+        return self.export()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # عدّ لكل حد (غير تراكمي) + المجموع + العدد
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @staticmethod
+    def _copy(state):
+        return [list(state[0]), state[1], state[2]]
+    
+    @staticmethod
+    def _combine(current, state):
+        if current is None:
+            return [list(state[0]), state[1], state[2]]
+        current[0] = [a + b for a, b in zip(current[0], state[0])]
+        current[1] += state[1]
+        current[2] += state[2]
+        return current
+    
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        samples = []
+        for key, (counts, total, count) in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                samples.append((f'{self.name}_bucket', dict(labels, le=format_value(float(bound))), cumulative))
+            samples.append((f'{self.name}_sum', labels, round(total, 6)))
+            samples.append((f'{self.name}_count', labels, count))
+        return samples
+
+
+class Registry:
+    """مجموعة مقاييس + دوال جمع تُستدعى عند كل قراءة لحساب المقاييس من الحالة المخزنة"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, *args, **kwargs):
+        return self._add(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self._add(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self._add(Histogram(*args, **kwargs))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, func):
+        """func() -> قائمة مقاييس (تُبنى من الذاكرة فقط)"""
+        self._collectors.append(func)
+        return func
+
+    def drain(self):
+        """{اسم: فروق} لكل المقاييس (انظر _Metric.drain)"""
+        return {metric.name: metric.drain() for metric in self._metrics}
+    
+    def restore(self, snapshot):
+        for metric in self._metrics:
+            if metric.kind != 'gauge' and metric.name in snapshot:
+                metric.restore(snapshot[metric.name])
+    
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            for metric in collect():
+                lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class WorkerAggregator:
+    """مقاييس عدة عمليات (عمال gunicorn) مجمعة في عملية واحدة تخدم /metrics
+    
+    كل عامل يدفع دورياً ناتج Registry.drain(): العدادات والمدرجات فروق تُضاف إلى المجاميع،
+    والمقاييس اللحظية قيم كاملة لكل عامل تسقط إذا توقف عن الدفع (عامل انتهى أو أُعيد تشغيله).
+    """
+    
+    def __init__(self, registry, stale_after=30):
+        self.metrics = {metric.name: metric for metric in registry._metrics}
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        self._totals = {name: [] for name, metric in self.metrics.items() if metric.kind != 'gauge'}
+        self._gauges = {}   # عامل -> (وقت آخر دفع، {اسم: قيم})
+    
+    def push(self, worker, snapshot):
+        with self._lock:
+            gauges = {}
+            for name, values in snapshot.items():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue
+                if metric.kind == 'gauge':
+                    gauges[name] = values
+                elif values:
+                    self._totals[name] = metric.merged([self._totals[name], values]).export()
+            self._gauges[worker] = (time.monotonic(), gauges)
+    
+    def render(self):
+        now = time.monotonic()
+        with self._lock:
+            for worker, (pushed, _) in list(self._gauges.items()):
+                if now - pushed > self.stale_after:
+                    del self._gauges[worker]
+            live = [gauges for _, gauges in self._gauges.values()]
+            lines = []
+            for name, metric in self.metrics.items():
+                if metric.kind == 'gauge':
+                    exports = [gauges.get(name, []) for gauges in live]
+                else:
+                    exports = [self._totals[name]]
+                lines.extend(metric.merged(exports).render())
+        return '\n'.join(lines) + '\n'
+
+
+def parse_text(text):
+    """تحليل مبسط لصيغة النص: {(اسم، تسميات مرتبة): قيمة} (لأدوات المراقبة الداخلية)"""
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        head, _, value = line.rpartition(' ')
+        name, _, labels = head.partition('{')
+        pairs = []
+        for part in labels.rstrip('}').split('",'):
+            if '=' in part:
+                key, _, val = part.partition('=')
+                pairs.append((key, val.strip('"')))
+        try:
+            samples[(name, tuple(sorted(pairs)))] = float(value)
+        except ValueError:
+            pass
+    return samples
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+مخزن سلاسل زمنية مدمج: حلقات ثابتة الحجم (array) بثلاث دقات 1s → 1m → 1h
+لإحصائيات القنوات والنظام، بذاكرة محدودة مهما طال التشغيل
+"""
+
+import os
+import time
+import threading
+from array import array
+
+# (دقة الخانة بالثواني، عدد الخانات) لكل مستوى
+DEFAULT_TIERS = (
+    (1, int(os.environ.get('IPTV_METRICS_1S_SLOTS', 300))),       # 5 دقائق
+    (60, int(os.environ.get('IPTV_METRICS_1M_SLOTS', 1440))),     # يوم
+    (3600, int(os.environ.get('IPTV_METRICS_1H_SLOTS', 720))),    # 30 يوماً
+)
+
+MAX_POINTS = 2000
+
+
+class _Ring:
+    """مستوى واحد: خانة لكل فترة زمنية تحمل المجموع والعدد والأقصى"""
+
+    __slots__ = ('resolution', 'capacity', 'slots', 'sums', 'counts', 'maxima')
+
+    def __init__(self, resolution, capacity):
+        self.resolution = resolution
+        self.capacity = capacity
+        # أنواع مضغوطة: ~14 بايت لكل خانة
+        self.slots = array('I', [0]) * capacity      # رقم الفترة المخزنة في كل خانة (0 = فارغة)
+        self.sums = array('f', [0.0]) * capacity
+        self.counts = array('H', [0]) * capacity
+        self.maxima = array('f', [0.0]) * capacity
+
+    def add(self, t, value):
+        slot = int(t // self.resolution)
+        i = slot % self.capacity
+        if self.slots[i] != slot:
+            # الخانة تحمل فترة قديمة انتهت صلاحيتها: إعادة استخدامها (هكذا يبقى الحجم ثابتاً)
+            self.slots[i] = slot
+            self.sums[i] = value
+            self.counts[i] = 1
+            self.maxima[i] = value
+        else:
+            self.sums[i] += value
+            if self.counts[i] < 65535:
+                self.counts[i] += 1
+            if value > self.maxima[i]:
+                self.maxima[i] = value
+
+    def columns(self, first, end):
+        """نسخ الأعمدة (sums، counts، maxima) للفترات [first، end) بعمليات شرائح
+
+        خانات أُعيد استخدامها لفترات أخرى تُصفر في النسخة (عدد 0) فلا تدخل في التجميع.
+        """
+        sums, counts, maxima = array('f'), array('H'), array('f')
+        while first < end:
+            i = first % self.capacity
+            j = min(self.capacity, i + end - first)     # حتى نهاية الحلقة (بدون التفاف)
+            part_sums, part_counts, part_maxima = self.sums[i:j], self.counts[i:j], self.maxima[i:j]
+            stored, expected = self.slots[i:j], array('I', range(first, first + j - i))
+            if stored != expected:
+                for x in [x for x, (a, b) in enumerate(zip(stored, expected)) if a != b]:
+                    part_sums[x], part_counts[x], part_maxima[x] = 0.0, 0, float('-inf')
+            sums += part_sums
+            counts += part_counts
+            maxima += part_maxima
+            first += j - i
+        return sums, counts, maxima
+
+    def retention(self):
+        return self.resolution * self.capacity
+
+    def nbytes(self):
+        return sum(a.itemsize * len(a) for a in (self.slots, self.sums, self.counts, self.maxima))
+
+
+class TimeSeriesStore:
+    """سلاسل (كيان، مقياس): كل عينة تُضاف لكل المستويات فوراً فلا حاجة لمهام تجميع"""
+
+    def __init__(self, tiers=DEFAULT_TIERS):
+        self.tiers = tiers
+        self._lock = threading.Lock()
+        self._series = {}   # (entity, metric) -> [_Ring, ...]
+
+    def add(self, entity, metric, value, t=None):
+        """إضافة عينة"""
+        if value is None:
+            return
+        t = time.time() if t is None else t
+        key = (entity, metric)
+        with self._lock:
+            rings = self._series.get(key)
+            if rings is None:
+                rings = self._series[key] = [_Ring(res, cap) for res, cap in self.tiers]
+            for ring in rings:
+                ring.add(t, float(value))
+
+    def add_many(self, entity, values, t=None):
+        """إضافة عدة مقاييس لنفس الكيان بنفس الوقت"""
+        t = time.time() if t is None else t
+        for metric, value in values.items():
+            self.add(entity, metric, value, t)
+
+    def drop(self, entity):
+        """حذف كل سلاسل كيان (عند حذف القناة)"""
+        with self._lock:
+            for key in [key for key in self._series if key[0] == entity]:
+                del self._series[key]
+
+    def metrics(self, entity):
+        """أسماء المقاييس المسجلة لكيان"""
+        with self._lock:
+            return sorted(metric for e, metric in self._series if e == entity)
+
+    def query(self, entity, metric, start, end, step=None):
+        """نقاط [وقت، متوسط، أقصى] بين start وend مجمعة على خطوة step
+
+        يُختار أدق مستوى يغطي الفترة المطلوبة وخطوته لا تتجاوز step.
+        """
+        end = max(end, start)
+        if not step:
+            step = max(1, (end - start) / 300)
+        # عدد النقاط محدود مهما كانت الفترة
+        step = max(step, (end - start) / MAX_POINTS)
+
+        with self._lock:
+            rings = self._series.get((entity, metric))
+            if rings is None:
+                return {'resolution': None, 'step': step, 'points': []}
+
+            now = time.time()
+            ring = rings[-1]
+            for candidate in rings:
+                if candidate.resolution <= step and now - start <= candidate.retention():
+                    ring = candidate
+                    break
+
+            resolution = ring.resolution
+            step = max(resolution, int(step // resolution) * resolution)
+            first = int(start // resolution)
+            last = int(end // resolution)
+            first = max(first, last - ring.capacity + 1)
+            sums, counts, maxima = ring.columns(first, last + 1)
+
+        # كل نقطة = شريحة من per خانة متتالية تبدأ بمضاعف per (خانة واحدة: الأعمدة كما هي)
+        per = int(step // resolution)
+        if per == 1:
+            points = [[(first + x) * resolution, round(total / count, 3), round(peak, 3)]
+                      for x, (total, count, peak) in enumerate(zip(sums, counts, maxima)) if count]
+            return {'resolution': resolution, 'step': step, 'points': points}
+        points = []
+        for bucket_slot in range(first // per * per, last + 1, per):
+            a = max(bucket_slot, first) - first
+            b = min(bucket_slot + per, last + 1) - first
+            count = sum(counts[a:b])
+            if count:
+                points.append([bucket_slot * resolution, round(sum(sums[a:b]) / count, 3),
+                               round(max(maxima[a:b]), 3)])
+        return {'resolution': resolution, 'step': step, 'points': points}
+
+    def stats(self):
+        """عدد السلاسل والذاكرة المحجوزة"""
+        with self._lock:
+            return {
+                'series': len(self._series),
+                'bytes': sum(ring.nbytes() for rings in self._series.values() for ring in rings),
+                'tiers': [{'resolution': res, 'slots': cap} for res, cap in self.tiers]
+            }
@@ -1,32 +1,71 @@
 #!/usr/bin/env python3
 """
-سكريبت مراقبة النظام
+سكريبت مراقبة النظام (يقرأ نقطة /metrics بدلاً من مسح جدول العمليات)
 """
 
+import os
 import time
 import psutil
 import requests
 import json
 from datetime import datetime
 
+from metrics_exporter import parse_text
+
 class SystemMonitor:
-    def __init__(self, api_url="http://localhost:8080"):
+    def __init__(self, api_url="http://localhost:8080", metrics_token=os.environ.get('IPTV_METRICS_TOKEN')):
         self.api_url = api_url
+        self.metrics_token = metrics_token
         
     def check_system_health(self):
         """فحص صحة النظام"""
+        metrics = self.scrape_metrics()
         checks = {
             'timestamp': datetime.now().isoformat(),
-            'cpu_usage': psutil.cpu_percent(interval=1),
-            'memory_usage': psutil.virtual_memory().percent,
+            'cpu_usage': self.value(metrics, 'iptv_host', metric='cpu_percent'),
+            'memory_usage': self.value(metrics, 'iptv_host', metric='memory_percent'),
             'disk_usage': psutil.disk_usage('/').percent,
             'network_status': self.check_network(),
-            'ffmpeg_processes': self.count_ffmpeg_processes(),
-            'api_status': self.check_api()
+            'ffmpeg_processes': self.total(metrics, 'iptv_channel_up'),
+            'failed_channels': self.value(metrics, 'iptv_channels', status='failed') or 0,
+            'unhealthy_channels': self.count_slow_channels(metrics),
+            'api_status': metrics is not None
         }
         
         return checks
     
+    def scrape_metrics(self):
+        """قراءة /metrics وتحليلها (None إذا تعذر الوصول)"""
+        headers = {'Authorization': f'Bearer {self.metrics_token}'} if self.metrics_token else {}
+        try:
+            response = requests.get(f"{self.api_url}/metrics", headers=headers, timeout=3)
+            if response.status_code != 200:
+                return None
+            return parse_text(response.text)
+        except requests.RequestException:
+            return None
+    
+    @staticmethod
+    def value(metrics, name, **labels):
+        """قيمة عينة واحدة بتسمياتها الكاملة"""
+        if metrics is None:
+            return None
+        return metrics.get((name, tuple(sorted((k, str(v)) for k, v in labels.items()))))
+    
+    @staticmethod
+    def total(metrics, name):
+        """مجموع كل عينات المقياس"""
+        if metrics is None:
+            return None
+        return int(sum(value for (sample, _), value in metrics.items() if sample == name))
+    
+    @staticmethod
+    def count_slow_channels(metrics, min_speed=0.95):
+        """قنوات تعمل أبطأ من الزمن الحقيقي"""
+        if metrics is None:
+            return None
+        return sum(1 for (sample, _), value in metrics.items() if sample == 'iptv_channel_speed' and value < min_speed)
+    
     def check_network(self):
         """فحص الشبكة"""
         try:
@@ -41,22 +80,6 @@ class SystemMonitor:
             except:
                 return 'disconnected'
     
-    def count_ffmpeg_processes(self):
-        """عد عمليات FFmpeg"""
-        count = 0
-        for proc in psutil.process_iter(['name']):
-            if proc.info['name'] and 'ffmpeg' in proc.info['name'].lower():
-                count += 1
-        return count
-    
-    def check_api(self):
-        """فحص API"""
-        try:
-            response = requests.get(f"{self.api_url}/api/system/info", timeout=3)
-            return response.status_code == 200
-        except:
-            return False
-    
     def send_alert(self, message, level='warning'):
         """إرسال تنبيه"""
         webhook_url = "YOUR_WEBHOOK_URL"  # للـ Telegram أو Slack
@@ -84,12 +107,15 @@ class SystemMonitor:
                 f.write(json.dumps(health) + '\n')
             
             # إرسال تنبيهات إذا لزم
-            if health['cpu_usage'] > 80:
+            if health['cpu_usage'] is not None and health['cpu_usage'] > 80:
                 self.send_alert(f"استخدام CPU عالي: {health['cpu_usage']}%")
             
-            if health['memory_usage'] > 85:
+            if health['memory_usage'] is not None and health['memory_usage'] > 85:
                 self.send_alert(f"استخدام الذاكرة عالي: {health['memory_usage']}%")
             
+            if health['failed_channels']:
+                self.send_alert(f"قنوات متوقفة بسبب الانهيار المتكرر: {int(health['failed_channels'])}", 'critical')
+            
             if health['api_status'] == False:
                 self.send_alert("API غير متاح!", 'critical')
             
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+مخصص مخارج القنوات (عنوان، منفذ): مجمعات قابلة للإعداد بخريطة بتات وقائمة محررة،
+حجز وتحرير بزمن ثابت، ورفض أي مخرج مستخدم من قناة أخرى
+
+صيغة IPTV_OUTPUT_POOLS: مجمعات مفصولة بفواصل، كل مجمع "عناوين:منافذ"
+    239.255.100.1-239.255.100.254:6000-6015,10.0.0.5:7000-7999
+
+الافتراضي 254 عنواناً × 200 منفذ = 50800 مخرج (قوائم المزودين تصل إلى ~20 ألف قناة)
+"""
+
+import threading
+import ipaddress
+
+DEFAULT_OUTPUT_POOLS = '239.255.100.1-239.255.100.254:6000-6199'
+
+
+def _parse_range(text, parse):
+    first, _, last = text.partition('-')
+    first = parse(first.strip())
+    last = parse(last.strip()) if last else first
+    if last < first:
+        raise ValueError(f'نطاق غير صالح: {text}')
+    return first, last
+
+
+class OutputPool:
+    """نطاق عناوين × نطاق منافذ؛ الخانة i = (عنوان i % عدد العناوين، منفذ i // عدد العناوين)
+
+    العنوان يتغير أولاً فتحصل القنوات المتتالية على مجموعات بث مختلفة على نفس المنفذ.
+    """
+
+    def __init__(self, spec):
+        addresses, _, ports = spec.strip().rpartition(':')
+        if not addresses:
+            raise ValueError(f'مجمع غير صالح: {spec} (الصيغة عناوين:منافذ)')
+        self.name = spec.strip()
+        self.first_address, last_address = _parse_range(addresses, lambda a: int(ipaddress.IPv4Address(a)))
+        self.first_port, last_port = _parse_range(ports, int)
+        if not (0 < self.first_port and last_port <= 65535):
+            raise ValueError(f'منافذ خارج النطاق: {ports}')
+        self.addresses = last_address - self.first_address + 1
+        self.size = self.addresses * (last_port - self.first_port + 1)
+
+        self.used = bytearray(self.size)   # 1 = محجوزة
+        self.used_count = 0
+        self.cursor = 0                     # أول خانة لم تُستخدم قط
+        self.freed = []                     # خانات حُررت (قد تحوي خانات أعيد حجزها: تُتجاهل عند السحب)
+
+    def slot(self, address, port):
+        """رقم الخانة أو None إذا كان المخرج خارج المجمع"""
+        try:
+            offset = int(ipaddress.IPv4Address(address)) - self.first_address
+        except ValueError:
+            return None
+        index = port - self.first_port
+        if not (0 <= offset < self.addresses) or index < 0:
+            return None
+        slot = index * self.addresses + offset
+        return slot if slot < self.size else None
+
+    def output(self, slot):
+        address = str(ipaddress.IPv4Address(self.first_address + slot % self.addresses))
+        return address, self.first_port + slot // self.addresses
+
+    def take(self):
+        """أول خانة حرة: من المحررة أولاً ثم من المؤشر (كلاهما يتقدم فقط، فالكلفة ثابتة بالمتوسط)"""
+        while self.freed:
+            slot = self.freed.pop()
+            if not self.used[slot]:
+                return slot
+        while self.cursor < self.size:
+            slot = self.cursor
+            self.cursor += 1
+            if not self.used[slot]:
+                return slot
+        return None
+
+    def mark(self, slot, used):
+        if self.used[slot] == used:
+            return
+        self.used[slot] = used
+        self.used_count += 1 if used else -1
+        if not used:
+            self.freed.append(slot)
+
+
+class OutputAllocator:
+    """مالك كل مخرج (عنوان، منفذ) مستخدم، داخل المجمعات أو خارجها (إعداد يدوي)"""
+
+    def __init__(self, pools=DEFAULT_OUTPUT_POOLS):
+        self.pools = [OutputPool(spec) for spec in pools.split(',') if spec.strip()]
+        self._lock = threading.Lock()
+        self._owners = {}       # (address, port) -> channel_id
+        self._channels = {}     # channel_id -> {(address, port), ...}
+
+    @staticmethod
+    def key(output):
+        """مفتاح المخرج أو None إذا لم يُحدد بعد"""
+        if not output or not output.get('address') or not output.get('port'):
+            return None
+        return str(output['address']), int(output['port'])
+
+    def _locate(self, key):
+        for pool in self.pools:
+            slot = pool.slot(*key)
+            if slot is not None:
+                return pool, slot
+        return None, None
+
+    def _mark(self, key, used):
+        pool, slot = self._locate(key)
+        if pool is not None:
+            pool.mark(slot, used)
+
+    def conflicts(self, channel_id, keys):
+        """المخارج المطلوبة المستخدمة من قنوات أخرى: {(address, port): owner}"""
+        with self._lock:
+            return {key: self._owners[key] for key in keys
+                    if self._owners.get(key, channel_id) != channel_id}
+
+    def assign(self, channel_id, keys):
+        """استبدال مخارج القناة كلها ذرياً؛ يُرجع التعارضات ولا يغير شيئاً إذا وُجدت"""
+        keys = set(keys)
+        with self._lock:
+            conflicts = {key: self._owners[key] for key in keys
+                         if self._owners.get(key, channel_id) != channel_id}
+            if conflicts:
+                return conflicts
+            old = self._channels.pop(channel_id, set())
+            for key in old - keys:
+                del self._owners[key]
+                self._mark(key, 0)
+            for key in keys - old:
+                self._owners[key] = channel_id
+                self._mark(key, 1)
+            if keys:
+                self._channels[channel_id] = keys
+            return {}
+
+    def allocate(self, channel_id):
+        """حجز مخرج جديد للقناة من أول مجمع فيه خانة حرة، أو None عند الامتلاء"""
+        with self._lock:
+            for pool in self.pools:
+                slot = pool.take()
+                if slot is None:
+                    continue
+                key = pool.output(slot)
+                pool.mark(slot, 1)
+                self._owners[key] = channel_id
+                self._channels.setdefault(channel_id, set()).add(key)
+                return key
+        return None
+
+    def release(self, channel_id):
+        """تحرير كل مخارج القناة"""
+        with self._lock:
+            for key in self._channels.pop(channel_id, ()):
+                del self._owners[key]
+                self._mark(key, 0)
+
+    def free(self):
+        """عدد الخانات الحرة في كل المجمعات"""
+        with self._lock:
+            return sum(pool.size - pool.used_count for pool in self.pools)
+    
+    def owner(self, address, port):
+        return self._owners.get((str(address), int(port)))
+
+    def report(self):
+        """نسبة استخدام كل مجمع وعدد المخارج اليدوية خارج المجمعات"""
+        with self._lock:
+            pools = [{
+                'pool': pool.name,
+                'size': pool.size,
+                'used': pool.used_count,
+                'free': pool.size - pool.used_count,
+                'utilization': round(pool.used_count / pool.size, 4) if pool.size else 0
+            } for pool in self.pools]
+            pooled = sum(pool['used'] for pool in pools)
+            return {'pools': pools, 'outputs': len(self._owners), 'outside_pools': len(self._owners) - pooled}
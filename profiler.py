@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+محلل أداء بالعينات عند الطلب: يلتقط مكدسات كل الخيوط عبر sys._current_frames
+ويُرجعها بصيغة المكدسات المطوية (collapsed) المتوافقة مع flamegraph.pl وspeedscope
+"""
+
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+PROFILE_MAX_SECONDS = 60
+PROFILE_DEFAULT_INTERVAL = 0.01     # 100 عينة في الثانية
+PROFILE_MAX_DEPTH = 128
+
+
+class ProfilerBusy(Exception):
+    """التقاط آخر قيد التنفيذ"""
+
+
+class SamplingProfiler:
+    """لا شيء يعمل خارج الالتقاط: لا خطافات ولا خيوط، فالكلفة صفر حين لا يُستخدم"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _frame_label(frame):
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def _stack(self, frame):
+        """المكدس من الجذر إلى الإطار الحالي"""
+        labels = []
+        while frame is not None and len(labels) < PROFILE_MAX_DEPTH:
+            labels.append(self._frame_label(frame))
+            frame = frame.f_back
+        labels.reverse()
+        return labels
+
+    def capture(self, seconds=10, interval=PROFILE_DEFAULT_INTERVAL, idle=False):
+        """أخذ عينات لمدة seconds وإرجاع {'collapsed', 'samples', 'threads', 'seconds'}
+
+        idle=False يستبعد الخيوط المنتظرة (select/wait/sleep) التي تملأ الرسم دون فائدة.
+        """
+        seconds = max(0.1, min(float(seconds), PROFILE_MAX_SECONDS))
+        interval = max(0.001, float(interval))
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy('يوجد التقاط آخر قيد التنفيذ')
+
+        try:
+            me = threading.get_ident()
+            stacks = Counter()
+            samples = 0
+            seen_threads = set()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    if not idle and self._is_idle(frame):
+                        continue
+                    stack = self._stack(frame)
+                    thread_name = names.get(ident, f'thread-{ident}')
+                    seen_threads.add(thread_name)
+                    stacks[';'.join([thread_name] + stack)] += 1
+                frame = None    # لا نُبقي إطارات الخيوط الأخرى حية أثناء النوم
+                samples += 1
+                time.sleep(interval)
+        finally:
+            self._lock.release()
+
+        collapsed = '\n'.join(f'{stack} {count}' for stack, count in stacks.most_common())
+        return {
+            'collapsed': collapsed + '\n' if collapsed else '',
+            'samples': samples,
+            'threads': sorted(seen_threads),
+            'seconds': seconds,
+            'interval': interval
+        }
+
+    @staticmethod
+    def _is_idle(frame):
+        """الإطار الأعلى داخل انتظار معروف (threading/selectors/queue/socketserver)"""
+        filename = os.path.basename(frame.f_code.co_filename)
+        return (filename in ('threading.py', 'selectors.py', 'queue.py', 'socketserver.py')
+                or frame.f_code.co_name in ('wait', 'select', 'poll', 'sleep', 'accept', 'readinto'))
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+محرك جدولة القنوات: كل جدول يُترجم إلى موعد الحدث التالي (تشغيل/إيقاف) في كومة واحدة،
+وخيط واحد ينام حتى أقرب موعد بالضبط؛ كلفة كل تنبيه بعدد الأحداث المستحقة لا بعدد القنوات
+
+صيغة الجدول (متوافقة مع القديمة):
+    {'daily': True, 'start_time': '06:00', 'stop_time': '02:00',     # نافذة قد تعبر منتصف الليل
+     'days': ['sun', 'mon', ...],          # أيام بداية النافذة (الافتراضي كل الأيام)
+     'timezone': 'Asia/Riyadh',            # الافتراضي IPTV_TIMEZONE أو توقيت النظام
+     'events': [{'at': '2026-10-20T21:00', 'action': 'start'}]}   # أحداث لمرة واحدة
+"""
+
+import os
+import heapq
+import logging
+import threading
+from datetime import datetime, time as dtime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+logger = logging.getLogger('IPTV-Manager')
+
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+ACTIONS = ('start', 'stop')
+LOOKAHEAD_DAYS = 8      # أسبوع كامل + يوم لنوافذ تعبر منتصف الليل
+
+
+def default_timezone():
+    """IPTV_TIMEZONE أو منطقة النظام (/etc/localtime) أو UTC"""
+    name = os.environ.get('IPTV_TIMEZONE')
+    if name:
+        return ZoneInfo(name)
+    try:
+        with open('/etc/localtime', 'rb') as f:
+            return ZoneInfo.from_file(f, key='localtime')
+    except OSError:
+        return ZoneInfo('UTC')
+
+
+def _parse_time(value):
+    try:
+        hours, minutes = str(value).split(':')[:2]
+        return dtime(int(hours), int(minutes))
+    except ValueError:
+        raise ValueError(f'وقت غير صالح: {value} (الصيغة HH:MM)')
+
+
+def _parse_day(value):
+    if isinstance(value, int) and 0 <= value <= 6:
+        return value
+    day = str(value).strip().lower()[:3]
+    if day not in WEEKDAYS:
+        raise ValueError(f'يوم غير صالح: {value}')
+    return WEEKDAYS.index(day)
+
+
+class CompiledSchedule:
+    """جدول قناة بعد التحقق منه، يحسب حالة النافذة والحدث التالي"""
+
+    def __init__(self, schedule, tz=None):
+        schedule = schedule or {}
+        try:
+            self.tz = ZoneInfo(schedule['timezone']) if schedule.get('timezone') else (tz or default_timezone())
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"منطقة زمنية غير معروفة: {schedule.get('timezone')}")
+
+        self.daily = bool(schedule.get('daily', False))
+        self.start_time = _parse_time(schedule.get('start_time', '00:00'))
+        self.stop_time = _parse_time(schedule.get('stop_time', '23:59'))
+        days = schedule.get('days')
+        self.days = frozenset(_parse_day(day) for day in days) if days else frozenset(range(7))
+
+        self.events = []
+        for event in schedule.get('events') or []:
+            action = event.get('action')
+            if action not in ACTIONS:
+                raise ValueError(f'إجراء غير صالح: {action}')
+            try:
+                at = datetime.fromisoformat(event['at'])
+            except (KeyError, TypeError, ValueError):
+                raise ValueError(f"موعد غير صالح: {event.get('at')}")
+            if at.tzinfo is None:
+                at = at.replace(tzinfo=self.tz)
+            self.events.append((at.timestamp(), action))
+        self.events.sort()
+
+    def _windows(self, now):
+        """النوافذ (بداية، نهاية) بالثواني حول now، مع دمج المتلاصقة (جدول 24 ساعة = نافذة واحدة)"""
+        if not self.daily or not self.days:
+            return []
+        today = datetime.fromtimestamp(now, self.tz).date()
+        windows = []
+        for offset in range(-1, LOOKAHEAD_DAYS):
+            day = today + timedelta(days=offset)
+            if day.weekday() not in self.days:
+                continue
+            start = datetime.combine(day, self.start_time, self.tz)
+            # وقت إيقاف قبل وقت التشغيل أو مساوٍ له = ينتهي في اليوم التالي
+            stop_day = day if self.stop_time > self.start_time else day + timedelta(days=1)
+            stop = datetime.combine(stop_day, self.stop_time, self.tz)
+            # نافذة تقع كلها في فجوة التوقيت الصيفي تصبح فارغة
+            if stop.timestamp() > start.timestamp():
+                windows.append([start.timestamp(), stop.timestamp()])
+
+        merged = []
+        for window in windows:
+            if merged and window[0] <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], window[1])
+            else:
+                merged.append(window)
+        return merged
+
+    def active(self, now):
+        """هل now داخل نافذة تشغيل"""
+        return any(start <= now < stop for start, stop in self._windows(now))
+
+    def next_event(self, now):
+        """(موعد، إجراء) لأول حدث بعد now أو None"""
+        candidates = []
+        for start, stop in self._windows(now):
+            if start > now:
+                candidates.append((start, 'start'))
+            if stop > now and self.active(stop):
+                # نافذة مدمجة قطعها أفق الحساب: نهايتها الحقيقية من النوافذ حول موعد القطع
+                stop = next((end for begin, end in self._windows(stop) if begin <= stop < end), None)
+                if stop is None or self.active(stop):
+                    continue    # نوافذ متلاصقة كل أيام الأسبوع = تشغيل دائم بلا إيقاف
+            if stop > now:
+                candidates.append((stop, 'stop'))
+        for at, action in self.events:
+            if at > now:
+                candidates.append((at, action))
+                break
+        return min(candidates) if candidates else None
+
+
+class ScheduleEngine:
+    """كومة (موعد، قناة، إجراء) مع إبطال كسول: تعديل الجدول يرفع جيل القناة فتُتجاهل أحداثها القديمة"""
+
+    def __init__(self, on_fire, clock=None):
+        self.on_fire = on_fire
+        self.clock = clock or (lambda: datetime.now().timestamp())
+        self._cond = threading.Condition()
+        self._heap = []         # (موعد، seq، channel_id، إجراء، جيل)
+        self._seq = 0
+        self._schedules = {}    # channel_id -> (CompiledSchedule, جيل)
+        self._next = {}         # channel_id -> (موعد، إجراء)
+        self._generation = 0
+        self._thread = threading.Thread(target=self._run, name='schedule', daemon=True)
+        self._thread.start()
+
+    def update(self, channel_id, schedule, reconcile=True):
+        """(إعادة) جدولة قناة؛ reconcile=True يطبق حالة النافذة الحالية فوراً"""
+        compiled = CompiledSchedule(schedule)
+        now = self.clock()
+        with self._cond:
+            self._generation += 1
+            generation = self._generation
+            self._schedules[channel_id] = (compiled, generation)
+            self._push(channel_id, compiled, generation, now)
+            self._cond.notify()
+        if reconcile and compiled.daily:
+            self.on_fire(channel_id, 'start' if compiled.active(now) else 'stop')
+
+    def remove(self, channel_id):
+        """إلغاء جدولة قناة (أحداثها في الكومة تُتجاهل عند حلولها)"""
+        with self._cond:
+            self._schedules.pop(channel_id, None)
+            self._next.pop(channel_id, None)
+
+    def next_event(self, channel_id):
+        """{'at': ISO, 'action'} للحدث التالي للقناة"""
+        event = self._next.get(channel_id)
+        if event is None:
+            return None
+        compiled = self._schedules.get(channel_id, (None,))[0]
+        tz = compiled.tz if compiled else None
+        return {'at': datetime.fromtimestamp(event[0], tz).isoformat(), 'action': event[1]}
+
+    def pending(self):
+        """عدد القنوات المجدولة وحجم الكومة"""
+        with self._cond:
+            return {'channels': len(self._schedules), 'heap': len(self._heap)}
+
+    def _push(self, channel_id, compiled, generation, now):
+        event = compiled.next_event(now)
+        if event is None:
+            self._next.pop(channel_id, None)
+            return
+        self._seq += 1
+        heapq.heappush(self._heap, (event[0], self._seq, channel_id, event[1], generation))
+        self._next[channel_id] = event
+
+    def _run(self):
+        while True:
+            due = []
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                now = self.clock()
+                if self._heap[0][0] > now:
+                    self._cond.wait(self._heap[0][0] - now)
+                    continue
+                while self._heap and self._heap[0][0] <= now:
+                    at, _, channel_id, action, generation = heapq.heappop(self._heap)
+                    current = self._schedules.get(channel_id)
+                    if current is None or current[1] != generation:
+                        continue    # جدول محذوف أو معدل
+                    due.append((channel_id, action))
+                    self._push(channel_id, current[0], generation, at)
+            for channel_id, action in due:
+                try:
+                    self.on_fire(channel_id, action)
+                except Exception as e:
+                    logger.error(f"خطأ في تنفيذ حدث الجدولة {action} للقناة {channel_id}: {e}")
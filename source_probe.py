@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+فحص مصادر القنوات بـ ffprobe: تزامن محدود، ذاكرة نتائج بمدة صلاحية، واختيار وضع الترميز
+(نسخ مباشر، ترميز الصوت فقط، أو ترميز كامل) وتلميحات فتح المدخل للتشغيل
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+import subprocess
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger('IPTV-Manager')
+
+PROBE_CONCURRENCY = int(os.environ.get('IPTV_PROBE_CONCURRENCY', 4))
+PROBE_TTL = int(os.environ.get('IPTV_PROBE_TTL', 6 * 3600))
+PROBE_ERROR_TTL = 300           # فشل الفحص يُخزن مدة أقصر قبل إعادة المحاولة
+PROBE_TIMEOUT = 15
+PROBE_ANALYZE_SECONDS = 5       # تحليل كامل مرة واحدة هنا بدلاً من كل تشغيل
+HINT_ANALYZE_SECONDS = 1        # ما يكفي FFmpeg عند التشغيل بعد معرفة المصدر
+HINT_MIN_PROBESIZE = 256 * 1024
+HINT_MAX_PROBESIZE = 5 * 1024 * 1024
+
+ENCODE_MODES = ('auto', 'copy', 'audio', 'transcode')
+COPY_VIDEO_CODECS = ('h264',)
+COPY_AUDIO_CODECS = ('aac',)
+COPY_MAX_BITRATE_RATIO = 1.5    # مصدر أعلى من الهدف بأكثر من هذا يُعاد ترميزه
+
+
+def parse_bitrate(value):
+    """'800k' / '2M' / 800000 -> kbps"""
+    if value in (None, ''):
+        return None
+    text = str(value).strip().lower()
+    try:
+        if text.endswith('k'):
+            return float(text[:-1])
+        if text.endswith('m'):
+            return float(text[:-1]) * 1000
+        return float(text) / 1000
+    except ValueError:
+        return None
+
+
+def _rate(value):
+    """'25/1' -> 25.0"""
+    try:
+        num, _, den = str(value).partition('/')
+        return round(float(num) / float(den or 1), 3) if float(den or 1) else None
+    except ValueError:
+        return None
+
+
+def parse_probe(data):
+    """ملخص مخرجات ffprobe -print_format json"""
+    video = audio = None
+    for stream in data.get('streams', []):
+        if stream.get('codec_type') == 'video' and video is None:
+            video = {
+                'codec': stream.get('codec_name'),
+                'profile': stream.get('profile'),
+                'width': stream.get('width'),
+                'height': stream.get('height'),
+                'fps': _rate(stream.get('avg_frame_rate')) or _rate(stream.get('r_frame_rate')),
+                'pix_fmt': stream.get('pix_fmt'),
+                'bitrate_kbps': parse_bitrate(stream.get('bit_rate'))
+            }
+        elif stream.get('codec_type') == 'audio' and audio is None:
+            audio = {
+                'codec': stream.get('codec_name'),
+                'channels': stream.get('channels'),
+                'sample_rate': stream.get('sample_rate'),
+                'bitrate_kbps': parse_bitrate(stream.get('bit_rate'))
+            }
+    fmt = data.get('format', {})
+    return {
+        'ok': video is not None or audio is not None,
+        'format': fmt.get('format_name'),
+        'bitrate_kbps': parse_bitrate(fmt.get('bit_rate')),
+        'video': video,
+        'audio': audio
+    }
+
+
+def choose_mode(probe, outputs):
+    """(الوضع، السبب) لقناة في الوضع التلقائي حسب نتيجة الفحص ومخرجاتها"""
+    if not probe or not probe.get('ok'):
+        return 'transcode', 'لا توجد نتيجة فحص صالحة للمصدر'
+    if len(outputs) > 1:
+        return 'transcode', 'دقات متعددة'
+    video, audio, target = probe.get('video'), probe.get('audio'), outputs[0]
+    if video is None:
+        return 'transcode', 'لا يوجد مسار فيديو'
+    if video['codec'] not in COPY_VIDEO_CODECS:
+        return 'transcode', f"مرمز الفيديو {video['codec']}"
+    if f"{video['width']}x{video['height']}" != target.get('resolution'):
+        return 'transcode', f"الدقة {video['width']}x{video['height']} بدلاً من {target.get('resolution')}"
+    source_bitrate = video.get('bitrate_kbps') or probe.get('bitrate_kbps')
+    target_bitrate = parse_bitrate(target.get('bitrate'))
+    if source_bitrate and target_bitrate and source_bitrate > target_bitrate * COPY_MAX_BITRATE_RATIO:
+        return 'transcode', f"معدل المصدر {source_bitrate:.0f}k أعلى من الهدف {target_bitrate:.0f}k"
+    if audio is not None and audio['codec'] not in COPY_AUDIO_CODECS:
+        return 'audio', f"مرمز الصوت {audio['codec']}"
+    return 'copy', 'المصدر مطابق للمخرج (H.264/AAC بنفس الدقة)'
+
+
+def input_hints(probe):
+    """خيارات فتح المدخل لمصدر معروف: تحليل أقصر بدلاً من افتراضي FFmpeg (5 ثوانٍ/5MB)"""
+    if not probe or not probe.get('ok'):
+        return []
+    bitrate = probe.get('bitrate_kbps') or 4000
+    probesize = int(bitrate * 1000 / 8 * HINT_ANALYZE_SECONDS)
+    probesize = max(HINT_MIN_PROBESIZE, min(HINT_MAX_PROBESIZE, probesize))
+    return ['-analyzeduration', str(HINT_ANALYZE_SECONDS * 1000000), '-probesize', str(probesize)]
+
+
+class SourceProber:
+    """فحوصات ffprobe في مجمع محدود، مع دمج الطلبات المتزامنة لنفس الرابط"""
+
+    def __init__(self, concurrency=PROBE_CONCURRENCY, ttl=PROBE_TTL, timeout=PROBE_TIMEOUT):
+        self.ttl = ttl
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='probe')
+        self._lock = threading.Lock()
+        self._cache = {}        # url -> نتيجة
+        self._inflight = {}     # url -> Future
+        self.probes_total = 0
+        self.failures_total = 0
+
+    def fresh(self, result):
+        ttl = self.ttl if result.get('ok') else PROBE_ERROR_TTL
+        return time.time() - result['probed_at'] < ttl
+
+    def get(self, url):
+        """آخر نتيجة مخزنة (حتى لو انتهت صلاحيتها) بدون فحص"""
+        return self._cache.get(url)
+
+    def submit(self, url, force=False):
+        """Future بنتيجة الفحص: من الذاكرة إن كانت صالحة، أو فحص جارٍ، أو فحص جديد"""
+        with self._lock:
+            cached = self._cache.get(url)
+            if cached and not force and self.fresh(cached):
+                future = Future()
+                future.set_result(cached)
+                return future
+            future = self._inflight.get(url)
+            if future is None:
+                future = self._inflight[url] = self._executor.submit(self._probe, url)
+            return future
+
+    def lookup(self, url):
+        """نتيجة للتشغيل بدون انتظار أبداً: المخزنة (حتى القديمة)، أو None؛ الفحص الناقص يُطلق في الخلفية"""
+        cached = self._cache.get(url)
+        if cached is None or not self.fresh(cached):
+            self.submit(url)
+        return cached
+
+    def forget(self, url):
+        with self._lock:
+            self._cache.pop(url, None)
+
+    def stats(self):
+        with self._lock:
+            return {'cached': len(self._cache), 'inflight': len(self._inflight),
+                    'probes_total': self.probes_total, 'failures_total': self.failures_total}
+
+    def _probe(self, url):
+        cmd = ['ffprobe', '-v', 'error', '-hide_banner', '-print_format', 'json',
+               '-show_streams', '-show_format',
+               '-analyzeduration', str(PROBE_ANALYZE_SECONDS * 1000000), '-probesize', str(HINT_MAX_PROBESIZE),
+               '-rw_timeout', str(self.timeout * 1000000), url]
+        started = time.monotonic()
+        try:
+            output = subprocess.run(cmd, capture_output=True, text=True, timeout=self.timeout)
+            if output.returncode != 0:
+                raise RuntimeError(output.stderr.strip().splitlines()[-1] if output.stderr.strip()
+                                   else f'ffprobe exit {output.returncode}')
+            result = parse_probe(json.loads(output.stdout or '{}'))
+            if not result['ok']:
+                result['error'] = 'لا توجد مسارات فيديو أو صوت'
+        except (OSError, ValueError, RuntimeError, subprocess.TimeoutExpired) as e:
+            result = {'ok': False, 'error': str(e) or type(e).__name__}
+        result['probed_at'] = time.time()
+        result['probe_seconds'] = round(time.monotonic() - started, 3)
+
+        with self._lock:
+            self._cache[url] = result
+            self._inflight.pop(url, None)
+            self.probes_total += 1
+            if not result['ok']:
+                self.failures_total += 1
+        if not result['ok']:
+            logger.warning(f"فشل فحص المصدر {url}: {result['error']}")
+        return result
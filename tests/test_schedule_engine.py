@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from schedule_engine import CompiledSchedule
+
+UTC = ZoneInfo('UTC')
+NOW = datetime(2026, 10, 17, 12, 0, tzinfo=UTC).timestamp()
+
+
+def walk(compiled, now=NOW, days=60):
+    """الأحداث المتتالية لمدة days مع التحقق من اتساقها مع active()"""
+    events = []
+    end = now + days * 86400
+    while True:
+        event = compiled.next_event(now)
+        if event is None or event[0] > end:
+            return events
+        at, action = event
+        assert compiled.active(at) == (action == 'start'), datetime.fromtimestamp(at, UTC)
+        events.append((datetime.fromtimestamp(at, UTC), action))
+        now = at
+
+
+def test_full_day_window_never_stops():
+    for start, stop in (('06:00', '06:00'), ('00:00', '00:00')):
+        compiled = CompiledSchedule({'daily': True, 'start_time': start, 'stop_time': stop}, tz=UTC)
+        assert compiled.active(NOW)
+        assert compiled.next_event(NOW) is None
+        assert walk(compiled) == []
+
+
+def test_back_to_back_windows_stop_at_real_end():
+    compiled = CompiledSchedule({'daily': True, 'start_time': '06:00', 'stop_time': '06:00',
+                                 'days': ['mon', 'tue', 'wed', 'thu', 'fri', 'sat']}, tz=UTC)
+    events = walk(compiled)
+    assert events[:2] == [(datetime(2026, 10, 18, 6, 0, tzinfo=UTC), 'stop'),
+                          (datetime(2026, 10, 19, 6, 0, tzinfo=UTC), 'start')]
+    assert [action for _, action in events] == ['stop', 'start'] * (len(events) // 2)
+    assert all(at.weekday() == 6 for at, action in events if action == 'stop')
+
+
+def test_chain_crossing_horizon_is_not_cut():
+    # من الأربعاء يقطع الأفق سلسلة الاثنين-الجمعة التالية يوم الخميس بدلاً من نهايتها السبت
+    compiled = CompiledSchedule({'daily': True, 'start_time': '06:00', 'stop_time': '06:00',
+                                 'days': ['mon', 'tue', 'wed', 'thu', 'fri']}, tz=UTC)
+    events = walk(compiled, now=datetime(2026, 10, 21, 12, 0, tzinfo=UTC).timestamp(), days=14)
+    assert events[:3] == [(datetime(2026, 10, 24, 6, 0, tzinfo=UTC), 'stop'),
+                          (datetime(2026, 10, 26, 6, 0, tzinfo=UTC), 'start'),
+                          (datetime(2026, 10, 31, 6, 0, tzinfo=UTC), 'stop')]